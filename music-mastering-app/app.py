@@ -1,27 +1,54 @@
 import os
-import sqlite3
 import re
 import base64
+import hashlib
 import io
+import json
 import matplotlib
 matplotlib.use('Agg')  # Usar backend não-interativo
 import matplotlib.pyplot as plt
 import numpy as np
-import librosa
 import soundfile as sf
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, send_from_directory
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 from datetime import datetime
 import traceback
 from functools import wraps
 import uuid
-from pedalboard import Pedalboard, Compressor, Gain, Limiter, HighpassFilter, LowpassFilter
+from jobs import JobManager, report_progress, JOB_QUEUED, JOB_DONE, JOB_FAILED
+from audio_cache import DecodedAudioCache, decode_audio
+from stage_cache import StageCache, stage_key
+from chain_presets import load_presets, BoardPool, StageBoard
+from audio_io import as_channels_first, frame_count, write_audio
+from streaming import stream_master_file, stream_process_file, process_block
+from waveform_peaks import PeakPyramidBuilder, build_peaks, save_peaks, load_or_build_peaks, peaks_path
+from content_store import store_stream, content_hash, result_key, restore_result, store_result, upload_path, find_upload, link_or_copy, MASTERING_PARAM_DEFAULTS
+import db
+from dashboard_cache import DashboardCache
+from storage_index import StorageIndex
+from retention import RetentionSweeper
+from audio_probe import AudioProbe, UploadError
+from chunked_upload import UploadManager, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE
+from normalization import normalize_in_place
+from renditions import RENDITION_FORMATS, negotiate_format, get_rendition
+from exports import ExportManager, EXPORT_FORMATS, parse_export_settings, export_filename
+from batch import BatchManager, BATCH_MAX_TRACKS
+from loudness import (LoudnessMeter, meter_file, album_target_loudness, save_loudness,
+                      load_or_measure_loudness)
+from loudness_target import (parse_loudness_target, has_loudness_target, proxy_rate, ProxyBuilder,
+                             CalibrationBuilder, calibration_ranges, solve_target, output_trim,
+                             TARGET_LUFS_RANGE, DEFAULT_MAX_TRUE_PEAK)
+from reference_analysis import (feature_cache, resolved_params_cache, resolved_params_key, derive_params,
+                                match_gain, is_silent)
 
 
 app = Flask(__name__)
 app.secret_key = 'sua_chave_secreta_aqui'
+# Limite do corpo da requisição: o formulário pode levar música + referência
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 2 * MAX_UPLOAD_BYTES + 1024 * 1024))
 
 # Configuração do Flask-Login
 login_manager = LoginManager()
@@ -29,6 +56,61 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Por favor, faça login para acessar esta página.'
 
+# Fila de jobs de masterização (pool de processos iniciado sob demanda)
+job_manager = JobManager()
+
+# Cache de áudio decodificado para os ajustes em /masterize
+audio_cache = DecodedAudioCache()
+
+# Cache do sinal antes do Gain: ajustes só de gain/limiter não recalculam compressor e EQ
+stage_cache = StageCache()
+
+# Presets da cadeia de masterização (validados aqui: um preset inválido impede a
+# inicialização) e pool de boards montadas, reaproveitadas entre renders
+chain_presets = load_presets()
+board_pool = BoardPool(chain_presets)
+
+# Cache curto dos dados do dashboard por usuário
+dashboard_cache = DashboardCache()
+
+# Índice dos arquivos presentes em uploads/ (evita os.path.exists por linha do banco)
+storage_index = StorageIndex()
+
+# Uploads em blocos retomáveis para arquivos grandes
+chunked_uploads = UploadManager()
+
+# Exportações do master em outros formatos/taxas (pool de processos + cache em disco)
+export_manager = ExportManager()
+
+# Lotes de masterização (álbuns): as faixas rodam como jobs no mesmo pool
+batch_manager = BatchManager(job_manager, on_complete=lambda batch: record_batch_songs(batch))
+
+# Retenção/coleta de lixo de uploads/ e static/results/ em segundo plano
+retention_sweeper = RetentionSweeper(on_sweep=lambda stats: (storage_index.reconcile(), dashboard_cache.clear()))
+
+# Configuração do modo preview de /masterize
+PREVIEW_DEFAULT_SECONDS = 15
+PREVIEW_MAX_SECONDS = 30
+PREVIEW_PREROLL_SECONDS = 1.0
+PREVIEW_FORMATS = {
+    'ogg': ('OGG', 'VORBIS', 'audio/ogg'),
+    'mp3': ('MP3', 'MPEG_LAYER_III', 'audio/mpeg')
+}
+
+# Waveforms em PNG têm nome pelo hash do conteúdo, então podem ficar em cache por 1 ano
+WAVEFORM_RESULTS_DIR = os.path.join('static', 'results')
+WAVEFORM_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Versão do áudio nas URLs de /audio (prefixo do SHA-256 do conteúdo)
+AUDIO_VERSION_LENGTH = 32
+AUDIO_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Faixas acima desta duração são masterizadas em blocos (motor de streaming)
+STREAMING_THRESHOLD_SECONDS = float(os.environ.get('STREAMING_THRESHOLD_SECONDS', 600))
+
+def parse_bool(value):
+    return str(value if value is not None else '').lower() in ('1', 'true', 'yes', 'on')
+
 # Classe User para Flask-Login
 class User(UserMixin):
     def __init__(self, id, nome, email, senha_hash):
@@ -41,107 +123,115 @@ class User(UserMixin):
 def init_db():
     try:
         print("Inicializando banco de dados...")
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Verifica se a tabela já existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        if not cursor.fetchone():
-            print("Criando tabela 'users'...")
-            cursor.execute('''
-                CREATE TABLE users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    nome TEXT NOT NULL,
-                    email TEXT UNIQUE NOT NULL,
-                    senha_hash TEXT NOT NULL
-                )
-            ''')
-            conn.commit()
-            print("Tabela 'users' criada com sucesso!")
-        else:
-            print("Tabela 'users' já existe!")
-        
-        # Criar tabela para tutoriais assistidos
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='tutorials_watched'")
-        if not cursor.fetchone():
-            print("Criando tabela 'tutorials_watched'...")
-            cursor.execute('''
-                CREATE TABLE tutorials_watched (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    tutorial_id TEXT NOT NULL,
-                    watched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    progress INTEGER DEFAULT 0,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            conn.commit()
-            print("Tabela 'tutorials_watched' criada com sucesso!")
-        
-        # Criar tabela para músicas masterizadas
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='mastered_songs'")
-        if not cursor.fetchone():
-            print("Criando tabela 'mastered_songs'...")
-            cursor.execute('''
-                CREATE TABLE mastered_songs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    session_id TEXT NOT NULL,
-                    original_filename TEXT NOT NULL,
-                    mastered_filename TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    status TEXT DEFAULT 'completed',
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            conn.commit()
-            print("Tabela 'mastered_songs' criada com sucesso!")
-        
-        # Criar tabela para downloads
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='downloads'")
-        if not cursor.fetchone():
-            print("Criando tabela 'downloads'...")
-            cursor.execute('''
-                CREATE TABLE downloads (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    file_type TEXT NOT NULL,
-                    filename TEXT NOT NULL,
-                    downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            conn.commit()
-            print("Tabela 'downloads' criada com sucesso!")
+        with db.connect() as conn:
+            cursor = conn.cursor()
         
-        # Criar tabela para solicitações de ghost producer
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='ghost_producer_requests'")
-        if not cursor.fetchone():
-            print("Criando tabela 'ghost_producer_requests'...")
-            cursor.execute('''
-                CREATE TABLE ghost_producer_requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    package TEXT NOT NULL,
-                    genre TEXT NOT NULL,
-                    description TEXT,
-                    budget REAL,
-                    deadline TEXT,
-                    status TEXT DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    completed_at TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            conn.commit()
-            print("Tabela 'ghost_producer_requests' criada com sucesso!")
+            # Verifica se a tabela já existe
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
+            if not cursor.fetchone():
+                print("Criando tabela 'users'...")
+                cursor.execute('''
+                    CREATE TABLE users (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        nome TEXT NOT NULL,
+                        email TEXT UNIQUE NOT NULL,
+                        senha_hash TEXT NOT NULL
+                    )
+                ''')
+                print("Tabela 'users' criada com sucesso!")
+            else:
+                print("Tabela 'users' já existe!")
         
-        # Verifica a estrutura da tabela
-        cursor.execute("PRAGMA table_info(users)")
-        columns = cursor.fetchall()
-        print(f"Colunas na tabela: {[col[1] for col in columns]}")
+            # Criar tabela para tutoriais assistidos
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='tutorials_watched'")
+            if not cursor.fetchone():
+                print("Criando tabela 'tutorials_watched'...")
+                cursor.execute('''
+                    CREATE TABLE tutorials_watched (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        tutorial_id TEXT NOT NULL,
+                        watched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        progress INTEGER DEFAULT 0,
+                        FOREIGN KEY (user_id) REFERENCES users (id)
+                    )
+                ''')
+                print("Tabela 'tutorials_watched' criada com sucesso!")
+        
+            # Criar tabela para músicas masterizadas
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='mastered_songs'")
+            if not cursor.fetchone():
+                print("Criando tabela 'mastered_songs'...")
+                cursor.execute('''
+                    CREATE TABLE mastered_songs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        session_id TEXT NOT NULL,
+                        original_filename TEXT NOT NULL,
+                        mastered_filename TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        status TEXT DEFAULT 'completed',
+                        integrated_lufs REAL,
+                        short_term_max_lufs REAL,
+                        momentary_max_lufs REAL,
+                        loudness_range_lu REAL,
+                        true_peak_dbtp REAL,
+                        sample_peak_dbfs REAL,
+                        FOREIGN KEY (user_id) REFERENCES users (id)
+                    )
+                ''')
+                print("Tabela 'mastered_songs' criada com sucesso!")
+        
+            # Criar tabela para downloads
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='downloads'")
+            if not cursor.fetchone():
+                print("Criando tabela 'downloads'...")
+                cursor.execute('''
+                    CREATE TABLE downloads (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        file_type TEXT NOT NULL,
+                        filename TEXT NOT NULL,
+                        downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users (id)
+                    )
+                ''')
+                print("Tabela 'downloads' criada com sucesso!")
+        
+            # Criar tabela para solicitações de ghost producer
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='ghost_producer_requests'")
+            if not cursor.fetchone():
+                print("Criando tabela 'ghost_producer_requests'...")
+                cursor.execute('''
+                    CREATE TABLE ghost_producer_requests (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        package TEXT NOT NULL,
+                        genre TEXT NOT NULL,
+                        description TEXT,
+                        budget REAL,
+                        deadline TEXT,
+                        status TEXT DEFAULT 'pending',
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        completed_at TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users (id)
+                    )
+                ''')
+                print("Tabela 'ghost_producer_requests' criada com sucesso!")
+        
+            # Migração: colunas adicionadas depois da versão original das tabelas
+            db.add_missing_columns(cursor)
+
+            # Migração: índices por usuário/data usados pelo dashboard
+            db.create_indexes(cursor)
+            
+            # Verifica a estrutura da tabela
+            cursor.execute("PRAGMA table_info(users)")
+            columns = cursor.fetchall()
+            print(f"Colunas na tabela: {[col[1] for col in columns]}")
         
-        conn.close()
+        # Esquema verificado uma única vez; as funções abaixo não consultam mais o sqlite_master
+        db.verify_schema()
         print("Banco de dados inicializado com sucesso!")
     except Exception as e:
         import traceback
@@ -151,11 +241,10 @@ def init_db():
 
 def get_user_by_id(user_id):
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-        user_data = cursor.fetchone()
-        conn.close()
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
+            user_data = cursor.fetchone()
         if user_data:
             return User(user_data[0], user_data[1], user_data[2], user_data[3])
         return None
@@ -166,19 +255,10 @@ def get_user_by_id(user_id):
 def get_user_by_email(email):
     try:
         print(f"Conectando ao banco de dados para buscar email: {email}")
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Verifica se a tabela existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        if not cursor.fetchone():
-            print("Tabela 'users' não existe!")
-            conn.close()
-            return None
-        
-        cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
-        user_data = cursor.fetchone()
-        conn.close()
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
+            user_data = cursor.fetchone()
         
         if user_data:
             print(f"Usuário encontrado: ID={user_data[0]}, Nome={user_data[1]}")
@@ -197,164 +277,158 @@ def get_user_dashboard_data(user_id):
     try:
         print(f"=== INÍCIO get_user_dashboard_data para usuário {user_id} ===")
         
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
+        cached = dashboard_cache.get(user_id)
+        if cached is not None:
+            print("Dados do dashboard servidos do cache")
+            return cached
         
-        # Verificar se as tabelas existem
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        existing_tables = [table[0] for table in cursor.fetchall()]
+        # Tabelas existentes vêm do cache do esquema (verificado uma vez no init_db)
+        existing_tables = list(db.get_schema())
         print(f"Tabelas existentes: {existing_tables}")
         
-        # Contar tutoriais assistidos
-        tutorials_watched = 0
-        if 'tutorials_watched' in existing_tables:
-            try:
-                cursor.execute('SELECT COUNT(*) FROM tutorials_watched WHERE user_id = ?', (user_id,))
-                tutorials_watched = cursor.fetchone()[0]
-                print(f"Tutoriais assistidos: {tutorials_watched}")
-            except Exception as e:
-                print(f"Erro ao contar tutoriais assistidos: {str(e)}")
-                tutorials_watched = 0
-        
-        # Contar músicas masterizadas
-        mastered_songs = 0
-        if 'mastered_songs' in existing_tables:
-            try:
-                cursor.execute('SELECT COUNT(*) FROM mastered_songs WHERE user_id = ?', (user_id,))
-                mastered_songs = cursor.fetchone()[0]
-                print(f"Músicas masterizadas: {mastered_songs}")
-            except Exception as e:
-                print(f"Erro ao contar músicas masterizadas: {str(e)}")
-                mastered_songs = 0
-        
-        # Buscar histórico de downloads
-        downloads = []
-        if 'downloads' in existing_tables:
-            try:
-                print("Buscando downloads...")
-                cursor.execute('''
-                    SELECT file_type, filename, downloaded_at 
-                    FROM downloads 
-                    WHERE user_id = ? 
-                    ORDER BY downloaded_at DESC 
-                    LIMIT 10
-                ''', (user_id,))
-                raw_downloads = cursor.fetchall()
-                print(f"Downloads encontrados: {len(raw_downloads)}")
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            
+            # Contagens em uma única consulta agregada (usa os índices por user_id)
+            tutorials_watched = 0
+            mastered_songs = 0
+            counters = [table for table in ('tutorials_watched', 'mastered_songs') if table in existing_tables]
+            if counters:
+                try:
+                    cursor.execute(
+                        'SELECT ' + ', '.join(f'(SELECT COUNT(*) FROM {table} WHERE user_id = ?)' for table in counters),
+                        (user_id,) * len(counters)
+                    )
+                    counts = dict(zip(counters, cursor.fetchone()))
+                    tutorials_watched = counts.get('tutorials_watched', 0)
+                    mastered_songs = counts.get('mastered_songs', 0)
+                    print(f"Tutoriais assistidos: {tutorials_watched}, músicas masterizadas: {mastered_songs}")
+                except Exception as e:
+                    print(f"Erro ao contar tutoriais/músicas masterizadas: {str(e)}")
+        
+            # Buscar histórico de downloads
+            downloads = []
+            if 'downloads' in existing_tables:
+                try:
+                    print("Buscando downloads...")
+                    cursor.execute('''
+                        SELECT file_type, filename, downloaded_at 
+                        FROM downloads 
+                        WHERE user_id = ? 
+                        ORDER BY downloaded_at DESC 
+                        LIMIT 10
+                    ''', (user_id,))
+                    raw_downloads = cursor.fetchall()
+                    print(f"Downloads encontrados: {len(raw_downloads)}")
                 
-                # Processar e limpar os dados, verificando se os arquivos ainda existem
-                for download in raw_downloads:
-                    cleaned_download = []
-                    for i, field in enumerate(download):
-                        if field is None:
-                            cleaned_download.append('')
-                        elif i == 1 and field:  # filename
-                            # Verificar se o arquivo ainda existe
-                            file_path = os.path.join('uploads', field)
-                            if os.path.exists(file_path):
-                                cleaned_download.append(str(field))
+                    # Processar e limpar os dados, verificando se os arquivos ainda existem
+                    for download in raw_downloads:
+                        cleaned_download = []
+                        for i, field in enumerate(download):
+                            if field is None:
+                                cleaned_download.append('')
+                            elif i == 1 and field:  # filename
+                                # Verificar no índice se o arquivo ainda existe
+                                if storage_index.exists(field):
+                                    cleaned_download.append(str(field))
+                                else:
+                                    cleaned_download.append('')  # Arquivo não existe mais
                             else:
-                                cleaned_download.append('')  # Arquivo não existe mais
-                        else:
-                            cleaned_download.append(str(field))
+                                cleaned_download.append(str(field))
                     
-                    # Só adicionar se o arquivo ainda existir
-                    if cleaned_download[1]:  # Se filename ainda existe
-                        downloads.append(cleaned_download)
+                        # Só adicionar se o arquivo ainda existir
+                        if cleaned_download[1]:  # Se filename ainda existe
+                            downloads.append(cleaned_download)
                 
-                print(f"Downloads válidos: {len(downloads)}")
+                    print(f"Downloads válidos: {len(downloads)}")
                     
-            except Exception as e:
-                print(f"Erro ao buscar downloads: {str(e)}")
-                downloads = []
-        
-        # Buscar solicitações de ghost producer
-        ghost_requests = []
-        if 'ghost_producer_requests' in existing_tables:
-            try:
-                print("Buscando solicitações de ghost producer...")
-                # Verificar se as novas colunas existem
-                cursor.execute("PRAGMA table_info(ghost_producer_requests)")
-                columns = [column[1] for column in cursor.fetchall()]
-                print(f"Colunas da tabela ghost_producer_requests: {columns}")
+                except Exception as e:
+                    print(f"Erro ao buscar downloads: {str(e)}")
+                    downloads = []
+        
+            # Buscar solicitações de ghost producer
+            ghost_requests = []
+            if 'ghost_producer_requests' in existing_tables:
+                try:
+                    print("Buscando solicitações de ghost producer...")
+                    # Verificar se as novas colunas existem
+                    columns = db.table_columns('ghost_producer_requests')
+                    print(f"Colunas da tabela ghost_producer_requests: {columns}")
                 
-                if 'package' in columns and 'deadline' in columns:
-                    cursor.execute('''
-                        SELECT id, package, genre, description, budget, deadline, status, created_at, completed_at 
-                        FROM ghost_producer_requests 
-                        WHERE user_id = ? 
-                        ORDER BY created_at DESC
-                    ''', (user_id,))
-                else:
-                    # Fallback para versão antiga da tabela
-                    cursor.execute('''
-                        SELECT id, genre, description, budget, status, created_at, completed_at 
-                        FROM ghost_producer_requests 
-                        WHERE user_id = ? 
-                        ORDER BY created_at DESC
-                    ''', (user_id,))
+                    if 'package' in columns and 'deadline' in columns:
+                        cursor.execute('''
+                            SELECT id, package, genre, description, budget, deadline, status, created_at, completed_at 
+                            FROM ghost_producer_requests 
+                            WHERE user_id = ? 
+                            ORDER BY created_at DESC
+                        ''', (user_id,))
+                    else:
+                        # Fallback para versão antiga da tabela
+                        cursor.execute('''
+                            SELECT id, genre, description, budget, status, created_at, completed_at 
+                            FROM ghost_producer_requests 
+                            WHERE user_id = ? 
+                            ORDER BY created_at DESC
+                        ''', (user_id,))
                 
-                raw_requests = cursor.fetchall()
-                print(f"Solicitações encontradas: {len(raw_requests)}")
+                    raw_requests = cursor.fetchall()
+                    print(f"Solicitações encontradas: {len(raw_requests)}")
                 
-                # Processar e limpar os dados
-                for request in raw_requests:
-                    cleaned_request = []
-                    for field in request:
-                        if field is None:
-                            cleaned_request.append('')
-                        else:
-                            cleaned_request.append(str(field))
-                    ghost_requests.append(cleaned_request)
+                    # Processar e limpar os dados
+                    for request in raw_requests:
+                        cleaned_request = []
+                        for field in request:
+                            if field is None:
+                                cleaned_request.append('')
+                            else:
+                                cleaned_request.append(str(field))
+                        ghost_requests.append(cleaned_request)
                 
-                print(f"Solicitações processadas: {len(ghost_requests)}")
+                    print(f"Solicitações processadas: {len(ghost_requests)}")
                     
-            except Exception as e:
-                print(f"Erro ao buscar solicitações ghost producer: {str(e)}")
-                ghost_requests = []
-        
-        # Buscar músicas masterizadas recentes
-        recent_masters = []
-        if 'mastered_songs' in existing_tables:
-            try:
-                print("Buscando músicas masterizadas recentes...")
-                cursor.execute('''
-                    SELECT original_filename, mastered_filename, created_at, status 
-                    FROM mastered_songs 
-                    WHERE user_id = ? 
-                    ORDER BY created_at DESC 
-                    LIMIT 5
-                ''', (user_id,))
-                raw_masters = cursor.fetchall()
-                print(f"Músicas masterizadas encontradas: {len(raw_masters)}")
+                except Exception as e:
+                    print(f"Erro ao buscar solicitações ghost producer: {str(e)}")
+                    ghost_requests = []
+        
+            # Buscar músicas masterizadas recentes
+            recent_masters = []
+            if 'mastered_songs' in existing_tables:
+                try:
+                    print("Buscando músicas masterizadas recentes...")
+                    cursor.execute('''
+                        SELECT original_filename, mastered_filename, created_at, status 
+                        FROM mastered_songs 
+                        WHERE user_id = ? 
+                        ORDER BY created_at DESC 
+                        LIMIT 5
+                    ''', (user_id,))
+                    raw_masters = cursor.fetchall()
+                    print(f"Músicas masterizadas encontradas: {len(raw_masters)}")
                 
-                # Processar e limpar os dados, verificando se os arquivos ainda existem
-                for master in raw_masters:
-                    cleaned_master = []
-                    for i, field in enumerate(master):
-                        if field is None:
-                            cleaned_master.append('')
-                        elif i in [0, 1] and field:  # original_filename ou mastered_filename
-                            # Verificar se o arquivo ainda existe
-                            file_path = os.path.join('uploads', field)
-                            if os.path.exists(file_path):
-                                cleaned_master.append(str(field))
+                    # Processar e limpar os dados, verificando se os arquivos ainda existem
+                    for master in raw_masters:
+                        cleaned_master = []
+                        for i, field in enumerate(master):
+                            if field is None:
+                                cleaned_master.append('')
+                            elif i in [0, 1] and field:  # original_filename ou mastered_filename
+                                # Verificar no índice se o arquivo ainda existe
+                                if storage_index.exists(field):
+                                    cleaned_master.append(str(field))
+                                else:
+                                    cleaned_master.append('')  # Arquivo não existe mais
                             else:
-                                cleaned_master.append('')  # Arquivo não existe mais
-                        else:
-                            cleaned_master.append(str(field))
+                                cleaned_master.append(str(field))
                     
-                    # Só adicionar se pelo menos um dos arquivos ainda existir
-                    if any(cleaned_master[0:2]):  # Se original ou mastered ainda existem
-                        recent_masters.append(cleaned_master)
+                        # Só adicionar se pelo menos um dos arquivos ainda existir
+                        if any(cleaned_master[0:2]):  # Se original ou mastered ainda existem
+                            recent_masters.append(cleaned_master)
                 
-                print(f"Músicas masterizadas válidas: {len(recent_masters)}")
+                    print(f"Músicas masterizadas válidas: {len(recent_masters)}")
                     
-            except Exception as e:
-                print(f"Erro ao buscar músicas masterizadas recentes: {str(e)}")
-                recent_masters = []
-        
-        conn.close()
+                except Exception as e:
+                    print(f"Erro ao buscar músicas masterizadas recentes: {str(e)}")
+                    recent_masters = []
         
         result = {
             'tutorials_watched': tutorials_watched,
@@ -368,7 +442,7 @@ def get_user_dashboard_data(user_id):
         print(f"Resultado final: {result}")
         print(f"=== FIM get_user_dashboard_data ===")
         
-        return result
+        return dashboard_cache.set(user_id, result)
     except Exception as e:
         print(f"❌ ERRO CRÍTICO em get_user_dashboard_data: {str(e)}")
         import traceback
@@ -377,66 +451,86 @@ def get_user_dashboard_data(user_id):
 
 def mark_tutorial_watched(user_id, tutorial_id):
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Verificar se a tabela existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='tutorials_watched'")
-        if not cursor.fetchone():
-            print("Tabela 'tutorials_watched' não existe!")
-            conn.close()
-            return False
-        
-        # Verificar se já foi assistido
-        cursor.execute('SELECT id FROM tutorials_watched WHERE user_id = ? AND tutorial_id = ?', (user_id, tutorial_id))
-        if not cursor.fetchone():
-            cursor.execute('INSERT INTO tutorials_watched (user_id, tutorial_id) VALUES (?, ?)', (user_id, tutorial_id))
-            conn.commit()
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            
+            # Verificar se já foi assistido
+            cursor.execute('SELECT id FROM tutorials_watched WHERE user_id = ? AND tutorial_id = ?', (user_id, tutorial_id))
+            if not cursor.fetchone():
+                cursor.execute('INSERT INTO tutorials_watched (user_id, tutorial_id) VALUES (?, ?)', (user_id, tutorial_id))
         
-        conn.close()
+        dashboard_cache.invalidate(user_id)
         return True
     except Exception as e:
         print(f"Erro ao marcar tutorial como assistido: {str(e)}")
         return False
 
-def record_mastered_song(user_id, session_id, original_filename, mastered_filename):
+# Colunas de mastered_songs com a medição do master (mesmas chaves do relatório de loudness)
+LOUDNESS_COLUMNS = db.LOUDNESS_COLUMNS
+
+def loudness_values(loudness):
+    return tuple((loudness or {}).get(column) for column in LOUDNESS_COLUMNS)
+
+def record_mastered_song(user_id, session_id, original_filename, mastered_filename, loudness=None):
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Verificar se a tabela existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='mastered_songs'")
-        if not cursor.fetchone():
-            print("Tabela 'mastered_songs' não existe!")
-            conn.close()
-            return False
-        
-        cursor.execute('''
-            INSERT INTO mastered_songs (user_id, session_id, original_filename, mastered_filename) 
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, session_id, original_filename, mastered_filename))
-        conn.commit()
-        conn.close()
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                INSERT INTO mastered_songs (user_id, session_id, original_filename, mastered_filename,
+                                            {', '.join(LOUDNESS_COLUMNS)})
+                VALUES (?, ?, ?, ?{', ?' * len(LOUDNESS_COLUMNS)})
+            ''', (user_id, session_id, original_filename, mastered_filename) + loudness_values(loudness))
+        # Nos workers de masterização isto não alcança o processo do Flask:
+        # lá a invalidação é feita por on_mastering_job_done
+        dashboard_cache.invalidate(user_id)
         return True
     except Exception as e:
         print(f"Erro ao registrar música masterizada: {str(e)}")
         return False
 
+def record_batch_songs(batch):
+    """
+    Registra todas as faixas concluídas de um lote em uma única transação.
+    Executado no processo do Flask quando a última faixa termina.
+    """
+    rows = [
+        (batch['owner_id'], track['session_id'], f"{track['session_id']}_target.wav", track['result']['output_filename'])
+        + loudness_values(track['result'].get('loudness'))
+        for track in batch['tracks'] if track['result']
+    ]
+    if rows:
+        with db.connect() as conn:
+            conn.cursor().executemany(f'''
+                INSERT INTO mastered_songs (user_id, session_id, original_filename, mastered_filename,
+                                            {', '.join(LOUDNESS_COLUMNS)})
+                VALUES (?, ?, ?, ?{', ?' * len(LOUDNESS_COLUMNS)})
+            ''', rows)
+        for row in rows:
+            storage_index.add(row[3])
+    dashboard_cache.invalidate(batch['owner_id'])
+    return len(rows)
+
+def update_mastered_loudness(mastered_filename, loudness):
+    """
+    Atualiza a medição de um master refeito (ex.: ajustes em /masterize)
+    """
+    try:
+        with db.connect() as conn:
+            conn.cursor().execute(f'''
+                UPDATE mastered_songs SET {', '.join(f'{column} = ?' for column in LOUDNESS_COLUMNS)}
+                WHERE mastered_filename = ?
+            ''', loudness_values(loudness) + (mastered_filename,))
+        return True
+    except Exception as e:
+        print(f"Erro ao atualizar medição do master: {str(e)}")
+        return False
+
 def record_download(user_id, file_type, filename):
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Verificar se a tabela existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='downloads'")
-        if not cursor.fetchone():
-            print("Tabela 'downloads' não existe!")
-            conn.close()
-            return False
-        
-        cursor.execute('INSERT INTO downloads (user_id, file_type, filename) VALUES (?, ?, ?)', (user_id, file_type, filename))
-        conn.commit()
-        conn.close()
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('INSERT INTO downloads (user_id, file_type, filename) VALUES (?, ?, ?)', (user_id, file_type, filename))
+        dashboard_cache.invalidate(user_id)
         return True
     except Exception as e:
         print(f"Erro ao registrar download: {str(e)}")
@@ -483,7 +577,8 @@ def servicos():
 @app.route('/masterizacao')
 @login_required_custom
 def masterizacao():
-    return render_template('masterizacao.html')
+    return render_template('masterizacao.html',
+                           presets=[preset.summary() for preset in chain_presets.values()])
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -555,12 +650,10 @@ def cadastro():
                 return render_template('cadastro.html')
 
             senha_hash = generate_password_hash(senha, method='pbkdf2:sha256')
-            conn = sqlite3.connect('users.db')
-            cursor = conn.cursor()
-            cursor.execute('INSERT INTO users (nome, email, senha_hash) VALUES (?, ?, ?)', 
-                          (nome, email, senha_hash))
-            conn.commit()
-            conn.close()
+            with db.connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('INSERT INTO users (nome, email, senha_hash) VALUES (?, ?, ?)', 
+                              (nome, email, senha_hash))
             flash('Cadastro realizado com sucesso! Faça login para continuar.', 'success')
             return redirect(url_for('login'))
 
@@ -573,6 +666,9 @@ def cadastro():
 @app.route('/logout')
 @login_required_custom
 def logout():
+    mastering_session_id = session.pop('mastering_session_id', None)
+    audio_cache.evict_session(mastering_session_id)
+    stage_cache.evict_session(mastering_session_id)
     logout_user()
     flash('Logout realizado com sucesso!', 'success')
     return redirect(url_for('home'))
@@ -693,32 +789,17 @@ def api_request_ghost_producer():
             deadline_fee = base_price * deadline_fees['urgent']
         total_price = base_price + deadline_fee
         
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Verificar se a tabela existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='ghost_producer_requests'")
-        if not cursor.fetchone():
-            conn.close()
+        # Tabela e colunas (package/deadline) garantidas pelo init_db, verificadas uma vez
+        if not db.has_table('ghost_producer_requests'):
             return jsonify({'success': False, 'error': 'Sistema de solicitações não disponível no momento'})
         
-        # Verificar se a tabela tem os novos campos
-        cursor.execute("PRAGMA table_info(ghost_producer_requests)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'package' not in columns:
-            # Adicionar coluna package se não existir
-            cursor.execute('ALTER TABLE ghost_producer_requests ADD COLUMN package TEXT')
-        if 'deadline' not in columns:
-            # Adicionar coluna deadline se não existir
-            cursor.execute('ALTER TABLE ghost_producer_requests ADD COLUMN deadline TEXT')
-        
-        cursor.execute('''
-            INSERT INTO ghost_producer_requests (user_id, package, genre, description, budget, deadline) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (current_user.id, package, genre, description, total_price, deadline))
-        conn.commit()
-        conn.close()
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO ghost_producer_requests (user_id, package, genre, description, budget, deadline) 
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (current_user.id, package, genre, description, total_price, deadline))
+        dashboard_cache.invalidate(current_user.id)
         
         # Mensagem personalizada baseada no pacote e prazo
         package_names = {
@@ -750,24 +831,20 @@ def api_delete_ghost_request():
         if not request_id:
             return jsonify({'success': False, 'error': 'ID da solicitação não fornecido'})
         
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Verificar se a solicitação existe e pertence ao usuário
-        cursor.execute('''
-            SELECT id FROM ghost_producer_requests 
-            WHERE id = ? AND user_id = ?
-        ''', (request_id, current_user.id))
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            
+            # Excluir apenas se a solicitação existir e pertencer ao usuário
+            cursor.execute('''
+                DELETE FROM ghost_producer_requests 
+                WHERE id = ? AND user_id = ?
+            ''', (request_id, current_user.id))
+            deleted = cursor.rowcount
+        dashboard_cache.invalidate(current_user.id)
         
-        if not cursor.fetchone():
-            conn.close()
+        if not deleted:
             return jsonify({'success': False, 'error': 'Solicitação não encontrada ou não pertence a você'})
         
-        # Excluir a solicitação
-        cursor.execute('DELETE FROM ghost_producer_requests WHERE id = ?', (request_id,))
-        conn.commit()
-        conn.close()
-        
         return jsonify({'success': True, 'message': 'Solicitação excluída com sucesso!'})
         
     except Exception as e:
@@ -877,37 +954,116 @@ def get_youtube_tutorials():
 
 # ======================
 
+@app.errorhandler(413)
+def request_too_large(e):
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({'success': False, 'error': f'Envio maior que o limite de {limit_mb}MB'}), 413
+
+# Upload em blocos retomável (arquivos grandes): criar, enviar blocos, concluir
+@app.route('/api/uploads', methods=['POST'])
+@login_required_custom
+def api_create_upload():
+    """
+    Cria um upload declarando o tamanho; arquivos acima do limite são recusados aqui
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        upload = chunked_uploads.create(current_user.id, secure_filename(data.get('filename') or ''), data.get('size'))
+        return jsonify({
+            'success': True,
+            **upload.status(),
+            'chunk_size': UPLOAD_CHUNK_SIZE,
+            'upload_url': url_for('api_upload', upload_id=upload.id),
+            'complete_url': url_for('api_complete_upload', upload_id=upload.id)
+        })
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'PATCH'])
+@login_required_custom
+def api_upload(upload_id):
+    """
+    GET: offset atual (para retomar). PATCH: anexa o corpo a partir do cabeçalho Upload-Offset.
+    """
+    upload = chunked_uploads.get(upload_id, current_user.id)
+    if upload is None:
+        return jsonify({'success': False, 'error': 'Upload não encontrado ou expirado'}), 404
+    if request.method == 'GET':
+        return jsonify({'success': True, **upload.status()})
+
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'success': False, 'error': 'Cabeçalho Upload-Offset ausente'}), 400
+    try:
+        with upload.lock:
+            upload.append(request.stream, offset, request.content_length)
+        return jsonify({'success': True, **upload.status()})
+    except UploadError as e:
+        if e.status == 415:
+            # Não é áudio: descartar o upload em vez de continuar recebendo
+            chunked_uploads.discard(upload)
+        return jsonify({'success': False, 'error': str(e), **upload.status()}), e.status
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+@login_required_custom
+def api_complete_upload(upload_id):
+    """
+    Conclui o upload e retorna hash e probe (formato, taxa, canais, duração)
+    """
+    upload = chunked_uploads.get(upload_id, current_user.id)
+    if upload is None:
+        return jsonify({'success': False, 'error': 'Upload não encontrado ou expirado'}), 404
+    try:
+        with upload.lock:
+            info = upload.complete()
+        return jsonify({'success': True, 'upload_id': upload.id, **info})
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
 # Rota de processamento de masterização
 @app.route('/processar_masterizacao', methods=['POST'])
 @login_required_custom
 def processar_masterizacao():
     try:
-        if 'target_file' not in request.files:
-            return jsonify({'success': False, 'error': 'Nenhum arquivo de música enviado'})
-
-        target_file = request.files['target_file']
+        # Arquivos grandes chegam antes pela API de upload em blocos (/api/uploads)
+        target_upload_id = request.form.get('target_upload_id')
+        reference_upload_id = request.form.get('reference_upload_id')
         reference_type = request.form.get('reference_type', 'file')
 
-        if target_file.filename == '':
-            return jsonify({'success': False, 'error': 'Nenhum arquivo de música selecionado'})
+        if not target_upload_id:
+            if 'target_file' not in request.files:
+                return jsonify({'success': False, 'error': 'Nenhum arquivo de música enviado'})
+            target_file = request.files['target_file']
+            if target_file.filename == '':
+                return jsonify({'success': False, 'error': 'Nenhum arquivo de música selecionado'})
 
         session_id = str(uuid.uuid4())
+
         target_filename = f"{session_id}_target.wav"
-        target_path = os.path.join('uploads', target_filename)
-        target_file.save(target_path)
+        target_path = upload_path(target_filename)
+        # Upload com hash e probe calculados durante a gravação; conteúdo repetido não ocupa disco de novo
+        if target_upload_id:
+            chunked_uploads.consume(target_upload_id, current_user.id, target_path)
+        else:
+            store_stream(target_file.stream, target_path, probe=AudioProbe(), max_bytes=MAX_UPLOAD_BYTES)
+        storage_index.add(target_path)
 
         reference_path = None
         reference_filename = None
 
         if reference_type == 'file':
-            if 'reference_file' not in request.files:
-                return jsonify({'success': False, 'error': 'Arquivo de referência não enviado'})
-            reference_file = request.files['reference_file']
-            if reference_file.filename == '':
-                return jsonify({'success': False, 'error': 'Nenhum arquivo de referência selecionado'})
             reference_filename = f"{session_id}_reference.wav"
-            reference_path = os.path.join('uploads', reference_filename)
-            reference_file.save(reference_path)
+            reference_path = upload_path(reference_filename)
+            if reference_upload_id:
+                chunked_uploads.consume(reference_upload_id, current_user.id, reference_path)
+            else:
+                if 'reference_file' not in request.files:
+                    return jsonify({'success': False, 'error': 'Arquivo de referência não enviado'})
+                reference_file = request.files['reference_file']
+                if reference_file.filename == '':
+                    return jsonify({'success': False, 'error': 'Nenhum arquivo de referência selecionado'})
+                store_stream(reference_file.stream, reference_path, probe=AudioProbe(), max_bytes=MAX_UPLOAD_BYTES)
+            storage_index.add(reference_path)
         elif reference_type == 'youtube':
             youtube_url = request.form.get('youtube_url')
             if not youtube_url:
@@ -915,83 +1071,539 @@ def processar_masterizacao():
             
             # Criar um arquivo de áudio placeholder para YouTube
             reference_filename = f"{session_id}_youtube_reference.wav"
-            reference_path = os.path.join('uploads', reference_filename)
+            reference_path = upload_path(reference_filename)
             
             try:
-                import numpy as np
-                # Criar um arquivo de áudio de exemplo (1 segundo de silêncio)
+                # Criar um arquivo de áudio de exemplo (1 segundo de silêncio estéreo)
                 sample_rate = 44100
                 duration = 1.0
                 samples = int(sample_rate * duration)
-                audio_data = np.zeros(samples)
-                sf.write(reference_path, audio_data, sample_rate)
+                audio_data = np.zeros((2, samples), dtype=np.float32)
+                write_audio(reference_path, audio_data, sample_rate)
+                storage_index.add(reference_path)
             except Exception as e:
                 return jsonify({'success': False, 'error': f'Erro ao processar link do YouTube: {str(e)}'})
 
-        # Processar a música imediatamente para gerar os resultados
+        # Colocar a masterização na fila e responder imediatamente; os parâmetros
+        # são derivados no worker, comparando a faixa com a referência
         try:
-            target_audio, target_sr = librosa.load(target_path, sr=None)
-            
-            # Se não houver arquivo de referência, usar o próprio arquivo como referência
-            if os.path.exists(reference_path):
-                reference_audio, reference_sr = librosa.load(reference_path, sr=None)
-            else:
-                reference_audio = target_audio
-                reference_sr = target_sr
-
-            # Aplicar masterização profissional
-            mastering_params = {
-                'compressor_threshold': -24,
-                'compressor_ratio': 1.8,
-                'gain_db': 1.2,
-                'limiter_threshold': -0.8
-            }
-            mastered_audio = apply_professional_mastering(target_audio, target_sr, mastering_params)
+            mastering_params = parse_loudness_target(request.form)
+            mastering_params.update(parse_preset(request.form))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
+
+        # Envio aceito: só agora a nova sessão substitui a anterior, liberando o áudio
+        # e os estágios em cache dela (um envio rejeitado mantém a sessão atual)
+        audio_cache.evict_session(session.get('mastering_session_id'))
+        stage_cache.evict_session(session.get('mastering_session_id'))
+        session['mastering_session_id'] = session_id
+
+        job_id = job_manager.submit(
+            run_mastering_job,
+            current_user.id, session_id, target_path, reference_path, mastering_params,
+            streaming=parse_bool(request.form.get('streaming')),
+            waveform_png=parse_bool(request.form.get('waveform_png')),
+            waveform_base64=parse_bool(request.form.get('waveform_base64')),
+            owner_id=current_user.id,
+            on_done=lambda job, user_id=current_user.id: on_mastering_job_done(job, user_id)
+        )
 
-            mastered_filename = f"mastered_{session_id}.wav"
-            mastered_path = os.path.join('uploads', mastered_filename)
-            sf.write(mastered_path, mastered_audio, target_sr)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'session_id': session_id,
+            'status': JOB_QUEUED,
+            'status_url': url_for('api_job_status', job_id=job_id),
+            'result_url': url_for('api_job_result', job_id=job_id)
+        })
+
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    except RequestEntityTooLarge as e:
+        return request_too_large(e)
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Erro geral: {str(e)}'})
+
+def on_mastering_job_done(job, user_id):
+    """
+    Executado no processo do Flask quando o job termina: o worker não alcança
+    os caches em memória deste processo
+    """
+    if job.get('result'):
+        storage_index.add(job['result']['output_filename'])
+    dashboard_cache.invalidate(user_id)
+
+def run_mastering_job(job_id, user_id, session_id, target_path, reference_path, mastering_params, streaming=False, waveform_png=False, waveform_base64=False):
+    """
+    Executa a masterização completa em um processo worker do pool de jobs
+    """
+    result = master_track(job_id, session_id, target_path, reference_path, mastering_params,
+                          streaming, waveform_png, waveform_base64)
+
+    # Registrar música masterizada no banco de dados
+    report_progress(job_id, 90, 'finalizing')
+    original_filename = os.path.basename(target_path)
+    record_mastered_song(user_id, session_id, original_filename, result['output_filename'], result['loudness'])
+
+    return result
+
+def run_batch_track(job_id, session_id, target_path, reference_path, mastering_params, streaming=False):
+    """
+    Faixa de um lote: o registro no banco é feito para o lote inteiro (record_batch_songs)
+    """
+    return master_track(job_id, session_id, target_path, reference_path, mastering_params, streaming)
 
-            # Gerar waveform da música original
-            original_waveform_filename, original_waveform_path = generate_beautiful_waveform(target_audio, target_sr, 'Música Original', session_id, 'original_waveform')
+def parse_preset(values):
+    """
+    {'preset': nome} se um preset da cadeia foi pedido; ValueError se não existir
+    """
+    name = values.get('preset')
+    if not name:
+        return {}
+    return {'preset': board_pool.preset(name).name}
 
-            # Gerar waveform da música masterizada
-            mastered_waveform_filename, mastered_waveform_path = generate_beautiful_waveform(mastered_audio, target_sr, 'Música Masterizada', session_id, 'mastered_waveform')
+def analyze_pre_gain(target_path, mastering_params):
+    """
+    Uma passada em blocos pelos estágios antes do Gain. Retorna a medição desse sinal
+    (`measure`: loudness, pico e duração), já equalizado e comprimido, e o proxy de
+    análise com os trechos de calibração em taxa completa (ver loudness_target), com
+    os quais `master_loudness_at` prevê a loudness do master para cada gain_db
+    """
+    try:
+        frames = sf.info(target_path).frames
+    except RuntimeError:
+        frames = 0
+    builders = {}
+
+    with board_pool.checkout(mastering_params) as chain:
+        def process(block, sample_rate, block_size):
+            processed = process_block(chain.pre_gain, block, sample_rate, block_size)
+            if not builders:
+                channels = processed.shape[0]
+                builders['proxy'] = ProxyBuilder(sample_rate, proxy_rate(sample_rate, frames), channels)
+                builders['excerpt'] = CalibrationBuilder(sample_rate, channels)
+            for builder in builders.values():
+                builder.add(processed)
+            return processed
+
+        meter = meter_file(target_path, process=process)
+
+    analysis = {'measure': meter.result(), 'sample_rate': meter.sample_rate, 'signal': None}
+    if builders:
+        analysis.update(signal=builders['proxy'].build(), rate=builders['proxy'].rate,
+                        excerpt=builders['excerpt'].build())
+    return analysis
+
+def master_loudness_at(analysis, params):
+    """
+    Loudness integrada do master (estágios do Gain em diante, inclusive o limiter) em
+    função do gain_db, a partir de `analyze_pre_gain`: (loudness no proxy, correção
+    proxy -> taxa completa medida nos trechos de calibração, ou None na taxa completa)
+    """
+    signal, rate, sample_rate = analysis['signal'], analysis['rate'], analysis['sample_rate']
+
+    def loudness_at(gain_db):
+        return measure_from_gain(signal, rate, params, gain_db)['integrated_lufs']
+
+    offset_at = None
+    if rate != sample_rate:
+        excerpt = analysis['excerpt']
+        excerpt_proxy = ProxyBuilder(sample_rate, rate, excerpt.shape[0])
+        excerpt_proxy.add(excerpt)
+        excerpt_proxy = excerpt_proxy.build()
+        offset_at = lambda gain_db: (measure_from_gain(excerpt, sample_rate, params, gain_db)['integrated_lufs']
+                                     - measure_from_gain(excerpt_proxy, rate, params, gain_db)['integrated_lufs'])
+    return loudness_at, offset_at
+
+def expected_master_loudness(analysis, params):
+    """
+    Loudness integrada prevista do master com o gain_db de `params`
+    """
+    if analysis['signal'] is None:
+        return analysis['measure']['loudness_db']
+    loudness_at, offset_at = master_loudness_at(analysis, params)
+    loudness = loudness_at(params['gain_db'])
+    if offset_at is not None:
+        loudness += offset_at(params['gain_db'])
+    return round(float(loudness), 2)
+
+def resolve_mastering_params(target_path, reference_path, overrides=None):
+    """
+    Parâmetros completos da masterização, a partir dos valores padrão do preset. Com uma
+    referência, EQ e compressor saem da comparação das features (em cache pelo hash) e o
+    ganho é o que leva o master, previsto pelos estágios do Gain em diante (o limiter
+    também muda a loudness), à loudness da referência; valores passados em `overrides`
+    sempre prevalecem. O resultado fica em cache por (faixa, referência, cadeia,
+    overrides): a mesma combinação não passa de novo pela análise.
+    Retorna (parâmetros, análise antes do Gain (analyze_pre_gain) ou None se não foi feita).
+    """
+    overrides = dict(overrides or {})
+    preset = board_pool.preset(overrides.pop('preset', None))
+    overrides = {name: float(value) for name, value in overrides.items() if value is not None}
+    params = dict(preset.params, **overrides, preset=preset.name)
+    if not reference_path or all(name in overrides for name in MASTERING_PARAM_DEFAULTS):
+        return params, None
+
+    key = resolved_params_key(content_hash(target_path), content_hash(reference_path),
+                              chain_version(params), overrides)
+    cached = resolved_params_cache.lookup(key)
+    if cached is not None:
+        return dict(cached), None
+
+    reference = feature_cache.get(reference_path)
+    if is_silent(reference):
+        # Referência sem áudio (ex.: placeholder do YouTube): parâmetros padrão
+        return params, None
+
+    target = feature_cache.get(target_path)
+    params = dict(preset.params, **derive_params(target, reference))
+    params.update(overrides, preset=preset.name)
+    analysis = None
+    if 'gain_db' not in overrides:
+        analysis = analyze_pre_gain(target_path, params)
+        if analysis['signal'] is not None:
+            gain_db = match_gain(analysis['measure']['loudness_db'], reference, *master_loudness_at(analysis, params))
+            if gain_db is not None:
+                params['gain_db'] = gain_db
+    print(f"Parâmetros derivados da referência ({reference['loudness_db']} dB): {params}")
+    resolved_params_cache.store(key, params)
+    return params, analysis
+
+def analyze_batch_track(job_id, target_path, reference_path, mastering_params):
+    """
+    Modo álbum: passada rápida de análise de uma faixa do lote. Os parâmetros da faixa
+    (derivados da referência, se houver) são resolvidos aqui e seguem para a renderização;
+    `expected_lufs` é a loudness prevista do master com eles (limiter incluído).
+    """
+    report_progress(job_id, 10, 'analysis')
+    params, analysis = resolve_mastering_params(target_path, reference_path, mastering_params)
+    analysis = analysis or analyze_pre_gain(target_path, params)
+    return dict(analysis['measure'], mastering_params=params,
+                expected_lufs=expected_master_loudness(analysis, params))
 
-            # Converter waveforms para base64
+def plan_album_gains(args_list, analyses, target_db=None):
+    """
+    Modo álbum: todas as faixas são renderizadas no modo alvo de loudness com o mesmo
+    alvo (`target_db` ou a média das loudness previstas). O ganho de cada uma é resolvido
+    na renderização pelos estágios do Gain em diante e o trim final acerta o alvo, então
+    o que o limiter faz com cada faixa não desvia o resultado.
+    """
+    if target_db is None:
+        # Lote já pedido no modo alvo: o alvo dele vale para o álbum
+        targets = {a['mastering_params'].get('target_lufs') for a in analyses if a}
+        if len(targets) == 1:
+            target_db = targets.pop()
+    levels = [analysis['expected_lufs'] if analysis else None for analysis in analyses]
+    target_db, track_targets = album_target_loudness(levels, target_db)
+    if target_db is not None:
+        target_db = min(max(target_db, TARGET_LUFS_RANGE[0]), TARGET_LUFS_RANGE[1])
+
+    planned, tracks = [], []
+    for args, analysis, track_target in zip(args_list, analyses, track_targets):
+        if analysis is None:
+            planned.append(None)
+            tracks.append(None)
+            continue
+        session_id, target_path, reference_path, _ = args
+        params = dict(analysis['mastering_params'])
+        if track_target is not None:
+            # Faixa audível: alvo do álbum, com o teto de true peak pedido (ou o padrão)
+            max_true_peak = params.get('max_true_peak')
+            params.update(target_lufs=target_db,
+                          max_true_peak=DEFAULT_MAX_TRUE_PEAK if max_true_peak is None else max_true_peak)
+        planned.append((session_id, target_path, reference_path, params))
+        tracks.append({
+            'loudness_db': analysis['expected_lufs'],
+            'peak_db': analysis['peak_db'],
+            'target_lufs': params.get('target_lufs'),
+            'gain_offset_db': round(target_db - analysis['expected_lufs'], 2) if track_target is not None else 0.0,
+            'gain_db': params['gain_db']
+        })
+    return planned, {'mode': 'album', 'target_db': target_db, 'tracks': tracks}
+
+def master_track(job_id, session_id, target_path, reference_path, mastering_params, streaming=False, waveform_png=False, waveform_base64=False):
+    """
+    Masteriza uma faixa (com cache de resultado) e grava os sidecars de picos.
+    `mastering_params` pode ser parcial: o que faltar vem da análise da referência.
+    """
+    report_progress(job_id, 2, 'analysis')
+    mastering_params, analysis = resolve_mastering_params(target_path, reference_path, mastering_params)
+
+    mastered_filename = f"mastered_{session_id}.wav"
+    mastered_path = upload_path(mastered_filename)
+
+    # Mesmo áudio + mesmos parâmetros + mesma cadeia = reaproveitar o master já gerado
+    use_streaming = should_stream(target_path, streaming)
+    cache_key = result_key(content_hash(target_path), mastering_params, chain_version(mastering_params),
+                           mode='streaming' if use_streaming else 'memory')
+
+    if restore_result(cache_key, mastered_path):
+        report_progress(job_id, 75, 'waveforms')
+        original_peaks = load_or_build_peaks(target_path)
+        mastered_peaks = load_or_build_peaks(mastered_path)
+        loudness = load_or_measure_loudness(mastered_path)
+        target_sr = original_peaks.sample_rate
+    elif use_streaming:
+        # Faixa longa: masterizar em blocos direto para o disco (picos calculados no caminho)
+        report_progress(job_id, 5, 'mastering')
+        info, original_peaks, mastered_peaks = master_file_streaming(
+            target_path, mastered_path, mastering_params,
+            progress=lambda fraction: report_progress(job_id, 5 + int(fraction * 70), 'mastering'),
+            with_original_peaks=True, analysis=analysis
+        )
+        mastering_params = info['params']
+        loudness = info['loudness']
+        target_sr = info['sample_rate']
+        store_result(cache_key, mastered_path)
+    else:
+        report_progress(job_id, 5, 'loading')
+        # Decodificar gravando o sidecar .npy, reaproveitado depois por /masterize
+        target_audio, target_sr = decode_audio(target_path)
+
+        # Aplicar masterização profissional
+        report_progress(job_id, 25, 'mastering')
+        mastered_audio, mastering_params, loudness = render_master(target_audio, target_sr, mastering_params,
+                                                                   analysis=analysis)
+        write_audio_file(mastered_path, mastered_audio, target_sr)
+        loudness = save_loudness(mastered_path, loudness)
+
+        # Pirâmides de picos para o waveform desenhado no navegador
+        report_progress(job_id, 75, 'waveforms')
+        original_peaks = save_peaks(target_path, build_peaks(target_audio, target_sr))
+        mastered_peaks = save_peaks(mastered_path, build_peaks(mastered_audio, target_sr))
+        store_result(cache_key, mastered_path)
+
+    result = {
+        'session_id': session_id,
+        'target_path': target_path,
+        'reference_path': reference_path,
+        'output_filename': mastered_filename,
+        # Tokens de versão para as URLs de /audio (cache do navegador até o master mudar)
+        'original_version': audio_version(target_path),
+        'mastered_version': audio_version(mastered_path),
+        'duration': original_peaks.total_frames / original_peaks.sample_rate,
+        # LUFS integrado/curto prazo/momentâneo, LRA e true peak do master
+        'loudness': loudness,
+        'params': {
+            'preset': mastering_params['preset'],
+            'use_compressor': True,
+            'compressor_threshold': mastering_params['compressor_threshold'],
+            'compressor_ratio': mastering_params['compressor_ratio'],
+            'gain_db': mastering_params['gain_db'],
+            'use_limiter': True,
+            'limiter_threshold': mastering_params['limiter_threshold'],
+            'low_shelf_db': mastering_params['low_shelf_db'],
+            'high_shelf_db': mastering_params['high_shelf_db'],
+            'low_band_db': mastering_params['low_band_db'],
+            'mid_band_db': mastering_params['mid_band_db'],
+            'high_band_db': mastering_params['high_band_db'],
+            'target_lufs': mastering_params.get('target_lufs'),
+            'max_true_peak': mastering_params.get('max_true_peak')
+        }
+    }
+
+    # Fallback opcional: waveforms em PNG com matplotlib (servidos como arquivos estáticos)
+    if waveform_png or waveform_base64:
+        report_progress(job_id, 80, 'waveforms')
+        original_signal, peaks_rate = original_peaks.to_signal()
+        original_waveform_filename, original_waveform_path = generate_beautiful_waveform(original_signal, peaks_rate, 'Música Original', 'original_waveform', source_sample_rate=target_sr)
+        mastered_signal, peaks_rate = mastered_peaks.to_signal()
+        mastered_waveform_filename, mastered_waveform_path = generate_beautiful_waveform(mastered_signal, peaks_rate, 'Música Masterizada', 'mastered_waveform', source_sample_rate=target_sr)
+
+        # A URL é montada em api_job_result (o worker não tem contexto de requisição)
+        result['original_waveform_filename'] = original_waveform_filename
+        result['mastered_waveform_filename'] = mastered_waveform_filename
+
+        # Base64 embutido no JSON apenas quando pedido explicitamente
+        if waveform_base64:
             with open(original_waveform_path, 'rb') as f:
-                original_waveform_b64 = base64.b64encode(f.read()).decode()
+                result['original_waveform'] = base64.b64encode(f.read()).decode()
             with open(mastered_waveform_path, 'rb') as f:
-                mastered_waveform_b64 = base64.b64encode(f.read()).decode()
+                result['mastered_waveform'] = base64.b64encode(f.read()).decode()
 
-            # Registrar música masterizada no banco de dados
-            original_filename = os.path.basename(target_path)
-            record_mastered_song(current_user.id, session_id, original_filename, mastered_filename)
+    return result
 
-            return jsonify({
-                'success': True,
-                'session_id': session_id,
-                'target_path': target_path,
-                'reference_path': reference_path,
-                'output_filename': mastered_filename,
-                'original_waveform': original_waveform_b64,
-                'mastered_waveform': mastered_waveform_b64,
-                'params': {
-                    'use_compressor': True,
-                    'compressor_threshold': -24,
-                    'compressor_ratio': 1.8,
-                    'gain_db': 1.2,
-                    'use_limiter': True,
-                    'limiter_threshold': -0.8
-                }
-            })
+def _get_user_job(job_id):
+    job = job_manager.get(job_id)
+    if not job or job['owner_id'] != current_user.id:
+        return None
+    return job
 
-        except Exception as e:
-            return jsonify({'success': False, 'error': f'Erro na masterização: {str(e)}'})
+@app.route('/api/jobs/<job_id>')
+@login_required_custom
+def api_job_status(job_id):
+    job = _get_user_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job não encontrado'}), 404
+
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': job['status'],
+        'progress': job['progress'],
+        'stage': job['stage'],
+        'error': job['error']
+    })
+
+@app.route('/api/jobs/<job_id>/result')
+@login_required_custom
+def api_job_result(job_id):
+    job = _get_user_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job não encontrado'}), 404
+
+    if job['status'] == JOB_FAILED:
+        return jsonify({'success': False, 'status': job['status'], 'error': f"Erro na masterização: {job['error']}"})
+    if job['status'] != JOB_DONE:
+        return jsonify({'success': False, 'status': job['status'], 'progress': job['progress'], 'error': 'Job ainda não concluído'}), 202
+
+    result = dict(job['result'])
+    result['success'] = True
+    for kind in ('original', 'mastered'):
+        filename = result.get(f'{kind}_waveform_filename')
+        if filename:
+            result[f'{kind}_waveform_url'] = url_for('waveform_image', filename=filename)
+    return jsonify(result)
+
+def store_local_audio(stream, dest, size=None):
+    """
+    Grava um áudio local (ex.: arquivo aberto pela CLI) pelo content store, com probe do formato
+    """
+    store_stream(stream, dest, probe=AudioProbe(size), max_bytes=MAX_UPLOAD_BYTES)
 
+def batch_mastering_params(params):
+    """
+    Parâmetros informados para o lote (ValueError se inválidos). Os que faltarem
+    vêm da análise da referência de cada faixa ou dos valores padrão da cadeia.
+    """
+    try:
+        mastering_params = {name: float(params[name]) for name in MASTERING_PARAM_DEFAULTS if name in params}
+    except (TypeError, ValueError):
+        raise ValueError('Parâmetros de masterização inválidos')
+    mastering_params.update(parse_loudness_target(params))
+    mastering_params.update(parse_preset(params))
+    return mastering_params
+
+def submit_mastering_batch(user_id, targets, reference, mastering_params, streaming=False,
+                           album=False, album_target_db=None):
+    """
+    Grava as faixas (uma sessão por faixa) e a referência compartilhada e coloca o lote na fila.
+    `targets` é uma lista de (nome original, store(destino)); `reference` é um store(destino) ou None.
+    A referência é gravada uma vez e ligada (hard link) nas demais sessões.
+    Com `album`, todas as faixas são analisadas antes e renderizadas uma vez no modo alvo
+    de loudness, com o mesmo alvo (`album_target_db` ou a média prevista do álbum).
+    """
+    if not targets:
+        raise ValueError('Nenhuma faixa enviada')
+    if len(targets) > BATCH_MAX_TRACKS:
+        raise ValueError(f'Lote com mais de {BATCH_MAX_TRACKS} faixas')
+    mastering_params = batch_mastering_params(mastering_params)
+
+    tracks = []
+    shared_reference = None
+    for filename, store in targets:
+        session_id = str(uuid.uuid4())
+        target_path = upload_path(f"{session_id}_target.wav")
+        store(target_path)
+        storage_index.add(target_path)
+
+        reference_path = None
+        if reference:
+            reference_path = upload_path(f"{session_id}_reference.wav")
+            if shared_reference is None:
+                reference(reference_path)
+                shared_reference = reference_path
+            else:
+                link_or_copy(shared_reference, reference_path)
+            storage_index.add(reference_path)
+
+        tracks.append({
+            'filename': filename,
+            'session_id': session_id,
+            'args': (session_id, target_path, reference_path, mastering_params),
+            'analysis_args': (target_path, reference_path, mastering_params)
+        })
+
+    if album:
+        return batch_manager.submit(
+            user_id, tracks, run_batch_track,
+            analyze=analyze_batch_track,
+            plan=lambda args_list, analyses: plan_album_gains(args_list, analyses, album_target_db),
+            streaming=streaming
+        )
+    return batch_manager.submit(user_id, tracks, run_batch_track, streaming=streaming)
+
+@app.route('/api/batch', methods=['POST'])
+@login_required_custom
+def api_batch_create():
+    """
+    Lote de masterização: várias faixas (target_files ou target_upload_ids), uma referência
+    opcional (reference_file ou reference_upload_id) e os mesmos parâmetros (JSON em `params`).
+    Com album=true, as faixas saem com a mesma loudness (alvo em `album_target_db`, opcional).
+    """
+    try:
+        user_id = current_user.id
+        targets = []
+        for target_file in request.files.getlist('target_files'):
+            if target_file.filename:
+                targets.append((secure_filename(target_file.filename),
+                                lambda dest, f=target_file: store_stream(f.stream, dest, probe=AudioProbe(), max_bytes=MAX_UPLOAD_BYTES)))
+        upload_ids = [upload_id for value in request.form.getlist('target_upload_ids') for upload_id in value.split(',') if upload_id]
+        for upload_id in upload_ids:
+            upload = chunked_uploads.get(upload_id, user_id)
+            if upload is None:
+                return jsonify({'success': False, 'error': 'Upload não encontrado ou expirado'}), 404
+            targets.append((secure_filename(upload.filename),
+                            lambda dest, upload_id=upload_id: chunked_uploads.consume(upload_id, user_id, dest)))
+
+        reference = None
+        reference_upload_id = request.form.get('reference_upload_id')
+        reference_file = request.files.get('reference_file')
+        if reference_upload_id:
+            reference = lambda dest: chunked_uploads.consume(reference_upload_id, user_id, dest)
+        elif reference_file and reference_file.filename:
+            reference = lambda dest: store_stream(reference_file.stream, dest, probe=AudioProbe(), max_bytes=MAX_UPLOAD_BYTES)
+
+        try:
+            params = json.loads(request.form.get('params') or '{}')
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Parâmetros de masterização inválidos'}), 400
+        if not isinstance(params, dict):
+            return jsonify({'success': False, 'error': 'Parâmetros de masterização inválidos'}), 400
+
+        album_target_db = request.form.get('album_target_db')
+        batch_id = submit_mastering_batch(user_id, targets, reference, params,
+                                          streaming=parse_bool(request.form.get('streaming')),
+                                          album=parse_bool(request.form.get('album')),
+                                          album_target_db=float(album_target_db) if album_target_db else None)
+        return jsonify({
+            'success': True,
+            'batch_id': batch_id,
+            'total': len(targets),
+            'status': JOB_QUEUED,
+            'status_url': url_for('api_batch_status', batch_id=batch_id)
+        })
+
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    except RequestEntityTooLarge as e:
+        return request_too_large(e)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': f'Erro geral: {str(e)}'})
 
+@app.route('/api/batch/<batch_id>')
+@login_required_custom
+def api_batch_status(batch_id):
+    """
+    Progresso de cada faixa do lote e vazão agregada
+    """
+    status = batch_manager.status(batch_id, current_user.id)
+    if not status:
+        return jsonify({'success': False, 'error': 'Lote não encontrado'}), 404
+    return jsonify({'success': True, **status})
+
 @app.route('/masterize', methods=['POST'])
 @login_required_custom
 def masterize():
@@ -1003,12 +1615,27 @@ def masterize():
             data = {
                 'session_id': request.form.get('session_id'),
                 'params': {
-                    'compressor_threshold': request.form.get('compressor_threshold', -24),
-                    'compressor_ratio': request.form.get('compressor_ratio', 1.8),
-                    'gain_db': request.form.get('gain_db', 1.2),
-                    'limiter_threshold': request.form.get('limiter_threshold', -0.8)
+                    'preset': request.form.get('preset'),
+                    'compressor_threshold': request.form.get('compressor_threshold'),
+                    'compressor_ratio': request.form.get('compressor_ratio'),
+                    'gain_db': request.form.get('gain_db'),
+                    'limiter_threshold': request.form.get('limiter_threshold'),
+                    'low_shelf_db': request.form.get('low_shelf_db'),
+                    'high_shelf_db': request.form.get('high_shelf_db'),
+                    'low_band_db': request.form.get('low_band_db'),
+                    'mid_band_db': request.form.get('mid_band_db'),
+                    'high_band_db': request.form.get('high_band_db'),
+                    'target_lufs': request.form.get('target_lufs'),
+                    'max_true_peak': request.form.get('max_true_peak')
                 },
-                'target_path': request.form.get('target_path')
+                'target_path': request.form.get('target_path'),
+                'preview': request.form.get('preview'),
+                'preview_start': request.form.get('preview_start'),
+                'preview_duration': request.form.get('preview_duration'),
+                'preview_format': request.form.get('preview_format'),
+                'streaming': request.form.get('streaming'),
+                'waveform_png': request.form.get('waveform_png'),
+                'waveform_base64': request.form.get('waveform_base64')
             }
         
         if not data:
@@ -1020,58 +1647,92 @@ def masterize():
         
         if not session_id or not target_path:
             return jsonify({'success': False, 'error': 'Session ID ou target path não fornecidos'})
+        # Só arquivos de sessão em uploads/ (em qualquer shard, ou ainda no local antigo)
+        target_path = find_upload(secure_filename(os.path.basename(target_path)))
 
-        compressor_threshold = float(params.get('compressor_threshold', -24))
-        compressor_ratio = float(params.get('compressor_ratio', 1.8))
-        gain_db = float(params.get('gain_db', 1.2))
-        limiter_threshold = float(params.get('limiter_threshold', -0.8))
+        # Valores que faltarem vêm dos padrões do preset da cadeia
+        try:
+            preset = board_pool.preset(params.get('preset'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
+        mastering_params = {
+            name: float(default if params.get(name) in (None, '') else params[name])
+            for name, default in preset.params.items()
+        }
+        mastering_params['preset'] = preset.name
+        # Modo alvo de loudness (opcional): o gain_db passa a ser o ponto de partida do drive
+        mastering_params.update(parse_loudness_target(params))
 
         if not os.path.exists(target_path):
             return jsonify({'success': False, 'error': 'Arquivo de música não encontrado'})
 
-        # Verificar se existe arquivo de referência
-        reference_path = target_path.replace('_target.wav', '_reference.wav')
-        if not os.path.exists(reference_path):
-            reference_path = target_path  # Usar o próprio arquivo como referência
-
         try:
-            target_audio, target_sr = librosa.load(target_path, sr=None)
-            
-            # Se não houver arquivo de referência, usar o próprio arquivo como referência
-            if os.path.exists(reference_path) and reference_path != target_path:
-                reference_audio, reference_sr = librosa.load(reference_path, sr=None)
-            else:
-                reference_audio = target_audio
-                reference_sr = target_sr
-
-            # Aplicar masterização profissional
-            mastering_params = {
-                'compressor_threshold': compressor_threshold,
-                'compressor_ratio': compressor_ratio,
-                'gain_db': gain_db,
-                'limiter_threshold': limiter_threshold
-            }
-            mastered_audio = apply_professional_mastering(target_audio, target_sr, mastering_params)
+            preview = parse_bool(data.get('preview'))
 
             mastered_filename = f"mastered_{session_id}.wav"
-            mastered_path = os.path.join('uploads', mastered_filename)
-            sf.write(mastered_path, mastered_audio, target_sr)
-
-            # Gerar waveform otimizado (mais rápido)
-            mastered_waveform_filename, mastered_waveform_path = generate_fast_waveform(mastered_audio, target_sr, 'Música Masterizada', session_id, 'mastered_waveform')
-
-            # Converter waveform para base64
-            with open(mastered_waveform_path, 'rb') as f:
-                waveform_b64 = base64.b64encode(f.read()).decode()
-
-            return jsonify({
+            mastered_path = upload_path(mastered_filename)
+
+            use_streaming = not preview and should_stream(target_path, parse_bool(data.get('streaming')))
+            audio_hash = content_hash(target_path)
+            cache_key = None
+            if not preview:
+                cache_key = result_key(audio_hash, mastering_params, chain_version(mastering_params),
+                                       mode='streaming' if use_streaming else 'memory')
+
+            if cache_key and restore_result(cache_key, mastered_path):
+                # Combinação de parâmetros já masterizada para este áudio
+                mastered_peaks = load_or_build_peaks(mastered_path)
+                loudness = load_or_measure_loudness(mastered_path)
+            elif use_streaming:
+                # Faixa longa: masterizar em blocos sem carregar o arquivo inteiro
+                info, _, mastered_peaks = master_file_streaming(target_path, mastered_path, mastering_params)
+                mastering_params = info['params']
+                loudness = info['loudness']
+                store_result(cache_key, mastered_path)
+            else:
+                # Áudio decodificado vem do cache: ajustes repetidos não decodificam de novo
+                target_audio, target_sr = audio_cache.get(target_path, session_id)
+
+                # Modo preview: processar só um trecho e devolver áudio comprimido
+                if preview:
+                    pre_gain = stage_cache.peek(pre_gain_key(audio_hash, mastering_params))
+                    return render_preview_response(target_audio, target_sr, mastering_params, data, pre_gain)
+
+                # Aplicar masterização profissional; compressor e EQ vêm do cache de estágios
+                # quando só gain/limiter mudaram desde o último render
+                mastered_audio, mastering_params, loudness = render_master(
+                    target_audio, target_sr, mastering_params, audio_hash=audio_hash, session_id=session_id)
+                write_audio_file(mastered_path, mastered_audio, target_sr)
+                mastered_peaks = save_peaks(mastered_path, build_peaks(mastered_audio, target_sr))
+                loudness = save_loudness(mastered_path, loudness)
+                store_result(cache_key, mastered_path)
+            storage_index.add(mastered_path)
+            update_mastered_loudness(mastered_filename, loudness)
+
+            result = {
                 'success': True,
                 'mastered_filename': mastered_filename,
-                'waveform_filename': mastered_waveform_filename,
-                'mastered_waveform': waveform_b64,
                 'output_filename': mastered_filename,
+                'mastered_version': audio_version(mastered_path),
+                'loudness': loudness,
+                'params': mastering_params,
                 'message': 'Masterização concluída com sucesso!'
-            })
+            }
+
+            # Fallback opcional: waveform em PNG (otimizado para velocidade), servido por URL
+            waveform_base64 = parse_bool(data.get('waveform_base64'))
+            if parse_bool(data.get('waveform_png')) or waveform_base64:
+                mastered_signal, peaks_rate = mastered_peaks.to_signal()
+                mastered_waveform_filename, mastered_waveform_path = generate_fast_waveform(mastered_signal, peaks_rate, 'Música Masterizada', 'mastered_waveform')
+                result['waveform_filename'] = mastered_waveform_filename
+                result['mastered_waveform_url'] = url_for('waveform_image', filename=mastered_waveform_filename)
+
+                # Base64 embutido no JSON apenas quando pedido explicitamente
+                if waveform_base64:
+                    with open(mastered_waveform_path, 'rb') as f:
+                        result['mastered_waveform'] = base64.b64encode(f.read()).decode()
+
+            return jsonify(result)
 
         except Exception as e:
             return jsonify({'success': False, 'error': f'Erro na masterização: {str(e)}'})
@@ -1079,38 +1740,174 @@ def masterize():
     except Exception as e:
         return jsonify({'success': False, 'error': f'Erro geral: {str(e)}'})
 
+def render_preview_response(audio_data, sample_rate, mastering_params, data, pre_gain=None):
+    """
+    Masteriza apenas um trecho curto e retorna o resultado como áudio comprimido.
+    `pre_gain` é o sinal antes do Gain da faixa inteira, se já estiver em cache.
+    """
+    preview_format = str(data.get('preview_format') or 'ogg').lower()
+    if preview_format not in PREVIEW_FORMATS:
+        return jsonify({'success': False, 'error': f'Formato de preview inválido: {preview_format}'})
+
+    total_duration = frame_count(audio_data) / sample_rate
+    start = float(data.get('preview_start') or 0)
+    duration = float(data.get('preview_duration') or PREVIEW_DEFAULT_SECONDS)
+    duration = min(max(duration, 1.0), PREVIEW_MAX_SECONDS)
+    start = min(max(start, 0.0), max(total_duration - duration, 0.0))
+
+    preview_audio = render_preview(audio_data, sample_rate, mastering_params, start, duration, pre_gain)
+
+    # Codificar em memória no formato comprimido escolhido
+    container, subtype, mimetype = PREVIEW_FORMATS[preview_format]
+    buffer = io.BytesIO()
+    write_audio(buffer, preview_audio, sample_rate, format=container, subtype=subtype)
+    buffer.seek(0)
+
+    response = send_file(buffer, mimetype=mimetype)
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Preview-Start'] = f'{start:.3f}'
+    response.headers['X-Preview-Duration'] = f'{frame_count(preview_audio) / sample_rate:.3f}'
+    return response
+
 @app.route('/download/<filename>')
 @login_required_custom
 def download(filename):
-    file_path = os.path.join('uploads', filename)
+    """
+    Download do arquivo como está (WAV original, bit a bit) ou, com ?format=wav|flac,
+    ?sample_rate= e ?bit_depth=16|24|32, de uma exportação do master nesse formato
+    """
+    filename = secure_filename(filename)
+    file_path = find_upload(filename)
     if os.path.exists(file_path):
-        # Registrar download no banco de dados
+        try:
+            settings = parse_export_settings(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
         file_type = 'mastered' if filename.startswith('mastered_') else 'original'
+        if settings is None:
+            record_download(current_user.id, file_type, filename)
+            return send_file(file_path, as_attachment=True)
+
+        try:
+            export_file = export_manager.get(file_path, settings)
+        except Exception as e:
+            print(f"Erro ao exportar {filename}: {str(e)}")
+            return jsonify({'success': False, 'error': 'Não foi possível exportar o arquivo'}), 500
+        # Registrar download no banco de dados só com a exportação pronta
         record_download(current_user.id, file_type, filename)
-        
-        return send_file(file_path, as_attachment=True)
+        return send_file(export_file, as_attachment=True, conditional=True,
+                         mimetype=EXPORT_FORMATS[settings['format']][2],
+                         download_name=export_filename(filename, settings, sf.info(file_path).samplerate))
     else:
         flash('Arquivo não encontrado.', 'error')
         return redirect(url_for('masterizacao'))
 
+def audio_version(path):
+    """
+    Token de versão do áudio (hash do conteúdo): muda só quando o arquivo muda
+    """
+    return content_hash(path)[:AUDIO_VERSION_LENGTH]
+
+def send_audio_file(path, mimetype='audio/wav'):
+    """
+    Serve o áudio com Range (206), ETag forte pelo conteúdo e 304 Not Modified.
+    Com ?v=<versão atual> a resposta é imutável e fica no cache do navegador.
+
+    O formato sai de ?format=opus|mp3|flac|wav ou do cabeçalho Accept: as versões
+    comprimidas são geradas na primeira requisição e reaproveitadas depois.
+    """
+    version = audio_version(path)
+    fmt = negotiate_format(request.args.get('format'), request.accept_mimetypes)
+    if fmt is None:
+        return jsonify({'success': False, 'error': 'Formato de áudio inválido'}), 400
+
+    etag = version
+    if fmt != 'wav':
+        try:
+            path = get_rendition(path, version, fmt)
+        except Exception as e:
+            print(f"Erro ao gerar a versão {fmt} de {path}: {str(e)}")
+            return jsonify({'success': False, 'error': 'Não foi possível converter o áudio'}), 500
+        mimetype = RENDITION_FORMATS[fmt][3]
+        etag = f"{version}-{fmt}"
+
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=etag)
+    if request.args.get('v') == version:
+        response.headers['Cache-Control'] = f'private, max-age={AUDIO_CACHE_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    if not request.args.get('format'):
+        response.vary.add('Accept')
+    return response
+
 @app.route('/audio/original/<session_id>')
 @login_required_custom
 def audio_original(session_id):
-    file_path = os.path.join('uploads', f"{session_id}_target.wav")
+    file_path = find_upload(f"{secure_filename(session_id)}_target.wav")
     if os.path.exists(file_path):
-        return send_file(file_path, mimetype='audio/wav')
+        return send_audio_file(file_path)
     else:
         return jsonify({'error': 'Arquivo não encontrado'})
 
 @app.route('/audio/mastered/<session_id>')
 @login_required_custom
 def audio_mastered(session_id):
-    file_path = os.path.join('uploads', f"mastered_{session_id}.wav")
+    file_path = find_upload(f"mastered_{secure_filename(session_id)}.wav")
     if os.path.exists(file_path):
-        return send_file(file_path, mimetype='audio/wav')
+        return send_audio_file(file_path)
     else:
         return jsonify({'error': 'Arquivo não encontrado'})
 
+def waveform_audio_path(session_id, kind):
+    if kind == 'original':
+        return find_upload(f"{secure_filename(session_id)}_target.wav")
+    if kind == 'mastered':
+        return find_upload(f"mastered_{secure_filename(session_id)}.wav")
+    return None
+
+@app.route('/api/waveform/<session_id>/<kind>')
+@login_required_custom
+def api_waveform_peaks(session_id, kind):
+    """
+    Picos min/max do áudio para desenhar o waveform no navegador (canvas)
+    """
+    try:
+        audio_path = waveform_audio_path(session_id, kind)
+        if not audio_path:
+            return jsonify({'success': False, 'error': 'Tipo de waveform inválido'}), 400
+        if not os.path.exists(audio_path):
+            return jsonify({'success': False, 'error': 'Arquivo não encontrado'}), 404
+
+        pyramid = load_or_build_peaks(audio_path)
+
+        # Sidecar binário completo (todos os níveis) para clientes que fazem zoom
+        if request.args.get('format') == 'binary':
+            return send_file(peaks_path(audio_path), mimetype='application/octet-stream')
+
+        points = request.args.get('points', 2000, type=int)
+        level = request.args.get('level', type=int)
+        if level is None or not 0 <= level < len(pyramid.levels):
+            level = pyramid.level_for_points(max(points, 1))
+
+        payload = pyramid.to_json(level)
+        payload['success'] = True
+        payload['level'] = level
+        payload['levels'] = len(pyramid.levels)
+        return jsonify(payload)
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Erro ao carregar waveform: {str(e)}'})
+
+@app.route('/waveforms/<filename>')
+def waveform_image(filename):
+    """
+    Serve o PNG do waveform com cache longo (o nome muda quando o conteúdo muda)
+    """
+    response = send_from_directory(WAVEFORM_RESULTS_DIR, filename, mimetype='image/png',
+                                   max_age=WAVEFORM_CACHE_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={WAVEFORM_CACHE_MAX_AGE}, immutable'
+    return response
+
 @app.route('/enviar_contato', methods=['POST'])
 @login_required_custom
 def enviar_contato():
@@ -1120,9 +1917,10 @@ def enviar_contato():
     flash('Mensagem enviada com sucesso! Entraremos em contato em breve.', 'success')
     return redirect(url_for('servicos'))
 
-def generate_beautiful_waveform(audio_data, sample_rate, title, session_id, filename_suffix):
+def generate_beautiful_waveform(audio_data, sample_rate, title, filename_suffix, source_sample_rate=None):
     """
-    Gera um waveform bonito e profissional como no FL Studio (música completa otimizada)
+    Gera um waveform bonito e profissional como no FL Studio (música completa otimizada).
+    Para picos (waveform_peaks), source_sample_rate é a taxa do áudio original.
     """
     import numpy as np
     import matplotlib.pyplot as plt
@@ -1192,10 +1990,11 @@ def generate_beautiful_waveform(audio_data, sample_rate, title, session_id, file
     ax.tick_params(axis='both', colors='#888888', labelsize=8)
     
     # Informações técnicas com duração completa
-    if len(audio_data) > max_points:
-        info_text = f'SR: {sample_rate}Hz | Duração: {duration:.1f}s | Otimizado para visualização'
+    display_sample_rate = source_sample_rate or sample_rate
+    if len(audio_data) > max_points or source_sample_rate:
+        info_text = f'SR: {display_sample_rate}Hz | Duração: {duration:.1f}s | Otimizado para visualização'
     else:
-        info_text = f'SR: {sample_rate}Hz | Duração: {duration:.1f}s | Música Completa'
+        info_text = f'SR: {display_sample_rate}Hz | Duração: {duration:.1f}s | Música Completa'
     
     ax.text(0.02, 0.98, info_text, transform=ax.transAxes, 
             fontsize=7, color='#888888', 
@@ -1205,15 +2004,9 @@ def generate_beautiful_waveform(audio_data, sample_rate, title, session_id, file
     plt.tight_layout()
     
     # Salvar com resolução otimizada (150 DPI em vez de 300)
-    waveform_filename = f"{filename_suffix}_{session_id}.png"
-    waveform_path = os.path.join('static', 'results', waveform_filename)
-    plt.savefig(waveform_path, dpi=150, bbox_inches='tight', 
-                facecolor='#0a0a0a', edgecolor='none')
-    plt.close()
-    
-    return waveform_filename, waveform_path
+    return save_waveform_figure(filename_suffix, dpi=150)
 
-def generate_fast_waveform(audio_data, sample_rate, title, session_id, filename_suffix):
+def generate_fast_waveform(audio_data, sample_rate, title, filename_suffix):
     """
     Gera um waveform otimizado para velocidade (música completa otimizada)
     """
@@ -1284,161 +2077,340 @@ def generate_fast_waveform(audio_data, sample_rate, title, session_id, filename_
     plt.tight_layout()
     
     # Salvar com resolução baixa para máxima velocidade
-    waveform_filename = f"{filename_suffix}_{session_id}.png"
-    waveform_path = os.path.join('static', 'results', waveform_filename)
-    plt.savefig(waveform_path, dpi=100, bbox_inches='tight', 
+    return save_waveform_figure(filename_suffix, dpi=100)
+
+def save_waveform_figure(filename_suffix, dpi):
+    """
+    Salva a figura atual em static/results com o hash do conteúdo no nome do arquivo
+    """
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight', 
                 facecolor='#0a0a0a', edgecolor='none')
     plt.close()
+    png_bytes = buffer.getvalue()
+    
+    content_hash = hashlib.sha256(png_bytes).hexdigest()[:16]
+    waveform_filename = f"{filename_suffix}_{content_hash}.png"
+    waveform_path = os.path.join(WAVEFORM_RESULTS_DIR, waveform_filename)
+    
+    # Mesmo conteúdo = mesmo arquivo: não reescrever, só marcar o uso para a retenção
+    if os.path.exists(waveform_path):
+        os.utime(waveform_path)
+    else:
+        tmp_path = f"{waveform_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(png_bytes)
+        os.replace(tmp_path, waveform_path)
     
     return waveform_filename, waveform_path
 
-def apply_professional_mastering(audio_data, sample_rate, params):
+def render_preview(audio_data, sample_rate, params, start_seconds, duration_seconds, pre_gain=None):
     """
-    Aplica masterização profissional com parâmetros otimizados para som limpo
+    Aplica a mesma cadeia de apply_professional_mastering a um trecho do áudio.
+    Um pequeno pre-roll antes do trecho aquece o compressor/limiter e é descartado.
+    Com `pre_gain` (sinal antes do Gain da faixa inteira, do cache de estágios),
+    só os estágios do Gain em diante rodam sobre o trecho.
+    No modo alvo de loudness o preview usa o gain_db atual, sem resolver o alvo
+    (o trecho não representa a loudness da faixa inteira).
     """
-    from pedalboard import Pedalboard, Compressor, Gain, Limiter
-    
-    # Parâmetros otimizados para masterização limpa e profissional
-    compressor_threshold = float(params.get('compressor_threshold', -24))
-    compressor_ratio = float(params.get('compressor_ratio', 1.8))
-    gain_db = float(params.get('gain_db', 1.2))
-    limiter_threshold = float(params.get('limiter_threshold', -0.8))
-    
+    start = int(start_seconds * sample_rate)
+    end = min(start + int(duration_seconds * sample_rate), frame_count(audio_data))
+    preroll = min(start, int(PREVIEW_PREROLL_SECONDS * sample_rate))
+
+    if pre_gain is not None:
+        mastered_excerpt = apply_from_gain(pre_gain[:, start - preroll:end], sample_rate, params)
+    else:
+        excerpt = as_channels_first(audio_data[..., start - preroll:end])
+        mastered_excerpt = apply_professional_mastering(excerpt, sample_rate, params)
+    return mastered_excerpt[:, preroll:]
+
+# Versão do processamento da cadeia: faz parte da chave dos resultados em cache, junto
+# com o fingerprint do preset (mudanças em presets/*.json já mudam a chave).
+# Incrementar sempre que o processamento fora dos presets mudar o áudio gerado.
+PROFESSIONAL_CHAIN_VERSION = 2
+
+def chain_version(params):
+    """
+    Identidade da cadeia usada com `params`: versão do processamento e fingerprint do preset
+    """
+    return f"{PROFESSIONAL_CHAIN_VERSION}:{board_pool.preset(params.get('preset')).fingerprint}"
+
+def pre_gain_key(audio_hash, params):
+    """
+    Chave do sinal antes do Gain no cache de estágios: só os parâmetros ligados aos
+    estágios antes do Gain no preset entram nela
+    """
+    preset = board_pool.preset(params.get('preset'))
+    return stage_key(audio_hash, 'pre_gain', params, chain_version(params), preset.pre_gain_params)
+
+def write_audio_file(path, audio_data, sample_rate):
+    """
+    Grava o WAV (canais, frames) em um temporário e substitui o destino (que pode ser
+    um hard link compartilhado)
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
     try:
-        # Tentar usar filtros se disponíveis
-        from pedalboard import HighpassFilter, LowpassFilter
-        
-        board = Pedalboard([
-            # High-pass filter mais alto para remover ruídos de baixa frequência
-            HighpassFilter(cutoff_frequency_hz=30),
-            
-            # Compressor mais suave para preservar dinâmica natural
-            Compressor(
-                threshold_db=compressor_threshold,
-                ratio=compressor_ratio,
-                attack_ms=15,  # Ataque mais lento para preservar transientes
-                release_ms=200  # Release mais longo para naturalidade
-            ),
-            
-            # Gain mais baixo para evitar distorção
-            Gain(gain_db=gain_db),
-            
-            # Low-pass filter mais baixo para reduzir chiado
-            LowpassFilter(cutoff_frequency_hz=18000),
-            
-            # Limiter mais suave para evitar clipping
-            Limiter(
-                threshold_db=limiter_threshold,
-                release_ms=100  # Release mais longo para suavidade
-            )
-        ])
-    except ImportError:
-        # Fallback para versão básica se filtros não estiverem disponíveis
-        board = Pedalboard([
-            # Compressor mais suave para preservar dinâmica natural
-            Compressor(
-                threshold_db=compressor_threshold,
-                ratio=compressor_ratio,
-                attack_ms=15,  # Ataque mais lento para preservar transientes
-                release_ms=200  # Release mais longo para naturalidade
-            ),
-            
-            # Gain mais baixo para evitar distorção
-            Gain(gain_db=gain_db),
-            
-            # Limiter mais suave para evitar clipping
-            Limiter(
-                threshold_db=limiter_threshold,
-                release_ms=100  # Release mais longo para suavidade
-            )
-        ])
-    
-    # Aplicar masterização
-    mastered_audio = board(audio_data, sample_rate)
-    
-    # Normalização mais suave para preservar dinâmica
-    max_amplitude = np.max(np.abs(mastered_audio))
-    if max_amplitude > 0.98:
-        normalization_factor = 0.98 / max_amplitude
-        mastered_audio = mastered_audio * normalization_factor
-    
+        write_audio(tmp_path, audio_data, sample_rate, format='WAV')
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def should_stream(target_path, requested=False):
+    """
+    Decide se a faixa deve ser masterizada em blocos (pedido explícito ou faixa longa)
+    """
+    if requested:
+        return True
+    try:
+        return sf.info(target_path).duration > STREAMING_THRESHOLD_SECONDS
+    except Exception:
+        # Formato que o soundfile não lê: seguir pelo caminho em memória (read_audio)
+        return False
+
+def master_file_streaming(target_path, mastered_path, params, progress=None, with_original_peaks=False,
+                          analysis=None):
+    """
+    Masteriza o arquivo em blocos com a cadeia do preset, gravando direto em mastered_path.
+    Os sidecars de picos e de loudness (`info['loudness']`) são gravados no caminho.
+    No modo alvo de loudness, `info['params']` traz o gain_db resolvido; com `analysis`
+    (analyze_pre_gain com os mesmos parâmetros) o proxy e os trechos dela são reaproveitados.
+    Retorna (info, picos_original, picos_masterizado).
+    """
+    target_info = sf.info(target_path)
+    sample_rate = target_info.samplerate
+    original_builder = PeakPyramidBuilder(sample_rate) if with_original_peaks else None
+    mastered_builder = PeakPyramidBuilder(sample_rate)
+
+    meter = LoudnessMeter(sample_rate, true_peak=True)
+
+    if not has_loudness_target(params):
+        with board_pool.checkout(params) as chain:
+            info = stream_master_file(target_path, mastered_path, chain.board, progress=progress,
+                                      input_peaks=original_builder, output_peaks=mastered_builder,
+                                      output_meter=meter)
+    else:
+        # Modo alvo: os estágios antes do Gain rodam uma vez, gravando o sinal
+        # intermediário e o proxy de análise; o drive é resolvido no proxy e só
+        # os estágios do Gain em diante rodam sobre o intermediário
+        pre_gain_path = f"{mastered_path}.{uuid.uuid4().hex}.pregain.wav"
+        try:
+            reused = analysis_proxy(analysis, sample_rate)
+            proxy = None if reused else ProxyBuilder(sample_rate, proxy_rate(sample_rate, target_info.frames),
+                                                     target_info.channels)
+            with board_pool.checkout(params) as chain:
+                stream_process_file(target_path, pre_gain_path, chain.pre_gain,
+                                    progress=(lambda fraction: progress(0.4 * fraction)) if progress else None,
+                                    inputs=[original_builder] if original_builder else [],
+                                    outputs=[proxy] if proxy else [])
+            if reused:
+                signal, rate, excerpt = reused
+            else:
+                signal, rate = proxy.build(), proxy.rate
+                with sf.SoundFile(pre_gain_path) as f:
+                    excerpt = []
+                    for start, end in calibration_ranges(signal, rate, sample_rate, target_info.frames):
+                        f.seek(start)
+                        excerpt.append(f.read(end - start, dtype='float32', always_2d=True).T)
+                excerpt = np.concatenate(excerpt, axis=1)
+            params = solve_target_drive(signal, rate, excerpt, sample_rate, params)
+
+            with board_pool.checkout(params) as chain:
+                info = stream_master_file(
+                    pre_gain_path, mastered_path, chain.from_gain,
+                    progress=(lambda fraction: progress(0.4 + 0.6 * fraction)) if progress else None,
+                    output_peaks=mastered_builder, output_meter=meter,
+                    final_gain=lambda gain: gain * output_trim(meter.report(gain), params['target_lufs'],
+                                                               params['max_true_peak'])
+                )
+        finally:
+            if os.path.exists(pre_gain_path):
+                os.remove(pre_gain_path)
+    info['params'] = params
+
+    original_peaks = save_peaks(target_path, original_builder.build()) if original_builder else None
+    mastered_peaks = save_peaks(mastered_path, mastered_builder.build().scale(info['gain']))
+    info['loudness'] = save_loudness(mastered_path, meter.report(info['gain']))
+    return info, original_peaks, mastered_peaks
+
+def measure_from_gain(audio, audio_rate, params, gain_db):
+    """
+    Relatório de loudness (com true peak) da saída dos estágios do Gain em diante com
+    `gain_db`, a partir do sinal antes do Gain (ex.: o proxy de análise)
+    """
+    meter = LoudnessMeter(audio_rate, true_peak=True)
+    with board_pool.checkout(dict(params, gain_db=gain_db)) as chain:
+        # Filtros acima da Nyquist do proxy não teriam efeito (e a Pedalboard não os aceita)
+        post_board = StageBoard([plugin for plugin in chain.from_gain
+                                 if getattr(plugin, 'cutoff_frequency_hz', 0) < audio_rate / 2])
+        meter.add(post_board(audio, audio_rate))
+    return meter.report()
+
+def solve_target_drive(signal, rate, excerpt, sample_rate, params):
+    """
+    Modo alvo de loudness: resolve no proxy `signal` (ver loudness_target) o gain_db que
+    leva a relação pico/loudness para dentro de `max_true_peak - target_lufs`. `excerpt`
+    são os trechos de calibração do sinal antes do Gain, em taxa completa.
+    Retorna os parâmetros com o gain_db resolvido.
+    """
+    def plr(audio, audio_rate, gain_db):
+        report = measure_from_gain(audio, audio_rate, params, gain_db)
+        return report['true_peak_dbtp'] - report['integrated_lufs']
+
+    plr_offset_at = None
+    if rate != sample_rate:
+        excerpt_proxy = ProxyBuilder(sample_rate, rate, excerpt.shape[0])
+        excerpt_proxy.add(excerpt)
+        excerpt_proxy = excerpt_proxy.build()
+        plr_offset_at = lambda gain_db: plr(excerpt, sample_rate, gain_db) - plr(excerpt_proxy, rate, gain_db)
+
+    gain_db, offset, evaluations = solve_target(
+        lambda gain_db: plr(signal, rate, gain_db), params['gain_db'],
+        params['max_true_peak'] - params['target_lufs'], plr_offset_at
+    )
+    print(f"Alvo {params['target_lufs']} LUFS / {params['max_true_peak']} dBTP: gain_db {gain_db:.2f} "
+          f"({evaluations} avaliações no proxy a {rate}Hz, correção do PLR {offset:+.2f} dB)")
+    return dict(params, gain_db=round(float(gain_db), 2))
+
+def analysis_proxy(analysis, sample_rate):
+    """
+    (proxy, taxa do proxy, trechos de calibração) de uma análise antes do Gain
+    (analyze_pre_gain) feita na mesma taxa, ou None se não houver
+    """
+    if analysis is None or analysis['signal'] is None or analysis['sample_rate'] != sample_rate:
+        return None
+    return analysis['signal'], analysis['rate'], analysis['excerpt']
+
+def master_to_target(audio_data, sample_rate, params, audio_hash=None, session_id=None, analysis=None):
+    """
+    Modo alvo de loudness em memória: estágios antes do Gain uma vez (ou do cache de
+    estágios), drive resolvido no proxy (o de `analysis`, se houver), estágios do Gain
+    em diante uma vez e o trim final medido no master.
+    Retorna (master, parâmetros com o gain_db resolvido, relatório de loudness).
+    """
+    pre_gain = pre_gain_signal(audio_data, sample_rate, params, audio_hash, session_id)
+
+    reused = analysis_proxy(analysis, sample_rate)
+    if reused:
+        signal, rate, excerpt = reused
+    else:
+        frames = frame_count(pre_gain)
+        proxy = ProxyBuilder(sample_rate, proxy_rate(sample_rate, frames), pre_gain.shape[0])
+        proxy.add(pre_gain)
+        signal, rate = proxy.build(), proxy.rate
+        excerpt = np.concatenate([pre_gain[:, start:end] for start, end
+                                  in calibration_ranges(signal, rate, sample_rate, frames)], axis=1)
+    params = solve_target_drive(signal, rate, excerpt, sample_rate, params)
+
+    mastered_audio = apply_from_gain(pre_gain, sample_rate, params)
+    del pre_gain
+
+    meter = LoudnessMeter(sample_rate, true_peak=True)
+    meter.add(mastered_audio)
+    trim = output_trim(meter.report(), params['target_lufs'], params['max_true_peak'])
+    if trim != 1.0:
+        np.multiply(mastered_audio, trim, out=mastered_audio)
+    return mastered_audio, params, meter.report(trim)
+
+def render_master(audio_data, sample_rate, params, audio_hash=None, session_id=None, analysis=None):
+    """
+    Masterização completa em memória, com a medição do master (LUFS, LRA, true peak).
+    Com `audio_hash`, o sinal antes do Gain é reaproveitado pelo cache de estágios; com
+    `analysis` (analyze_pre_gain com os mesmos parâmetros), o proxy do modo alvo.
+    Retorna (master, parâmetros usados, relatório de loudness).
+    """
+    if has_loudness_target(params):
+        return master_to_target(audio_data, sample_rate, params, audio_hash, session_id, analysis)
+    mastered_audio = apply_professional_mastering(audio_data, sample_rate, params, audio_hash, session_id)
+    meter = LoudnessMeter(sample_rate, true_peak=True)
+    meter.add(mastered_audio)
+    return mastered_audio, params, meter.report()
+
+def pre_gain_signal(audio_data, sample_rate, params, audio_hash=None, session_id=None):
+    """
+    Sinal que chega ao Gain (filtros, EQ e compressor). Com `audio_hash`, fica no cache
+    de estágios, indexado pelos parâmetros desses estágios.
+    O array pode ser somente leitura.
+    """
+    def compute():
+        with board_pool.checkout(params) as chain:
+            return chain.pre_gain(as_channels_first(audio_data), sample_rate)
+
+    if audio_hash is None:
+        return compute()
+    return stage_cache.get(pre_gain_key(audio_hash, params), compute, session_id)
+
+def apply_from_gain(pre_gain, sample_rate, params):
+    """
+    Estágios do Gain em diante (gain, low-pass e limiter) e normalização, a partir do
+    sinal antes do Gain
+    """
+    with board_pool.checkout(params) as chain:
+        mastered_audio = chain.from_gain(pre_gain, sample_rate)
+
+    # Normalização mais suave para preservar dinâmica (no próprio buffer de saída)
+    normalize_in_place(mastered_audio)
+
     return mastered_audio
 
-def apply_basic_mastering(audio_data, sample_rate):
+def apply_professional_mastering(audio_data, sample_rate, params, audio_hash=None, session_id=None):
     """
-    Aplica masterização básica com parâmetros seguros
+    Aplica a cadeia de masterização do preset em `params['preset']` (padrão: profissional).
+    `audio_data` é float32 (canais, frames), processado pela Pedalboard sem transposição.
+    Com `audio_hash`, a cadeia roda em duas partes, divididas no Gain, e a primeira
+    (filtros, EQ e compressor) vem do cache de estágios quando só gain/limiter mudaram.
     """
-    from pedalboard import Pedalboard, Compressor, Gain, Limiter
-    
-    # Parâmetros seguros para masterização básica
-    board = Pedalboard([
-        # Compressor suave para controlar picos
-        Compressor(
-            threshold_db=-16,  # Menos agressivo
-            ratio=2.0,         # Ratio mais suave
-            attack_ms=10,      # Ataque mais lento
-            release_ms=150     # Release mais longo
-        ),
-        
-        # Gain moderado
-        Gain(gain_db=1.5),
-        
-        # Limiter com threshold mais alto
-        Limiter(
-            threshold_db=-0.3,
-            release_ms=100
-        )
-    ])
-    
-    # Aplicar masterização
-    mastered_audio = board(audio_data, sample_rate)
+    if audio_hash is not None:
+        pre_gain = pre_gain_signal(audio_data, sample_rate, params, audio_hash, session_id)
+        return apply_from_gain(pre_gain, sample_rate, params)
+
+    # Aplicar masterização com a cadeia do preset (board do pool, parâmetros atualizados no lugar)
+    with board_pool.checkout(params) as chain:
+        mastered_audio = chain.board(as_channels_first(audio_data), sample_rate)
     
-    # Normalizar suavemente
-    max_amplitude = np.max(np.abs(mastered_audio))
-    if max_amplitude > 0.98:
-        normalization_factor = 0.98 / max_amplitude
-        mastered_audio = mastered_audio * normalization_factor
+    # Normalização mais suave para preservar dinâmica (no próprio buffer de saída)
+    normalize_in_place(mastered_audio)
     
     return mastered_audio
 
+def apply_basic_mastering(audio_data, sample_rate):
+    """
+    Aplica masterização básica com parâmetros seguros (preset 'basic')
+    """
+    return apply_professional_mastering(audio_data, sample_rate, dict(board_pool.preset('basic').params, preset='basic'))
+
 def cleanup_missing_files():
     """
-    Remove registros de arquivos que não existem mais na pasta uploads
+    Remove registros de arquivos que não existem mais na pasta uploads.
+    Uma única varredura do diretório; os ausentes saem por diferença de conjuntos
+    e são removidos em lotes.
     """
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
+        existing_tables = db.get_schema()
+        present_files = storage_index.reconcile()
         
-        # Verificar se as tabelas existem
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        existing_tables = [table[0] for table in cursor.fetchall()]
-        
-        # Limpar mastered_songs
-        if 'mastered_songs' in existing_tables:
-            cursor.execute('SELECT id, original_filename, mastered_filename FROM mastered_songs')
-            songs = cursor.fetchall()
+        with db.connect() as conn:
+            cursor = conn.cursor()
             
-            for song_id, original_file, mastered_file in songs:
-                original_exists = os.path.exists(os.path.join('uploads', original_file)) if original_file else False
-                mastered_exists = os.path.exists(os.path.join('uploads', mastered_file)) if mastered_file else False
-                
-                # Se nenhum dos arquivos existe, remover o registro
-                if not original_exists and not mastered_exists:
-                    cursor.execute('DELETE FROM mastered_songs WHERE id = ?', (song_id,))
-                    print(f"Removido registro de música masterizada: {song_id}")
-        
-        # Limpar downloads
-        if 'downloads' in existing_tables:
-            cursor.execute('SELECT id, filename FROM downloads')
-            downloads = cursor.fetchall()
+            # Limpar mastered_songs: remover quando nem o original nem o master existem mais
+            if 'mastered_songs' in existing_tables:
+                cursor.execute('SELECT id, original_filename, mastered_filename FROM mastered_songs')
+                missing_songs = [song_id for song_id, original_file, mastered_file in cursor.fetchall()
+                                 if original_file not in present_files and mastered_file not in present_files]
+                if missing_songs:
+                    db.delete_by_ids(cursor, 'mastered_songs', missing_songs)
+                    print(f"Removidos {len(missing_songs)} registro(s) de músicas masterizadas")
             
-            for download_id, filename in downloads:
-                if filename and not os.path.exists(os.path.join('uploads', filename)):
-                    cursor.execute('DELETE FROM downloads WHERE id = ?', (download_id,))
-                    print(f"Removido registro de download: {download_id}")
-        
-        conn.commit()
-        conn.close()
+            # Limpar downloads
+            if 'downloads' in existing_tables:
+                cursor.execute('SELECT id, filename FROM downloads')
+                missing_downloads = [download_id for download_id, filename in cursor.fetchall()
+                                     if filename and filename not in present_files]
+                if missing_downloads:
+                    db.delete_by_ids(cursor, 'downloads', missing_downloads)
+                    print(f"Removidos {len(missing_downloads)} registro(s) de downloads")
+        
+        dashboard_cache.clear()
         print("Limpeza de arquivos ausentes concluída")
         
     except Exception as e:
@@ -1454,6 +2426,9 @@ if __name__ == '__main__':
         print("Diretórios criados/verificados")
         
         init_db()
+        # Com o reloader do modo debug, só o processo que atende as requisições roda o sweeper
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            retention_sweeper.start()
         print("Aplicação pronta para execução!")
         app.run(debug=True, host='0.0.0.0', port=5002)
     except Exception as e:
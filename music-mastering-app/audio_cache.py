@@ -0,0 +1,142 @@
+"""
+Cache de áudio decodificado (float32, canais x frames) por sessão de masterização.
+
+Mantém os buffers em memória com política LRU e limite total de bytes.
+Quando um buffer sai da memória, a próxima leitura usa um arquivo `.npy`
+ao lado do upload, aberto com memory-map, em vez de decodificar de novo.
+"""
+
+import os
+import uuid
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from audio_io import audio_info, read_audio
+
+# Limites padrão do cache em memória
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get('AUDIO_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+AUDIO_CACHE_MAX_ENTRIES = int(os.environ.get('AUDIO_CACHE_MAX_ENTRIES', 32))
+
+SIDECAR_SUFFIX = '.npy'
+
+
+def sidecar_path(path):
+    """
+    Caminho do arquivo .npy com o áudio decodificado ao lado do upload
+    """
+    return path + SIDECAR_SUFFIX
+
+
+def _sidecar_is_fresh(path, npy_path):
+    try:
+        return os.path.getmtime(npy_path) >= os.path.getmtime(path)
+    except OSError:
+        return False
+
+
+def decode_audio(path, write_sidecar=True):
+    """
+    Decodifica o arquivo (ou abre o .npy em memory-map, se existir) e retorna (audio, sr),
+    com o áudio em float32 (canais, frames)
+    """
+    npy_path = sidecar_path(path)
+
+    if _sidecar_is_fresh(path, npy_path):
+        try:
+            sample_rate, channels, _ = audio_info(path)
+            audio_data = np.load(npy_path, mmap_mode='r')
+            # Sidecars antigos (mono 1-D) são descartados e refeitos
+            if audio_data.ndim == 2 and audio_data.shape[0] == channels and audio_data.dtype == np.float32:
+                return audio_data, sample_rate
+        except Exception as e:
+            print(f"Sidecar inválido {npy_path}, decodificando novamente: {str(e)}")
+
+    audio_data, sample_rate = read_audio(path)
+
+    if write_sidecar:
+        # Escrever em arquivo temporário e renomear para não expor .npy incompleto; nome
+        # único porque o worker e o /masterize podem decodificar o mesmo upload ao mesmo tempo
+        tmp_path = f"{npy_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, audio_data)
+            os.replace(tmp_path, npy_path)
+        except OSError as e:
+            print(f"Não foi possível gravar o sidecar {npy_path}: {str(e)}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return audio_data, sample_rate
+
+
+class DecodedAudioCache:
+    """
+    Cache LRU de buffers decodificados com orçamento total de bytes
+    """
+
+    def __init__(self, max_bytes=AUDIO_CACHE_MAX_BYTES, max_entries=AUDIO_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, session_id=None):
+        """
+        Retorna (audio, sr) do arquivo, usando o cache sempre que possível.
+        O array retornado é somente leitura e não deve ser modificado.
+        """
+        key = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['mtime'] == mtime:
+                self._entries.move_to_end(key)
+                return entry['audio'], entry['sr']
+
+        audio_data, sample_rate = decode_audio(path)
+        if audio_data.flags.writeable:
+            audio_data.setflags(write=False)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self.total_bytes -= old['nbytes']
+            self._entries[key] = {
+                'audio': audio_data,
+                'sr': sample_rate,
+                'mtime': mtime,
+                'nbytes': audio_data.nbytes,
+                'session_id': session_id
+            }
+            self.total_bytes += audio_data.nbytes
+            self._evict_over_budget()
+
+        return audio_data, sample_rate
+
+    def _evict_over_budget(self):
+        # Chamado com o lock adquirido; sempre mantém ao menos a entrada mais recente
+        while len(self._entries) > 1 and (self.total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            _, entry = self._entries.popitem(last=False)
+            self.total_bytes -= entry['nbytes']
+
+    def evict_session(self, session_id):
+        """
+        Remove da memória todos os buffers de uma sessão de masterização
+        """
+        if not session_id:
+            return 0
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry['session_id'] == session_id]
+            for key in keys:
+                self.total_bytes -= self._entries.pop(key)['nbytes']
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
@@ -0,0 +1,85 @@
+"""
+Leitura e gravação de áudio no formato usado pela cadeia de masterização.
+
+Todo áudio em memória é float32 com forma (canais, frames), C-contíguo: é o
+layout que a Pedalboard processa direto, sem transposição nem cópia, e evita
+a promoção para float64 (metade da memória por faixa). Estéreo continua
+estéreo; nada é somado para mono.
+
+O soundfile trabalha com (frames, canais), então a conversão é feita em
+blocos pequenos na leitura e na gravação, sem uma segunda cópia da faixa.
+"""
+
+import numpy as np
+import soundfile as sf
+
+AUDIO_DTYPE = np.float32
+IO_BLOCK_SIZE = 65536
+
+
+def as_channels_first(audio_data):
+    """
+    Garante float32 (canais, frames) C-contíguo (sinais mono 1-D viram (1, frames))
+    """
+    audio_data = np.asarray(audio_data)
+    if audio_data.ndim == 1:
+        audio_data = audio_data[np.newaxis, :]
+    return np.ascontiguousarray(audio_data, dtype=AUDIO_DTYPE)
+
+
+def frame_count(audio_data):
+    return audio_data.shape[-1]
+
+
+def audio_info(path):
+    """
+    (sample_rate, canais, frames) lidos só do cabeçalho
+    """
+    info = sf.info(path)
+    return info.samplerate, info.channels, info.frames
+
+
+def read_audio(path, start=0, frames=-1, block_size=IO_BLOCK_SIZE):
+    """
+    Decodifica o arquivo em float32 (canais, frames). Retorna (audio, sample_rate).
+    `start`/`frames` limitam a leitura a um trecho.
+    """
+    try:
+        with sf.SoundFile(path) as f:
+            total = f.frames - start if frames < 0 else min(frames, f.frames - start)
+            total = max(total, 0)
+            audio_data = np.empty((f.channels, total), dtype=AUDIO_DTYPE)
+            if start:
+                f.seek(start)
+            buffer = np.empty((min(block_size, max(total, 1)), f.channels), dtype=AUDIO_DTYPE)
+            position = 0
+            while position < total:
+                count = min(len(buffer), total - position)
+                read = f.read(count, dtype='float32', always_2d=True, out=buffer[:count])
+                if len(read) == 0:
+                    break
+                audio_data[:, position:position + len(read)] = read.T
+                position += len(read)
+            if position < total:
+                audio_data = np.ascontiguousarray(audio_data[:, :position])
+            return audio_data, f.samplerate
+    except RuntimeError:
+        # Formato que o soundfile não lê: decodificar com librosa, sem mixar para mono
+        import librosa
+        audio_data, sample_rate = librosa.load(path, sr=None, mono=False, dtype=AUDIO_DTYPE)
+        audio_data = as_channels_first(audio_data)
+        end = None if frames < 0 else start + frames
+        return np.ascontiguousarray(audio_data[:, start:end]), sample_rate
+
+
+def write_audio(file, audio_data, sample_rate, format='WAV', subtype=None, block_size=IO_BLOCK_SIZE):
+    """
+    Grava um sinal (canais, frames) em `file` (caminho ou buffer), em blocos
+    """
+    audio_data = np.asarray(audio_data)
+    if audio_data.ndim == 1:
+        audio_data = audio_data[np.newaxis, :]
+    with sf.SoundFile(file, 'w', samplerate=sample_rate, channels=audio_data.shape[0],
+                      format=format, subtype=subtype) as f:
+        for position in range(0, audio_data.shape[1], block_size):
+            f.write(audio_data[:, position:position + block_size].T)
@@ -0,0 +1,115 @@
+"""
+Identificação do formato de áudio a partir dos primeiros bytes do upload.
+
+O probe recebe os blocos à medida que chegam: o formato é reconhecido no
+primeiro bloco (uploads que não são áudio são rejeitados antes de ocupar
+disco) e, para WAV e FLAC, taxa, canais e duração saem do cabeçalho, sem
+decodificar o arquivo.
+"""
+
+import struct
+
+# Quantidade máxima de bytes guardados para ler o cabeçalho
+PROBE_HEADER_BYTES = 64 * 1024
+_MIN_DETECT_BYTES = 12
+
+
+class UploadError(ValueError):
+    """
+    Upload rejeitado; `status` é o código HTTP da resposta
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def detect_format(head):
+    """
+    Formato pelo "magic number" do início do arquivo (None se não for áudio conhecido)
+    """
+    if head[:4] in (b'RIFF', b'RF64') and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[:4] == b'fLaC':
+        return 'flac'
+    if head[:4] == b'OggS':
+        return 'ogg'
+    if head[:4] == b'FORM' and head[8:12] in (b'AIFF', b'AIFC'):
+        return 'aiff'
+    if head[:3] == b'ID3' or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    return None
+
+
+def _parse_wav(head, total_size):
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(head):
+        chunk_id, chunk_size = struct.unpack_from('<4sI', head, offset)
+        body = offset + 8
+        if chunk_id == b'fmt ' and body + 16 <= len(head):
+            _, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', head, body)
+            fmt = (channels, sample_rate, bits)
+        elif chunk_id == b'data':
+            if not fmt:
+                break
+            channels, sample_rate, bits = fmt
+            # Tamanho 0/0xFFFFFFFF (gravação em streaming, RF64): usar o tamanho do upload
+            if chunk_size in (0, 0xFFFFFFFF) and total_size:
+                chunk_size = total_size - body
+            frame_bytes = channels * bits // 8
+            duration = chunk_size / (frame_bytes * sample_rate) if frame_bytes and sample_rate else None
+            return {'sample_rate': sample_rate, 'channels': channels, 'duration': duration}
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _parse_flac(head):
+    # Bloco STREAMINFO logo após o "fLaC" (cabeçalho de 4 bytes + 34 bytes de dados)
+    if len(head) < 42:
+        return None
+    info = int.from_bytes(head[18:26], 'big')
+    sample_rate = info >> 44
+    channels = ((info >> 41) & 0x7) + 1
+    total_samples = info & 0xFFFFFFFFF
+    duration = total_samples / sample_rate if sample_rate and total_samples else None
+    return {'sample_rate': sample_rate, 'channels': channels, 'duration': duration}
+
+
+class AudioProbe:
+    """
+    Recebe os blocos do upload e identifica o formato sem guardar o arquivo inteiro
+    """
+
+    def __init__(self, total_size=None):
+        self.total_size = total_size
+        self.format = None
+        self.details = None
+        self._head = b''
+
+    def feed(self, chunk):
+        if self.details is not None or len(self._head) >= PROBE_HEADER_BYTES:
+            return
+        self._head += chunk[:PROBE_HEADER_BYTES - len(self._head)]
+
+        if self.format is None and len(self._head) >= _MIN_DETECT_BYTES:
+            self.format = detect_format(self._head)
+            if self.format is None:
+                raise UploadError('O arquivo enviado não é um áudio suportado', 415)
+
+        if self.format == 'wav':
+            self.details = _parse_wav(self._head, self.total_size)
+        elif self.format == 'flac':
+            self.details = _parse_flac(self._head)
+
+    def finish(self):
+        """
+        Resultado do probe ao fim do upload; rejeita uploads curtos demais para identificar
+        """
+        if self.format is None:
+            self.format = detect_format(self._head)
+            if self.format is None:
+                raise UploadError('O arquivo enviado não é um áudio suportado', 415)
+        result = {'format': self.format, 'sample_rate': None, 'channels': None, 'duration': None}
+        result.update(self.details or {})
+        return result
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Masterização em lote (álbuns e catálogos).
+
+Um lote reúne várias faixas com a mesma referência e os mesmos parâmetros.
+Cada faixa vira um job no pool de processos do JobManager (um processo por
+núcleo), então as faixas são masterizadas em paralelo. O lote acompanha o
+progresso de cada faixa e a vazão total (segundos de áudio por segundo de
+relógio); quando a última faixa termina, `on_complete` recebe o lote inteiro
+para gravar todas as faixas no banco em uma única transação.
+
+Também pode ser usado pela linha de comando:
+
+    python batch.py --user-id 3 --reference ref.wav faixa1.wav faixa2.wav ...
+    python batch.py --user-id 3 --album faixas/*.wav
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+
+from jobs import JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+
+# Número máximo de faixas por lote
+BATCH_MAX_TRACKS = int(os.environ.get('BATCH_MAX_TRACKS', 100))
+# Tempo que um lote concluído fica disponível para consulta
+BATCH_TTL_SECONDS = 24 * 60 * 60
+
+# Fases de um lote: análise (só no modo álbum) e renderização
+PHASE_ANALYSIS = 'analysis'
+PHASE_RENDER = 'render'
+# Peso da análise no progresso de cada faixa
+ANALYSIS_WEIGHT = 0.2
+
+
+class BatchManager:
+    """
+    Estado dos lotes; as faixas são executadas pelo JobManager
+    """
+
+    def __init__(self, job_manager, on_complete=None):
+        self.job_manager = job_manager
+        self.on_complete = on_complete
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def submit(self, owner_id, tracks, func, analyze=None, plan=None, **kwargs):
+        """
+        Coloca as faixas na fila e retorna o ID do lote. Cada faixa é um dict com
+        'filename', 'session_id' e 'args' (argumentos de `func` depois do job_id).
+
+        Com `analyze` (modo álbum), cada faixa passa antes por analyze(job_id, *faixa['analysis_args']).
+        Quando todas as análises terminam, plan(args, análises) retorna (args finais de cada
+        faixa, informações do plano) e só então cada faixa é renderizada, uma única vez.
+        """
+        if not tracks:
+            raise ValueError('Nenhuma faixa no lote')
+        if len(tracks) > BATCH_MAX_TRACKS:
+            raise ValueError(f'Lote com mais de {BATCH_MAX_TRACKS} faixas')
+        self._prune()
+
+        batch_id = str(uuid.uuid4())
+        batch = {
+            'id': batch_id,
+            'owner_id': owner_id,
+            'created_at': time.time(),
+            'finished_at': None,
+            'finalized': False,
+            'recorded': 0,
+            'phase': PHASE_ANALYSIS if analyze else PHASE_RENDER,
+            'plan': None,
+            'func': func,
+            'kwargs': kwargs,
+            'plan_func': plan,
+            'tracks': [
+                {
+                    'filename': track['filename'],
+                    'session_id': track['session_id'],
+                    'args': track['args'],
+                    'job_id': None,
+                    'status': JOB_QUEUED,
+                    'analysis': None,
+                    'plan': None,
+                    'result': None,
+                    'error': None
+                }
+                for track in tracks
+            ]
+        }
+        with self._lock:
+            self._batches[batch_id] = batch
+
+        if analyze:
+            self._submit_jobs(batch, PHASE_ANALYSIS, analyze,
+                              [(i, t['analysis_args']) for i, t in enumerate(tracks)], self._analysis_done)
+        else:
+            self._submit_jobs(batch, PHASE_RENDER, func,
+                              [(i, t['args']) for i, t in enumerate(tracks)], self._track_done, **kwargs)
+        return batch_id
+
+    def _submit_jobs(self, batch, phase, func, indexed_args, on_done, **kwargs):
+        for index, args in indexed_args:
+            try:
+                job_id = self.job_manager.submit(
+                    func, *args, owner_id=batch['owner_id'],
+                    on_done=lambda job, index=index: on_done(batch['id'], index, job),
+                    **kwargs
+                )
+            except Exception as e:
+                # Faixa que nem entrou na fila conta como falha, para o lote poder terminar
+                on_done(batch['id'], index, {'status': JOB_FAILED, 'result': None, 'error': str(e)})
+                continue
+            with self._lock:
+                # Uma análise rápida pode terminar (e o lote já passar à renderização) antes daqui
+                if batch['phase'] == phase:
+                    batch['tracks'][index]['job_id'] = job_id
+
+    def _analysis_done(self, batch_id, index, job):
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if not batch:
+                return
+            track = batch['tracks'][index]
+            if job['status'] == JOB_DONE:
+                track['analysis'] = job['result']
+            else:
+                track['status'] = JOB_FAILED
+                track['error'] = f"Erro na análise: {job['error']}"
+            if any(t['analysis'] is None and t['status'] != JOB_FAILED for t in batch['tracks']):
+                return
+            batch['phase'] = PHASE_RENDER
+
+        # Todas as análises prontas: planejar e renderizar fora da thread de callback do pool
+        threading.Thread(target=self._start_render, args=(batch_id,), daemon=True).start()
+
+    def _start_render(self, batch_id):
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if not batch:
+                return
+            tracks = [dict(t) for t in batch['tracks']]
+
+        try:
+            args_list, info = batch['plan_func']([t['args'] for t in tracks], [t['analysis'] for t in tracks])
+        except Exception as e:
+            print(f"Erro ao planejar o lote {batch_id}: {str(e)}")
+            args_list, info = [None] * len(tracks), {'error': str(e)}
+
+        pending = []
+        with self._lock:
+            batch['plan'] = {key: value for key, value in info.items() if key != 'tracks'}
+            for index, args in enumerate(args_list):
+                track = batch['tracks'][index]
+                track['plan'] = (info.get('tracks') or [None] * len(tracks))[index]
+                track['job_id'] = None
+                if track['status'] == JOB_FAILED:
+                    continue
+                if args is None:
+                    track['status'] = JOB_FAILED
+                    track['error'] = info.get('error') or 'Faixa fora do plano do lote'
+                    continue
+                track['args'] = args
+                pending.append((index, args))
+
+        self._submit_jobs(batch, PHASE_RENDER, batch['func'], pending, self._track_done, **batch['kwargs'])
+        if not pending:
+            self._finalize(batch_id)
+
+    def _track_done(self, batch_id, index, job):
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if not batch:
+                return
+            track = batch['tracks'][index]
+            track['status'] = job['status']
+            track['result'] = job['result']
+            track['error'] = job['error']
+        self._finalize(batch_id)
+
+    def _finalize(self, batch_id):
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if not batch or batch['finished_at'] or batch['phase'] != PHASE_RENDER:
+                return
+            if any(t['status'] not in (JOB_DONE, JOB_FAILED) for t in batch['tracks']):
+                return
+            batch['finished_at'] = time.time()
+            snapshot = {**batch, 'tracks': [dict(t) for t in batch['tracks']]}
+
+        # Última faixa: gravar o lote inteiro de uma vez
+        recorded = 0
+        if self.on_complete:
+            try:
+                recorded = self.on_complete(snapshot) or 0
+            except Exception as e:
+                print(f"Erro ao concluir o lote {batch_id}: {str(e)}")
+        with self._lock:
+            batch['recorded'] = recorded
+            batch['finalized'] = True
+
+    def status(self, batch_id, owner_id=None):
+        """
+        Progresso de cada faixa e do lote, com a vazão agregada; None se o lote não existir
+        """
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if not batch or (owner_id is not None and batch['owner_id'] != owner_id):
+                return None
+            tracks = [dict(t) for t in batch['tracks']]
+            created_at, finished_at = batch['created_at'], batch['finished_at']
+            finalized, recorded = batch['finalized'], batch['recorded']
+            phase, plan = batch['phase'], batch['plan']
+            has_analysis = batch['plan_func'] is not None
+
+        report = []
+        audio_seconds = 0.0
+        for track in tracks:
+            job = self.job_manager.get(track['job_id']) if track['job_id'] else None
+            analyzing = has_analysis and track['analysis'] is None
+            if track['status'] not in (JOB_DONE, JOB_FAILED) and job:
+                track['status'] = job['status']
+            if track['status'] in (JOB_DONE, JOB_FAILED):
+                progress = 100
+            else:
+                progress = job['progress'] if job else 0
+                if has_analysis:
+                    # A análise é a parte rápida do lote: conta como os primeiros 20%
+                    progress = int(progress * ANALYSIS_WEIGHT) if analyzing else \
+                        int(ANALYSIS_WEIGHT * 100 + progress * (1 - ANALYSIS_WEIGHT))
+            result = track['result'] or {}
+            audio_seconds += result.get('duration') or 0.0
+            report.append({
+                'filename': track['filename'],
+                'session_id': track['session_id'],
+                'job_id': track['job_id'],
+                'status': track['status'],
+                'progress': progress,
+                'stage': PHASE_ANALYSIS if analyzing and track['status'] != JOB_FAILED else (job['stage'] if job else None),
+                'output_filename': result.get('output_filename'),
+                'duration': result.get('duration'),
+                'loudness_lufs': (result.get('loudness') or {}).get('integrated_lufs'),
+                'plan': track['plan'],
+                'error': track['error']
+            })
+
+        done = sum(1 for t in report if t['status'] == JOB_DONE)
+        failed = sum(1 for t in report if t['status'] == JOB_FAILED)
+        # Concluído só depois do registro no banco
+        if finalized:
+            status = JOB_DONE if done else JOB_FAILED
+        elif has_analysis or any(t['status'] != JOB_QUEUED for t in report):
+            status = JOB_RUNNING
+        else:
+            status = JOB_QUEUED
+
+        if plan and plan.get('mode') == 'album':
+            # Alvo alcançado: loudness média medida nos masters prontos
+            levels = [t['loudness_lufs'] for t in report if t['status'] == JOB_DONE and t['loudness_lufs'] is not None]
+            plan = dict(plan, achieved_db=round(sum(levels) / len(levels), 2) if levels else None)
+
+        elapsed = (finished_at or time.time()) - created_at
+        return {
+            'batch_id': batch_id,
+            'status': status,
+            'phase': phase,
+            'plan': plan,
+            'progress': int(sum(t['progress'] for t in report) / len(report)),
+            'total': len(report),
+            'completed': done,
+            'failed': failed,
+            'recorded': recorded,
+            'elapsed_seconds': round(elapsed, 2),
+            'audio_seconds': round(audio_seconds, 2),
+            # Vazão: segundos de áudio masterizados por segundo de relógio, e faixas por minuto
+            'realtime_factor': round(audio_seconds / elapsed, 2) if elapsed > 0 else None,
+            'tracks_per_minute': round((done + failed) * 60 / elapsed, 2) if elapsed > 0 else None,
+            'tracks': report
+        }
+
+    def _prune(self):
+        limit = time.time() - BATCH_TTL_SECONDS
+        with self._lock:
+            expired = [batch_id for batch_id, batch in self._batches.items()
+                       if batch['finished_at'] and batch['finished_at'] < limit]
+            for batch_id in expired:
+                del self._batches[batch_id]
+
+
+def _print_progress(status, last):
+    for track in status['tracks']:
+        key = (track['status'], track['progress'])
+        if last.get(track['session_id']) != key:
+            last[track['session_id']] = key
+            line = f"  {track['filename']}: {track['status']} {track['progress']}%"
+            if track['error']:
+                line += f" ({track['error']})"
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Masterização em lote com a mesma referência e parâmetros')
+    parser.add_argument('files', nargs='+', help='Faixas a masterizar')
+    parser.add_argument('--user-id', type=int, required=True, help='Dono das masterizações (users.id)')
+    parser.add_argument('--reference', help='Arquivo de referência compartilhado')
+    parser.add_argument('--params', default='{}', help='Parâmetros da cadeia em JSON, ex.: \'{"gain_db": 1.5}\'')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processos de masterização')
+    parser.add_argument('--streaming', action='store_true', help='Masterizar todas as faixas em blocos')
+    parser.add_argument('--album', action='store_true', help='Modo álbum: mesma loudness em todas as faixas')
+    parser.add_argument('--album-target-db', type=float, help='Alvo de loudness do modo álbum (padrão: média das faixas)')
+    args = parser.parse_args(argv)
+
+    try:
+        params = json.loads(args.params)
+    except ValueError as e:
+        parser.error(f'--params inválido: {str(e)}')
+    missing = [path for path in args.files + ([args.reference] if args.reference else []) if not os.path.isfile(path)]
+    if missing:
+        parser.error(f"Arquivo(s) não encontrado(s): {', '.join(missing)}")
+
+    import app as mastering_app
+    mastering_app.init_db()
+    mastering_app.job_manager.max_workers = max(1, args.workers)
+
+    def from_file(path):
+        def store(dest):
+            with open(path, 'rb') as f:
+                mastering_app.store_local_audio(f, dest, os.path.getsize(path))
+        return store
+
+    targets = [(os.path.basename(path), from_file(path)) for path in args.files]
+    reference = from_file(args.reference) if args.reference else None
+    batch_id = mastering_app.submit_mastering_batch(args.user_id, targets, reference, params,
+                                                    streaming=args.streaming, album=args.album,
+                                                    album_target_db=args.album_target_db)
+    print(f"Lote {batch_id}: {len(targets)} faixa(s) em {mastering_app.job_manager.max_workers} processo(s)")
+
+    last = {}
+    while True:
+        status = mastering_app.batch_manager.status(batch_id)
+        _print_progress(status, last)
+        if status['status'] in (JOB_DONE, JOB_FAILED):
+            break
+        time.sleep(0.5)
+
+    if status['plan'] and status['plan'].get('mode') == 'album':
+        print(f"Modo álbum: alvo {status['plan']['target_db']} LUFS, alcançado {status['plan']['achieved_db']} LUFS")
+        for track in status['tracks']:
+            if track['plan']:
+                print(f"  {track['filename']}: previsto {track['plan']['loudness_db']} LUFS "
+                      f"({track['plan']['gain_offset_db']:+.2f} dB) -> medido {track['loudness_lufs']} LUFS")
+    print(f"Concluído: {status['completed']} ok, {status['failed']} com erro, {status['recorded']} registrada(s) | "
+          f"{status['audio_seconds']:.1f}s de áudio em {status['elapsed_seconds']:.1f}s "
+          f"({status['realtime_factor']}x tempo real, {status['tracks_per_minute']} faixas/min)")
+    return 0 if status['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+Presets da cadeia de masterização: definição declarativa em JSON e boards reutilizáveis.
+
+Cada arquivo `presets/<nome>.json` descreve uma cadeia:
+
+    {
+      "description": "Cadeia padrão",
+      "defaults": {"gain_db": 1.2},
+      "stages": [
+        {"plugin": "HighpassFilter", "cutoff_frequency_hz": 30},
+        {"plugin": "LowShelfFilter", "cutoff_frequency_hz": 150,
+         "gain_db": {"param": "low_shelf_db"}, "only_if": "low_shelf_db"},
+        {"plugin": "Gain", "gain_db": {"param": "gain_db"}},
+        ...
+      ]
+    }
+
+- os atributos de cada estágio são valores fixos ou `{"param": nome}`, ligados
+  aos parâmetros da masterização (MASTERING_PARAM_DEFAULTS)
+- `only_if` deixa o estágio fora da cadeia enquanto o parâmetro for zero
+- `defaults` substitui os valores padrão dos parâmetros para o preset
+- todo preset tem um estágio Gain ligado a `gain_db`: a cadeia é dividida nele
+  (cache do sinal antes do Gain, modo alvo de loudness)
+- além dos plugins da Pedalboard, `MultibandCompressor` (ver multiband.py) pode
+  ser usado como estágio
+
+Os presets são carregados e validados uma vez, na inicialização: um preset
+inválido impede o app de subir. As boards montadas ficam em um pool por
+processo e são reaproveitadas, só com os parâmetros atualizados no lugar.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from pedalboard import (Pedalboard, Plugin, Compressor, Gain, Limiter, HighpassFilter, LowpassFilter,
+                        LowShelfFilter, HighShelfFilter, PeakFilter)
+
+from content_store import MASTERING_PARAM_DEFAULTS
+from multiband import MultibandCompressor
+
+PRESETS_DIR = os.environ.get('MASTERING_PRESETS_DIR', 'presets')
+DEFAULT_PRESET = 'professional'
+
+# Boards ociosas mantidas por preset e combinação de estágios ativos
+BOARD_POOL_MAX_IDLE = int(os.environ.get('BOARD_POOL_MAX_IDLE', 4))
+
+# Plugins aceitos nos presets
+PLUGINS = {
+    plugin.__name__: plugin
+    for plugin in (HighpassFilter, LowpassFilter, LowShelfFilter, HighShelfFilter, PeakFilter,
+                   Compressor, Gain, Limiter, MultibandCompressor)
+}
+
+
+def accepts_attribute(plugin_class, attribute):
+    # Plugins da Pedalboard expõem os atributos como properties; estágios Python, em PARAMETERS
+    if hasattr(plugin_class, 'PARAMETERS'):
+        return attribute in plugin_class.PARAMETERS
+    return isinstance(getattr(plugin_class, attribute, None), property)
+
+
+class ChainPreset:
+    """
+    Preset validado: estágios, parâmetros padrão e fingerprint do conteúdo
+    """
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.description = spec.get('description', '')
+        self.stages = spec['stages']
+        self.params = dict(MASTERING_PARAM_DEFAULTS, **spec.get('defaults', {}))
+        # Parâmetros ligados aos estágios antes do Gain: indexam o sinal intermediário em cache
+        gain_index = next(i for i, stage in enumerate(self.stages) if stage['plugin'] == 'Gain')
+        self.pre_gain_params = tuple(sorted({
+            value['param'] if isinstance(value, dict) else value
+            for stage in self.stages[:gain_index]
+            for attribute, value in stage.items()
+            if isinstance(value, dict) or attribute == 'only_if'
+        }))
+        # Muda sempre que o preset muda: entra na chave dos resultados em cache
+        canonical = json.dumps({'defaults': spec.get('defaults', {}), 'stages': self.stages}, sort_keys=True)
+        self.fingerprint = hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+    def active(self, params):
+        """
+        Índices dos estágios ativos para os parâmetros dados (ver `only_if`)
+        """
+        return tuple(
+            i for i, stage in enumerate(self.stages)
+            if not stage.get('only_if') or float(params.get(stage['only_if'], self.params[stage['only_if']]))
+        )
+
+    def values(self, stage, params):
+        """
+        Atributos do estágio, com as ligações `{"param": nome}` resolvidas
+        """
+        values = {}
+        for attribute, value in stage.items():
+            if attribute in ('plugin', 'only_if'):
+                continue
+            if isinstance(value, dict):
+                value = params.get(value['param'], self.params[value['param']])
+            values[attribute] = float(value)
+        return values
+
+    def summary(self):
+        return {'name': self.name, 'description': self.description}
+
+
+def validate_preset(name, spec):
+    """
+    Confere a estrutura do preset e monta cada estágio uma vez (ValueError se inválido)
+    """
+    def fail(message):
+        raise ValueError(f"Preset '{name}': {message}")
+
+    if not isinstance(spec, dict) or not isinstance(spec.get('stages'), list) or not spec['stages']:
+        fail('"stages" deve ser uma lista não vazia')
+    defaults = spec.get('defaults', {})
+    if not isinstance(defaults, dict):
+        fail('"defaults" deve ser um objeto')
+    for param, value in defaults.items():
+        if param not in MASTERING_PARAM_DEFAULTS:
+            fail(f'parâmetro padrão desconhecido: {param}')
+        if not isinstance(value, (int, float)):
+            fail(f'valor padrão inválido para {param}')
+
+    gain_stages = 0
+    for i, stage in enumerate(spec['stages']):
+        if not isinstance(stage, dict) or stage.get('plugin') not in PLUGINS:
+            fail(f'estágio {i}: plugin inválido (aceitos: {", ".join(sorted(PLUGINS))})')
+        for attribute, value in stage.items():
+            if attribute == 'plugin':
+                continue
+            if attribute != 'only_if' and not accepts_attribute(PLUGINS[stage['plugin']], attribute):
+                fail(f'estágio {i}: atributo desconhecido para {stage["plugin"]}: {attribute}')
+            if attribute == 'only_if':
+                if value not in MASTERING_PARAM_DEFAULTS:
+                    fail(f'estágio {i}: only_if com parâmetro desconhecido: {value}')
+            elif isinstance(value, dict):
+                if set(value) != {'param'} or value['param'] not in MASTERING_PARAM_DEFAULTS:
+                    fail(f'estágio {i}: ligação inválida em {attribute}: {value}')
+            elif not isinstance(value, (int, float)):
+                fail(f'estágio {i}: valor inválido em {attribute}')
+        if stage['plugin'] == 'Gain':
+            if stage.get('gain_db') != {'param': 'gain_db'} or stage.get('only_if'):
+                fail(f'estágio {i}: o Gain deve estar ligado a gain_db e sempre ativo')
+            gain_stages += 1
+
+    if gain_stages != 1:
+        fail('a cadeia precisa de exatamente um estágio Gain')
+
+    # Montar cada estágio com os valores padrão: atributos desconhecidos falham aqui
+    preset = ChainPreset(name, spec)
+    for i, stage in enumerate(preset.stages):
+        try:
+            PLUGINS[stage['plugin']](**preset.values(stage, preset.params))
+        except (TypeError, ValueError) as e:
+            fail(f'estágio {i} ({stage["plugin"]}): {e}')
+    return preset
+
+
+def load_presets(directory=PRESETS_DIR):
+    """
+    Carrega e valida todos os presets do diretório ({nome: ChainPreset})
+    """
+    presets = {}
+    for filename in sorted(os.listdir(directory)):
+        name, ext = os.path.splitext(filename)
+        if ext != '.json':
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            with open(path) as f:
+                spec = json.load(f)
+        except ValueError as e:
+            raise ValueError(f"Preset '{name}': JSON inválido ({e})")
+        presets[name] = validate_preset(name, spec)
+    if DEFAULT_PRESET not in presets:
+        raise ValueError(f"Preset padrão '{DEFAULT_PRESET}' não encontrado em {directory}")
+    print(f"Presets da cadeia carregados: {', '.join(presets)}")
+    return presets
+
+
+class StageBoard:
+    """
+    Sequência de estágios com a interface de Pedalboard usada pelo app (chamada com
+    `reset`, `reset()` e iteração). Plugins nativos consecutivos rodam juntos em uma
+    Pedalboard; estágios Python (ex.: multibanda) rodam entre eles.
+    """
+
+    def __init__(self, plugins):
+        self.plugins = list(plugins)
+        self._segments = []
+        native = []
+        for plugin in self.plugins:
+            if isinstance(plugin, Plugin):
+                native.append(plugin)
+                continue
+            if native:
+                self._segments.append(Pedalboard(native))
+                native = []
+            self._segments.append(plugin)
+        if native:
+            self._segments.append(Pedalboard(native))
+
+    def __iter__(self):
+        return iter(self.plugins)
+
+    def __len__(self):
+        return len(self.plugins)
+
+    def reset(self):
+        for segment in self._segments:
+            segment.reset()
+
+    def __call__(self, audio, sample_rate, reset=True):
+        if not self._segments:
+            return np.array(audio, dtype=np.float32)
+        for segment in self._segments:
+            audio = segment(audio, sample_rate, reset=reset)
+        return audio
+
+
+class CompiledChain:
+    """
+    Cadeia montada para um preset e um conjunto de estágios ativos. A board completa
+    e as duas partes divididas no Gain compartilham as mesmas instâncias de plugin.
+    """
+
+    def __init__(self, preset, active):
+        self.preset = preset
+        self.stages = [preset.stages[i] for i in active]
+        self.plugins = [PLUGINS[stage['plugin']](**preset.values(stage, preset.params)) for stage in self.stages]
+        gain_index = next(i for i, stage in enumerate(self.stages) if stage['plugin'] == 'Gain')
+        self.board = StageBoard(self.plugins)
+        self.pre_gain = StageBoard(self.plugins[:gain_index])
+        self.from_gain = StageBoard(self.plugins[gain_index:])
+
+    def update(self, params):
+        """
+        Atualiza no lugar os atributos ligados a parâmetros
+        """
+        for stage, plugin in zip(self.stages, self.plugins):
+            for attribute, value in stage.items():
+                if isinstance(value, dict):
+                    setattr(plugin, attribute, float(params.get(value['param'], self.preset.params[value['param']])))
+
+
+class BoardPool:
+    """
+    Pool por processo de cadeias montadas, por (preset, estágios ativos)
+    """
+
+    def __init__(self, presets, max_idle=BOARD_POOL_MAX_IDLE):
+        self.presets = presets
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def preset(self, name=None):
+        """
+        Preset pelo nome (padrão se vazio); ValueError se não existir
+        """
+        preset = self.presets.get(name or DEFAULT_PRESET)
+        if preset is None:
+            raise ValueError(f'Preset desconhecido: {name}')
+        return preset
+
+    @contextmanager
+    def checkout(self, params):
+        """
+        Cadeia do preset em `params['preset']`, com os parâmetros aplicados e o
+        estado dos plugins reiniciado; volta ao pool ao sair do bloco
+        """
+        preset = self.preset(params.get('preset'))
+        key = (preset.name, preset.active(params))
+        with self._lock:
+            idle = self._idle.get(key)
+            chain = idle.pop() if idle else None
+        if chain is None:
+            chain = CompiledChain(preset, key[1])
+        chain.update(params)
+        chain.board.reset()
+        try:
+            yield chain
+        finally:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(chain)
@@ -0,0 +1,239 @@
+"""
+Uploads em blocos, retomáveis, para arquivos grandes (stems longos).
+
+O cliente cria o upload declarando o tamanho, envia o corpo em blocos
+(PATCH com o offset de cada bloco) e conclui. Cada bloco é lido do stream
+da requisição e anexado direto ao arquivo parcial, sem o spool do Werkzeug;
+o SHA-256 e o probe do formato são calculados no caminho. Se a conexão cair,
+o cliente consulta o offset atual e continua de onde parou.
+
+O estado de cada upload fica em um JSON ao lado do arquivo parcial, então um
+upload pode ser retomado por outro processo (o hash é refeito a partir do
+arquivo parcial nesse caso).
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+
+import soundfile as sf
+
+from audio_probe import AudioProbe, UploadError
+from content_store import UPLOAD_FOLDER, CHUNK_SIZE, adopt_blob, link_blob
+
+INCOMING_DIR = os.path.join(UPLOAD_FOLDER, 'incoming')
+
+# Tamanho máximo de cada arquivo enviado
+MAX_UPLOAD_BYTES = int(float(os.environ.get('MAX_UPLOAD_MB', 512)) * 1024 * 1024)
+# Tamanho de bloco sugerido ao cliente (cada PATCH)
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# Uploads não concluídos (ou concluídos e não usados) expiram depois deste tempo
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+
+class ChunkedUpload:
+    """
+    Um upload em andamento: arquivo parcial + metadados
+    """
+
+    def __init__(self, upload_id, owner_id, filename, total_size, created_at=None, completed=False):
+        self.id = upload_id
+        self.owner_id = owner_id
+        self.filename = filename
+        self.total_size = total_size
+        self.created_at = created_at or time.time()
+        self.completed = completed
+        self.info = None
+        self.digest = None
+        self.received = 0
+        self.lock = threading.Lock()
+        self._hasher = hashlib.sha256()
+        self._probe = AudioProbe(total_size)
+
+    @property
+    def part_path(self):
+        return os.path.join(INCOMING_DIR, f"{self.id}.part")
+
+    @property
+    def meta_path(self):
+        return os.path.join(INCOMING_DIR, f"{self.id}.json")
+
+    def save_meta(self):
+        meta = {
+            'owner_id': self.owner_id,
+            'filename': self.filename,
+            'total_size': self.total_size,
+            'created_at': self.created_at,
+            'completed': self.completed
+        }
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    @classmethod
+    def load(cls, upload_id):
+        """
+        Recarrega um upload a partir do disco, refazendo hash e probe do arquivo parcial
+        """
+        with open(os.path.join(INCOMING_DIR, f"{upload_id}.json")) as f:
+            meta = json.load(f)
+        upload = cls(upload_id, meta['owner_id'], meta['filename'], meta['total_size'],
+                     meta['created_at'], meta['completed'])
+        if os.path.exists(upload.part_path):
+            with open(upload.part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    upload._consume(chunk)
+        if upload.completed:
+            upload._finish()
+        return upload
+
+    def _consume(self, chunk):
+        self._probe.feed(chunk)
+        self._hasher.update(chunk)
+        self.received += len(chunk)
+
+    def append(self, stream, offset, length=None):
+        """
+        Anexa o corpo da requisição a partir de `offset`. Retorna o novo offset.
+        """
+        if self.completed:
+            raise UploadError('Upload já concluído', 409)
+        if offset != self.received:
+            raise UploadError(f'Offset inválido: esperado {self.received}', 409)
+        if length is not None and self.received + length > self.total_size:
+            raise UploadError('O bloco excede o tamanho declarado do arquivo', 413)
+
+        with open(self.part_path, 'ab') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if self.received + len(chunk) > self.total_size:
+                    raise UploadError('O bloco excede o tamanho declarado do arquivo', 413)
+                self._consume(chunk)
+                f.write(chunk)
+        return self.received
+
+    def _finish(self):
+        self.info = self._probe.finish()
+        if self.info['duration'] is None:
+            # MP3/OGG/AIFF: duração lida pelo soundfile (só cabeçalho/frames, sem decodificar)
+            try:
+                self.info['duration'] = sf.info(self.part_path).duration
+            except Exception:
+                pass
+        self.digest = self._hasher.hexdigest()
+
+    def complete(self):
+        """
+        Valida o upload recebido por inteiro e retorna hash e probe
+        """
+        if not self.completed:
+            if self.received != self.total_size:
+                raise UploadError(f'Upload incompleto: {self.received} de {self.total_size} bytes', 409)
+            self._finish()
+            self.completed = True
+            self.save_meta()
+        return {'sha256': self.digest, 'size': self.total_size, **self.info}
+
+    def status(self):
+        return {
+            'upload_id': self.id,
+            'offset': self.received,
+            'size': self.total_size,
+            'completed': self.completed
+        }
+
+
+class UploadManager:
+    """
+    Registro dos uploads em blocos (em memória, com os metadados também em disco)
+    """
+
+    def __init__(self, max_bytes=MAX_UPLOAD_BYTES, ttl=UPLOAD_SESSION_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def create(self, owner_id, filename, total_size):
+        try:
+            total_size = int(total_size)
+        except (TypeError, ValueError):
+            raise UploadError('Tamanho do arquivo não informado')
+        if total_size <= 0:
+            raise UploadError('Arquivo vazio')
+        if total_size > self.max_bytes:
+            raise UploadError(f'Arquivo maior que o limite de {self.max_bytes // (1024 * 1024)}MB', 413)
+
+        self.prune()
+        os.makedirs(INCOMING_DIR, exist_ok=True)
+        upload = ChunkedUpload(uuid.uuid4().hex, owner_id, filename, total_size)
+        open(upload.part_path, 'wb').close()
+        upload.save_meta()
+        with self._lock:
+            self._uploads[upload.id] = upload
+        return upload
+
+    def get(self, upload_id, owner_id):
+        """
+        Upload do usuário, recarregado do disco se este processo ainda não o conhece
+        """
+        if not upload_id or not upload_id.isalnum():
+            return None
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+        if upload is None:
+            try:
+                upload = ChunkedUpload.load(upload_id)
+            except (OSError, ValueError, KeyError, UploadError):
+                return None
+            with self._lock:
+                upload = self._uploads.setdefault(upload_id, upload)
+        if upload.owner_id != owner_id:
+            return None
+        return upload
+
+    def discard(self, upload):
+        with self._lock:
+            self._uploads.pop(upload.id, None)
+        for path in (upload.part_path, upload.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def consume(self, upload_id, owner_id, dest_path):
+        """
+        Usa um upload concluído como arquivo de sessão: o arquivo parcial vira blob
+        (sem cópia) e dest_path é ligado a ele. Retorna o hash.
+        """
+        upload = self.get(upload_id, owner_id)
+        if upload is None:
+            raise UploadError('Upload não encontrado ou expirado', 404)
+        with upload.lock:
+            info = upload.complete()
+            blob_path = adopt_blob(upload.part_path, info['sha256'], os.path.splitext(dest_path)[1])
+            link_blob(blob_path, dest_path, info['sha256'])
+            self.discard(upload)
+        return info['sha256']
+
+    def prune(self):
+        """
+        Remove uploads abandonados (parciais ou não usados) mais velhos que o TTL
+        """
+        limit = time.time() - self.ttl
+        try:
+            entries = list(os.scandir(INCOMING_DIR))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < limit:
+                    os.remove(entry.path)
+                    with self._lock:
+                        self._uploads.pop(entry.name.split('.')[0], None)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,271 @@
+"""
+Armazenamento endereçado por conteúdo para uploads e resultados de masterização.
+
+Cada upload é gravado uma única vez em `uploads/blobs/<sha256>` e os caminhos
+por sessão (`{session_id}_target.wav` etc.) são hard links para esse blob.
+Resultados de masterização ficam em `uploads/results/<chave>.wav`, com a
+chave derivada de (hash do áudio, parâmetros normalizados, versão da cadeia).
+
+Como os arquivos são compartilhados por hard link, nunca se deve sobrescrever
+um desses caminhos no lugar: grave em um temporário e use os.replace.
+
+Para manter as listagens de diretório pequenas, blobs, resultados e arquivos
+de sessão ficam em subdiretórios de 2 dígitos hex (`uploads/<ab>/<arquivo>`).
+"""
+
+import os
+import json
+import uuid
+import shutil
+import hashlib
+
+from audio_probe import UploadError
+
+UPLOAD_FOLDER = 'uploads'
+BLOB_DIR = os.path.join(UPLOAD_FOLDER, 'blobs')
+RESULT_DIR = os.path.join(UPLOAD_FOLDER, 'results')
+EXPORT_DIR = os.path.join(UPLOAD_FOLDER, 'exports')
+FEATURE_DIR = os.path.join(UPLOAD_FOLDER, 'features')
+
+HASH_SUFFIX = '.sha256'
+CHUNK_SIZE = 1024 * 1024
+
+# Subdiretórios por hash: 2 dígitos hex = 256 diretórios por nível
+SHARD_WIDTH = 2
+
+# Sidecars gravados ao lado dos arquivos de sessão (ficam no mesmo shard do áudio)
+UPLOAD_SIDECARS = ('.npy', '.peaks', '.loudness', HASH_SUFFIX)
+
+# Sidecars que acompanham um resultado (pirâmide de picos do waveform, medição de
+# loudness e hash, usado como ETag)
+RESULT_SIDECARS = ('.peaks', '.loudness', HASH_SUFFIX)
+
+# Parâmetros que entram na chave do resultado, com o valor padrão de cada um
+MASTERING_PARAM_DEFAULTS = {
+    'compressor_threshold': -24,
+    'compressor_ratio': 1.8,
+    'gain_db': 1.2,
+    'limiter_threshold': -0.8,
+    'low_shelf_db': 0.0,
+    'high_shelf_db': 0.0,
+    # Ganho de cada banda do estágio multibanda (presets com MultibandCompressor)
+    'low_band_db': 0.0,
+    'mid_band_db': 0.0,
+    'high_band_db': 0.0
+}
+
+# Modo alvo de loudness (opcional): só entram na chave do resultado quando ativos
+LOUDNESS_TARGET_PARAMS = ('target_lufs', 'max_true_peak')
+
+
+def primary_name(name):
+    """
+    Nome do áudio ao qual um sidecar pertence ('x.wav.peaks' -> 'x.wav')
+    """
+    stripped = True
+    while stripped:
+        stripped = False
+        for suffix in UPLOAD_SIDECARS:
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+                stripped = True
+    return name
+
+
+def shard_name(filename):
+    return hashlib.md5(primary_name(filename).encode()).hexdigest()[:SHARD_WIDTH]
+
+
+def is_shard_dir(name):
+    return len(name) == SHARD_WIDTH and all(c in '0123456789abcdef' for c in name)
+
+
+def upload_path(filename):
+    """
+    Caminho para gravar um arquivo de sessão: uploads/<shard>/<arquivo>
+    """
+    shard_dir = os.path.join(UPLOAD_FOLDER, shard_name(filename))
+    os.makedirs(shard_dir, exist_ok=True)
+    return os.path.join(shard_dir, filename)
+
+
+def find_upload(filename):
+    """
+    Caminho para ler um arquivo de sessão; aceita o local antigo (uploads/<arquivo>)
+    enquanto o arquivo ainda não foi migrado para o seu shard
+    """
+    path = os.path.join(UPLOAD_FOLDER, shard_name(filename), filename)
+    if not os.path.exists(path):
+        legacy_path = os.path.join(UPLOAD_FOLDER, filename)
+        if os.path.exists(legacy_path):
+            return legacy_path
+    return path
+
+
+def link_or_copy(src, dst):
+    """
+    Cria dst apontando para o mesmo conteúdo de src (hard link, ou cópia se não suportado).
+    Substitui dst atomicamente.
+    """
+    tmp_path = f"{dst}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def _write_hash_sidecar(path, digest):
+    # O sidecar pode estar ligado por hard link a outras sessões: nunca reescrever no lugar
+    tmp_path = f"{path}{HASH_SUFFIX}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(digest)
+        os.replace(tmp_path, path + HASH_SUFFIX)
+    except OSError as e:
+        print(f"Não foi possível gravar o hash de {path}: {str(e)}")
+
+
+def adopt_blob(tmp_path, digest, ext):
+    """
+    Move um arquivo recebido (já com o hash calculado) para blobs/; se o conteúdo
+    já existir, descarta a cópia recebida. Retorna o caminho do blob.
+    """
+    blob_dir = os.path.join(BLOB_DIR, digest[:SHARD_WIDTH])
+    os.makedirs(blob_dir, exist_ok=True)
+    blob_path = os.path.join(blob_dir, digest + ext)
+    if os.path.exists(blob_path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, blob_path)
+    return blob_path
+
+
+def link_blob(blob_path, dest_path, digest):
+    """
+    Cria o arquivo de sessão dest_path como link para o blob, com o sidecar de hash
+    """
+    link_or_copy(blob_path, dest_path)
+    _write_hash_sidecar(dest_path, digest)
+
+
+def store_stream(stream, dest_path, chunk_size=CHUNK_SIZE, probe=None, max_bytes=None):
+    """
+    Lê o upload em blocos calculando o SHA-256, guarda o conteúdo em blobs/
+    (uma vez por conteúdo) e cria dest_path como link para o blob.
+    `probe` (AudioProbe) recebe cada bloco e pode rejeitar o upload já no primeiro;
+    acima de `max_bytes` o upload é interrompido. Retorna o hash.
+    """
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    hasher = hashlib.sha256()
+    tmp_path = os.path.join(BLOB_DIR, f"incoming-{uuid.uuid4().hex}.tmp")
+    received = 0
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if max_bytes is not None and received > max_bytes:
+                    raise UploadError(f'Arquivo maior que o limite de {max_bytes // (1024 * 1024)}MB', 413)
+                if probe is not None:
+                    probe.feed(chunk)
+                hasher.update(chunk)
+                f.write(chunk)
+
+        if probe is not None:
+            probe.finish()
+        digest = hasher.hexdigest()
+        blob_path = adopt_blob(tmp_path, digest, os.path.splitext(dest_path)[1])
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    link_blob(blob_path, dest_path, digest)
+    return digest
+
+
+def content_hash(path):
+    """
+    SHA-256 do arquivo, usando o sidecar .sha256 quando estiver atualizado
+    """
+    sidecar = path + HASH_SUFFIX
+    try:
+        if os.path.getmtime(sidecar) >= os.path.getmtime(path):
+            with open(sidecar) as f:
+                digest = f.read().strip()
+            if len(digest) == 64:
+                return digest
+    except OSError:
+        pass
+
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    _write_hash_sidecar(path, digest)
+    return digest
+
+
+def normalize_params(params):
+    """
+    Parâmetros em forma canônica (float arredondado) para compor a chave do resultado
+    """
+    normalized = {
+        name: round(float(params.get(name, default)), 2)
+        for name, default in MASTERING_PARAM_DEFAULTS.items()
+    }
+    for name in LOUDNESS_TARGET_PARAMS:
+        if params.get(name) is not None:
+            normalized[name] = round(float(params[name]), 2)
+    return normalized
+
+
+def result_key(audio_hash, params, chain_version, mode='memory'):
+    """
+    Chave do resultado: hash de (áudio, parâmetros normalizados, versão da cadeia, modo)
+    """
+    payload = json.dumps({
+        'audio': audio_hash,
+        'params': normalize_params(params),
+        'chain': chain_version,
+        'mode': mode
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def result_path(key):
+    return os.path.join(RESULT_DIR, key[:SHARD_WIDTH], f"{key}.wav")
+
+
+def restore_result(key, mastered_path):
+    """
+    Se o resultado existir, liga-o (com os sidecars) em mastered_path e retorna True
+    """
+    cached_path = result_path(key)
+    if not os.path.exists(cached_path):
+        return False
+    for suffix in RESULT_SIDECARS:
+        if not os.path.exists(cached_path + suffix):
+            return False
+
+    link_or_copy(cached_path, mastered_path)
+    for suffix in RESULT_SIDECARS:
+        link_or_copy(cached_path + suffix, mastered_path + suffix)
+    return True
+
+
+def store_result(key, mastered_path):
+    """
+    Guarda o master recém-gerado (e seus sidecars) sob a chave do resultado
+    """
+    content_hash(mastered_path)
+    cached_path = result_path(key)
+    os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+    for suffix in RESULT_SIDECARS:
+        if os.path.exists(mastered_path + suffix):
+            link_or_copy(mastered_path + suffix, cached_path + suffix)
+    link_or_copy(mastered_path, cached_path)
@@ -0,0 +1,50 @@
+"""
+Cache curto, por usuário, dos dados do dashboard.
+
+Evita refazer as consultas a cada carregamento da página. O cache é
+invalidado quando o usuário ganha uma nova música masterizada ou um novo
+download; o TTL só cobre mudanças feitas fora desses caminhos.
+"""
+
+import os
+import time
+import threading
+
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', 30))
+
+
+class DashboardCache:
+    """
+    {user_id: (expira_em, dados)} protegido por lock
+    """
+
+    def __init__(self, ttl=DASHBOARD_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            return data
+
+    def set(self, user_id, data):
+        if self.ttl <= 0:
+            return data
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, data)
+        return data
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,203 @@
+"""
+Camada de acesso ao banco SQLite compartilhada pela aplicação.
+
+- Pool de conexões reutilizadas entre requisições (sem abrir conexão a cada chamada)
+- Modo WAL, para leituras concorrentes não bloquearem a escrita
+- Esquema verificado uma única vez (cache de tabelas/colunas), sem consultas
+  ao sqlite_master a cada operação
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'users.db')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_BUSY_TIMEOUT_MS = 5000
+
+
+def _open_connection(path):
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    return conn
+
+
+class ConnectionPool:
+    """
+    Pool simples de conexões SQLite. Cada conexão é usada por uma thread de cada vez.
+    Após um fork (workers de masterização) o pool é recriado no processo filho.
+    A primeira conexão aberta aplica as migrações de colunas (add_missing_columns),
+    seja qual for o ponto de entrada (python app.py, flask run, servidor WSGI).
+    """
+
+    def __init__(self, path=DATABASE_PATH, size=DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._migrated = False
+        self._migrate_lock = threading.Lock()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Conexões herdadas do processo pai não podem ser usadas no filho
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue(maxsize=self.size)
+
+    def acquire(self):
+        self._check_fork()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            conn = _open_connection(self.path)
+        if not self._migrated:
+            self._migrate(conn)
+        return conn
+
+    def _migrate(self, conn):
+        with self._migrate_lock:
+            if self._migrated:
+                return
+            try:
+                add_missing_columns(conn.cursor())
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            self._migrated = True
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+_pool = ConnectionPool()
+
+
+@contextmanager
+def connect():
+    """
+    Conexão do pool para um bloco `with`: commit ao sair sem erro, rollback em caso de exceção
+    """
+    conn = _pool.acquire()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        _pool.release(conn)
+
+
+# Limite de parâmetros por instrução (SQLITE_MAX_VARIABLE_NUMBER antigo é 999)
+DELETE_BATCH_SIZE = 500
+
+
+def execute_in_batches(cursor, sql, values, batch_size=DELETE_BATCH_SIZE):
+    """
+    Executa `sql` (com um marcador {placeholders} dentro de IN (...)) em lotes de valores.
+    Retorna o total de linhas afetadas.
+    """
+    values = list(values)
+    affected = 0
+    for start in range(0, len(values), batch_size):
+        batch = values[start:start + batch_size]
+        cursor.execute(sql.format(placeholders=', '.join('?' * len(batch))), batch)
+        affected += max(cursor.rowcount, 0)
+    return affected
+
+
+def delete_by_ids(cursor, table, ids, batch_size=DELETE_BATCH_SIZE):
+    """
+    Remove as linhas de `table` com os ids informados em lotes de DELETE ... WHERE id IN (...)
+    """
+    return execute_in_batches(cursor, f'DELETE FROM {table} WHERE id IN ({{placeholders}})', ids, batch_size)
+
+
+# Índices compostos para as consultas por usuário ordenadas por data (dashboard)
+INDEXES = (
+    ('idx_tutorials_watched_user', 'tutorials_watched', 'user_id, tutorial_id'),
+    ('idx_mastered_songs_user_created', 'mastered_songs', 'user_id, created_at'),
+    ('idx_downloads_user_downloaded', 'downloads', 'user_id, downloaded_at'),
+    ('idx_ghost_requests_user_created', 'ghost_producer_requests', 'user_id, created_at'),
+)
+
+
+def create_indexes(cursor):
+    """
+    Migração: cria os índices que ainda não existem (idempotente)
+    """
+    for name, table, columns in INDEXES:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+
+
+# Colunas de mastered_songs com a medição do master (mesmas chaves do relatório de loudness)
+LOUDNESS_COLUMNS = ('integrated_lufs', 'short_term_max_lufs', 'momentary_max_lufs',
+                    'loudness_range_lu', 'true_peak_dbtp', 'sample_peak_dbfs')
+
+# Colunas adicionadas depois da versão original das tabelas: (tabela, coluna, tipo)
+ADDED_COLUMNS = (
+    ('ghost_producer_requests', 'package', 'TEXT'),
+    ('ghost_producer_requests', 'deadline', 'TEXT'),
+) + tuple(('mastered_songs', column, 'REAL') for column in LOUDNESS_COLUMNS)
+
+
+def add_missing_columns(cursor):
+    """
+    Migração: adiciona as colunas de ADDED_COLUMNS que faltam nas tabelas existentes
+    (idempotente; tabelas ainda não criadas são ignoradas)
+    """
+    columns = {}
+    for table, column, column_type in ADDED_COLUMNS:
+        if table not in columns:
+            cursor.execute(f'PRAGMA table_info({table})')
+            columns[table] = [row[1] for row in cursor.fetchall()]
+        if columns[table] and column not in columns[table]:
+            print(f"Adicionando coluna '{column}' em '{table}'...")
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+            columns[table].append(column)
+
+
+# Cache do esquema: {tabela: [colunas]}, carregado uma única vez
+_schema = None
+_schema_lock = threading.Lock()
+
+
+def verify_schema():
+    """
+    Lê (ou relê, após migrações) as tabelas e colunas existentes
+    """
+    global _schema
+    with _schema_lock:
+        with connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            tables = [row[0] for row in cursor.fetchall()]
+            _schema = {}
+            for table in tables:
+                cursor.execute(f'PRAGMA table_info({table})')
+                _schema[table] = [column[1] for column in cursor.fetchall()]
+    return _schema
+
+
+def get_schema():
+    if _schema is None:
+        verify_schema()
+    return _schema
+
+
+def has_table(table):
+    return table in get_schema()
+
+
+def table_columns(table):
+    return get_schema().get(table, [])
@@ -0,0 +1,228 @@
+"""
+Exportação do master em outras taxas de amostragem, resoluções e formatos.
+
+O download padrão continua sendo o WAV do master, sem alterações. Quando o
+usuário pede outra versão (ex.: 48kHz/24 bits em FLAC), ela é gerada em um
+pool de processos próprio, em blocos:
+
+- reamostragem de alta qualidade (soxr, qualidade VHQ)
+- dither TPDF ao reduzir a resolução para PCM inteiro
+- gravação atômica em `uploads/exports/<ab>/<chave>.<ext>`
+
+A chave combina o hash do master com as configurações da exportação, então
+downloads repetidos da mesma versão saem direto do disco, e um master refeito
+gera uma chave nova.
+"""
+
+import os
+import json
+import uuid
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+from content_store import EXPORT_DIR, SHARD_WIDTH, content_hash
+
+# Formato -> (formato do soundfile, extensão, mimetype, {bits: subtipo})
+EXPORT_FORMATS = {
+    'wav': ('WAV', '.wav', 'audio/wav', {16: 'PCM_16', 24: 'PCM_24', 32: 'FLOAT'}),
+    'flac': ('FLAC', '.flac', 'audio/flac', {16: 'PCM_16', 24: 'PCM_24'}),
+}
+
+EXPORT_SAMPLE_RATES = (44100, 48000, 88200, 96000, 176400, 192000)
+
+# Processos de exportação (separados do pool de masterização)
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 2))
+# Tempo máximo que o download espera a exportação ficar pronta
+EXPORT_TIMEOUT_SECONDS = float(os.environ.get('EXPORT_TIMEOUT_SECONDS', 300))
+
+EXPORT_BLOCK_SIZE = 65536
+
+# Resolução efetiva de cada subtipo de origem (para decidir se há redução)
+_SUBTYPE_BITS = {'PCM_S8': 8, 'PCM_U8': 8, 'PCM_16': 16, 'PCM_24': 24, 'PCM_32': 32, 'FLOAT': 32, 'DOUBLE': 64}
+
+
+def parse_export_settings(args):
+    """
+    Configurações da exportação a partir dos parâmetros da URL; None se nenhuma
+    foi pedida (download do master como está). ValueError se forem inválidas.
+    """
+    if not any(args.get(name) for name in ('format', 'sample_rate', 'bit_depth')):
+        return None
+
+    fmt = (args.get('format') or 'wav').lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportação inválido: {fmt}")
+
+    sample_rate = args.get('sample_rate')
+    if sample_rate:
+        try:
+            sample_rate = int(sample_rate)
+        except ValueError:
+            raise ValueError(f"Taxa de amostragem inválida: {sample_rate}")
+        if sample_rate not in EXPORT_SAMPLE_RATES:
+            raise ValueError(f"Taxa de amostragem não suportada: {sample_rate}")
+    else:
+        sample_rate = None
+
+    try:
+        bit_depth = int(args.get('bit_depth') or 24)
+    except ValueError:
+        raise ValueError(f"Resolução inválida: {args.get('bit_depth')}")
+    if bit_depth not in EXPORT_FORMATS[fmt][3]:
+        raise ValueError(f"Resolução de {bit_depth} bits não suportada em {fmt.upper()}")
+
+    dither = str(args.get('dither', '1')).lower() not in ('0', 'false', 'no')
+    return {'format': fmt, 'sample_rate': sample_rate, 'bit_depth': bit_depth, 'dither': dither}
+
+
+def export_key(master_hash, settings):
+    payload = json.dumps({'master': master_hash, **settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def export_path(key, fmt):
+    return os.path.join(EXPORT_DIR, key[:SHARD_WIDTH], key + EXPORT_FORMATS[fmt][1])
+
+
+def export_filename(master_filename, settings, source_rate=None):
+    """
+    Nome do arquivo baixado, ex.: mastered_x_48k_24bit.flac
+    """
+    base = os.path.splitext(master_filename)[0]
+    rate = settings['sample_rate'] or source_rate
+    rate_label = f"_{rate / 1000:g}k" if rate else ''
+    depth_label = '32f' if settings['bit_depth'] == 32 else f"{settings['bit_depth']}bit"
+    return f"{base}{rate_label}_{depth_label}{EXPORT_FORMATS[settings['format']][1]}"
+
+
+class TPDFDither:
+    """
+    Dither triangular (TPDF) de ±1 LSB e quantização para PCM inteiro.
+    O gerador tem semente fixa para que a mesma exportação gere os mesmos bytes.
+    """
+
+    def __init__(self, bit_depth, seed=0, enabled=True):
+        self.scale = float(2 ** (bit_depth - 1))
+        self.enabled = enabled
+        self._rng = np.random.default_rng(seed)
+
+    def quantize(self, block):
+        scaled = block.astype(np.float64) * self.scale
+        if self.enabled:
+            scaled += self._rng.random(block.shape) - self._rng.random(block.shape)
+        return np.clip(np.round(scaled), -self.scale, self.scale - 1)
+
+
+def render_export(master_path, output_path, settings, seed=0, block_size=EXPORT_BLOCK_SIZE):
+    """
+    Gera a exportação em blocos (executado nos workers do pool)
+    """
+    sf_format, _, _, subtypes = EXPORT_FORMATS[settings['format']]
+    bit_depth = settings['bit_depth']
+    tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    try:
+        with sf.SoundFile(master_path) as infile:
+            sample_rate = infile.samplerate
+            channels = infile.channels
+            out_rate = settings['sample_rate'] or sample_rate
+            resampler = None
+            if out_rate != sample_rate:
+                resampler = soxr.ResampleStream(sample_rate, out_rate, channels, dtype='float32', quality='VHQ')
+
+            # Dither só quando há perda de resolução: reamostragem ou redução de bits
+            source_bits = _SUBTYPE_BITS.get(infile.subtype, 32)
+            quantizer = None
+            if bit_depth < 32:
+                quantizer = TPDFDither(bit_depth, seed,
+                                       enabled=settings['dither'] and (resampler is not None or bit_depth < source_bits))
+
+            def write(outfile, block):
+                if not len(block):
+                    return
+                if quantizer is None:
+                    outfile.write(block)
+                elif bit_depth == 16:
+                    outfile.write(quantizer.quantize(block).astype(np.int16))
+                else:
+                    # PCM_24 recebe int32 alinhado à esquerda (os 8 bits baixos são descartados)
+                    outfile.write(quantizer.quantize(block).astype(np.int32) << 8)
+
+            with sf.SoundFile(tmp_path, 'w', samplerate=out_rate, channels=channels,
+                              format=sf_format, subtype=subtypes[bit_depth]) as outfile:
+                for block in infile.blocks(blocksize=block_size, dtype='float32', always_2d=True):
+                    if resampler is not None:
+                        block = resampler.resample_chunk(block)
+                    write(outfile, block)
+                if resampler is not None:
+                    write(outfile, resampler.resample_chunk(np.zeros((0, channels), dtype=np.float32), last=True))
+
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output_path
+
+
+class ExportManager:
+    """
+    Pool de processos das exportações, com cache em disco e sem trabalho duplicado:
+    pedidos simultâneos da mesma exportação esperam o mesmo future.
+    """
+
+    def __init__(self, max_workers=EXPORT_WORKERS, timeout=EXPORT_TIMEOUT_SECONDS):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context())
+            print(f"Pool de exportação iniciado com {self.max_workers} worker(s)")
+
+    def _submit(self, master_path, path, settings, seed):
+        try:
+            return self._executor.submit(render_export, master_path, path, settings, seed)
+        except BrokenProcessPool:
+            print("Pool de exportação quebrado, recriando...")
+            self._executor = None
+            self._ensure_started()
+            return self._executor.submit(render_export, master_path, path, settings, seed)
+
+    def get(self, master_path, settings):
+        """
+        Caminho da exportação de `master_path`, gerando-a no pool se ainda não estiver no cache
+        """
+        key = export_key(content_hash(master_path), settings)
+        path = export_path(key, settings['format'])
+        if os.path.exists(path):
+            # Exportação reaproveitada: a retenção usa o mtime como último uso
+            os.utime(path)
+            return path
+
+        with self._lock:
+            future = self._pending.get(key)
+            submitted = future is None
+            if submitted:
+                self._ensure_started()
+                future = self._submit(master_path, path, settings, int(key[:8], 16))
+                self._pending[key] = future
+        if submitted:
+            # Fora do lock: um future já concluído chama _forget na hora, nesta mesma thread
+            future.add_done_callback(lambda f, key=key: self._forget(key))
+        return future.result(timeout=self.timeout)
+
+    def _forget(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
@@ -6,6 +6,8 @@ Script para inicializar o banco de dados
 import sqlite3
 import os
 
+import db
+
 def init_database():
     print("=== Inicializando Banco de Dados ===")
     
@@ -70,6 +72,14 @@ def init_database():
             )
         ''')
         
+        # Colunas adicionadas depois (medição de loudness dos masters, etc.)
+        print("Migrando colunas...")
+        db.add_missing_columns(cursor)
+        
+        # Índices por usuário/data (consultas do dashboard)
+        print("Criando índices...")
+        db.create_indexes(cursor)
+        
         conn.commit()
         conn.close()
         
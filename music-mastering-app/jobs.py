@@ -0,0 +1,177 @@
+"""
+Fila local de jobs em segundo plano para a masterização.
+
+Os jobs são executados em um pool de processos (ProcessPoolExecutor) e o
+progresso é enviado pelos workers através de uma fila multiprocessing,
+consumida por uma thread no processo do Flask.
+"""
+
+import os
+import time
+import uuid
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Número de processos de masterização (pode ser ajustado por variável de ambiente)
+MAX_WORKERS = int(os.environ.get('MASTERING_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+
+# Tempo que um job concluído fica disponível para consulta
+JOB_TTL_SECONDS = 60 * 60
+
+# Fila de progresso do lado do worker (definida pelo initializer do pool)
+_progress_queue = None
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def report_progress(job_id, progress, stage=None):
+    """
+    Reporta o progresso (0-100) de um job a partir do processo worker
+    """
+    if _progress_queue is None or not job_id:
+        return
+    try:
+        _progress_queue.put_nowait((job_id, int(progress), stage))
+    except Exception:
+        # Progresso é apenas informativo, nunca deve derrubar o job
+        pass
+
+
+def _run_job(func, job_id, args, kwargs):
+    report_progress(job_id, 0, JOB_RUNNING)
+    return func(job_id, *args, **kwargs)
+
+
+class JobManager:
+    """
+    Gerencia a fila de jobs, o pool de workers e o estado de cada job
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._progress_queue = None
+        self._listener = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            ctx = multiprocessing.get_context()
+            if self._progress_queue is None:
+                self._progress_queue = ctx.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(self._progress_queue,)
+            )
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen_progress, daemon=True)
+                self._listener.start()
+            print(f"Pool de masterização iniciado com {self.max_workers} worker(s)")
+
+    def _listen_progress(self):
+        while True:
+            try:
+                job_id, progress, stage = self._progress_queue.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if not job or job['status'] in (JOB_DONE, JOB_FAILED):
+                    continue
+                job['status'] = JOB_RUNNING
+                job['progress'] = max(job['progress'], progress)
+                if stage and stage != JOB_RUNNING:
+                    job['stage'] = stage
+                job['updated_at'] = time.time()
+
+    def submit(self, func, *args, owner_id=None, on_done=None, **kwargs):
+        """
+        Coloca um job na fila e retorna o seu ID imediatamente.
+        `func` deve ser uma função de nível de módulo e recebe o job_id como primeiro argumento.
+        `on_done(job)` é chamado no processo do Flask quando o job termina (com ou sem erro).
+        """
+        self._ensure_started()
+        self._prune()
+
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                'id': job_id,
+                'owner_id': owner_id,
+                'status': JOB_QUEUED,
+                'progress': 0,
+                'stage': None,
+                'result': None,
+                'error': None,
+                'created_at': now,
+                'updated_at': now
+            }
+
+        try:
+            future = self._executor.submit(_run_job, func, job_id, args, kwargs)
+        except BrokenProcessPool:
+            # Um worker morreu (ex.: falta de memória): recriar o pool e tentar de novo
+            print("Pool de masterização quebrado, recriando...")
+            with self._lock:
+                self._executor = None
+            self._ensure_started()
+            future = self._executor.submit(_run_job, func, job_id, args, kwargs)
+
+        future.add_done_callback(lambda f, job_id=job_id: self._on_done(job_id, f, on_done))
+        return job_id
+
+    def _on_done(self, job_id, future, callback=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            try:
+                job['result'] = future.result()
+                job['status'] = JOB_DONE
+                job['progress'] = 100
+            except Exception as e:
+                print(f"Erro no job {job_id}: {str(e)}")
+                print(f"Traceback: {traceback.format_exc()}")
+                job['status'] = JOB_FAILED
+                job['error'] = str(e)
+            job['updated_at'] = time.time()
+            snapshot = dict(job)
+
+        if callback:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"Erro no callback do job {job_id}: {str(e)}")
+
+    def get(self, job_id):
+        """
+        Retorna uma cópia do estado do job ou None se não existir
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _prune(self):
+        limit = time.time() - JOB_TTL_SECONDS
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['status'] in (JOB_DONE, JOB_FAILED) and job['updated_at'] < limit]
+            for job_id in expired:
+                del self._jobs[job_id]
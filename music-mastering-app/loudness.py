@@ -0,0 +1,346 @@
+"""
+Medição de loudness (LUFS) e true peak, no esquema da ITU-R BS.1770 / EBU R128.
+
+Uma passada pelo arquivo, em blocos, com operações vetorizadas do NumPy/SciPy:
+
+- ponderação K (shelf de agudos + passa-altas) com `sosfilt`, com o estado
+  dos filtros carregado de um bloco para o outro
+- a energia ponderada é acumulada em janelas de 100ms; a loudness momentânea
+  (400ms), de curto prazo (3s) e integrada (gates de -70 LUFS e -10 LU) e a
+  faixa de loudness (LRA) saem dessas janelas
+- true peak por sobreamostragem 4x: as 4 fases do filtro polifásico saem de
+  um único produto de matrizes (janelas do bloco x coeficientes), em float32,
+  com as últimas amostras do bloco anterior como histórico
+
+A memória usada depende só do tamanho do bloco, então o medidor roda tanto
+sobre o master em memória quanto no caminho em blocos (streaming). O
+relatório do master fica em um sidecar `.loudness` (JSON) ao lado do áudio.
+
+Também calcula as correções de ganho do modo álbum do lote.
+"""
+
+import os
+import json
+import uuid
+
+import numpy as np
+import soundfile as sf
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import sosfilt, firwin
+
+# Janela base de energia e janelas de medição (em janelas base)
+LOUDNESS_STEP_SECONDS = 0.1
+MOMENTARY_WINDOW_STEPS = 4
+SHORT_TERM_WINDOW_STEPS = 30
+LOUDNESS_WINDOW_STEPS = MOMENTARY_WINDOW_STEPS
+LOUDNESS_ABSOLUTE_GATE_DB = -70.0
+LOUDNESS_RELATIVE_GATE_DB = -10.0
+
+# Faixa de loudness: janelas de 3s, gate relativo de -20 LU, percentis 10 a 95
+LOUDNESS_RANGE_WINDOW_STEPS = SHORT_TERM_WINDOW_STEPS
+LOUDNESS_RANGE_RELATIVE_GATE_DB = -20.0
+LOUDNESS_RANGE_PERCENTILES = (10, 95)
+
+# Constante da BS.1770 para a energia ponderada em K
+LUFS_OFFSET_DB = -0.691
+
+# True peak: sobreamostragem 4x com FIR de 48 coeficientes (12 por fase)
+TRUE_PEAK_OVERSAMPLING = 4
+TRUE_PEAK_TAPS_PER_PHASE = 12
+
+MEASURE_BLOCK_SIZE = 262144
+
+LOUDNESS_SUFFIX = '.loudness'
+LOUDNESS_VERSION = 1
+
+_SILENCE_DB = -120.0
+
+
+def _to_db(power):
+    return 10 * np.log10(np.maximum(power, 1e-12))
+
+
+def _to_lufs(power):
+    return LUFS_OFFSET_DB + _to_db(power)
+
+
+def k_weighting_sos(sample_rate):
+    """
+    Filtro de ponderação K em seções biquad, para qualquer taxa de amostragem
+    (mesmos polos/zeros da BS.1770, que especifica os coeficientes a 48kHz)
+    """
+    # Estágio 1: shelf de agudos (+4 dB acima de ~1,7kHz)
+    f0, gain_db, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = np.tan(np.pi * f0 / sample_rate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    # Estágio 2: passa-altas (RLB, ~38Hz)
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    highpass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, highpass])
+
+
+class KWeighting:
+    """
+    Ponderação K de blocos (canais, frames), com estado entre blocos
+    """
+
+    def __init__(self, sample_rate):
+        self.sos = k_weighting_sos(sample_rate)
+        self._state = None
+
+    def process(self, block):
+        if self._state is None or self._state.shape[1] != block.shape[0]:
+            self._state = np.zeros((len(self.sos), block.shape[0], 2))
+        filtered, self._state = sosfilt(self.sos, block, axis=-1, zi=self._state)
+        return filtered
+
+
+class TruePeakMeter:
+    """
+    Pico do sinal sobreamostrado (dBTP). Cada fase do filtro polifásico é um FIR
+    curto na taxa original: com as janelas de `taps_per_phase` amostras do bloco
+    (sem cópia, via sliding_window_view), todas as fases saem de um só matmul.
+    """
+
+    def __init__(self, oversampling=TRUE_PEAK_OVERSAMPLING, taps_per_phase=TRUE_PEAK_TAPS_PER_PHASE):
+        taps = firwin(oversampling * taps_per_phase, 1.0 / oversampling, window=('kaiser', 8.0)) * oversampling
+        # (coeficientes, fases), com os coeficientes invertidos para a convolução
+        self.taps_per_phase = taps_per_phase
+        self.matrix = np.stack([taps[phase::oversampling][::-1] for phase in range(oversampling)],
+                               axis=1).astype(np.float32)
+        self.peak = 0.0
+        self._history = None
+
+    def add(self, block):
+        if self._history is None or self._history.shape[0] != block.shape[0]:
+            self._history = np.zeros((block.shape[0], self.taps_per_phase - 1), dtype=np.float32)
+        padded = np.concatenate([self._history, block], axis=1)
+        upsampled = sliding_window_view(padded, self.taps_per_phase, axis=1) @ self.matrix
+        self.peak = max(self.peak, float(np.max(upsampled)), -float(np.min(upsampled)))
+        self._history = padded[:, padded.shape[1] - self._history.shape[1]:]
+
+
+def _window_powers(step_powers, window_steps):
+    """
+    Energia média de janelas de `window_steps` janelas base, deslizando de uma em uma
+    """
+    window_steps = min(window_steps, len(step_powers))
+    cumulative = np.concatenate([[0.0], np.cumsum(step_powers)])
+    return (cumulative[window_steps:] - cumulative[:-window_steps]) / window_steps
+
+
+def gated_loudness(step_powers, window_steps=LOUDNESS_WINDOW_STEPS):
+    """
+    Loudness integrada (LUFS) a partir da energia média de cada janela base
+    """
+    if not len(step_powers):
+        return _SILENCE_DB
+    # Janelas de 400ms deslizando de 100ms: média de 4 janelas base consecutivas
+    windows = _window_powers(step_powers, window_steps)
+
+    windows = windows[_to_lufs(windows) > LOUDNESS_ABSOLUTE_GATE_DB]
+    if not len(windows):
+        return _SILENCE_DB
+    relative_gate = _to_lufs(windows.mean()) + LOUDNESS_RELATIVE_GATE_DB
+    windows = windows[_to_lufs(windows) > relative_gate]
+    return float(_to_lufs(windows.mean()))
+
+
+def max_loudness(step_powers, window_steps):
+    """
+    Maior loudness (LUFS) entre as janelas de `window_steps` janelas base
+    """
+    if not len(step_powers):
+        return _SILENCE_DB
+    return float(max(_to_lufs(_window_powers(step_powers, window_steps).max()), _SILENCE_DB))
+
+
+def loudness_range(step_powers, window_steps=LOUDNESS_RANGE_WINDOW_STEPS):
+    """
+    Faixa de loudness (LU): distância entre os percentis 10 e 95 das janelas de 3s
+    acima dos gates, como medida da dinâmica macro da faixa
+    """
+    if not len(step_powers):
+        return 0.0
+    levels = _to_lufs(_window_powers(step_powers, window_steps))
+    levels = levels[levels > LOUDNESS_ABSOLUTE_GATE_DB]
+    if not len(levels):
+        return 0.0
+    relative_gate = _to_db(np.mean(10 ** (levels / 10))) + LOUDNESS_RANGE_RELATIVE_GATE_DB
+    levels = levels[levels > relative_gate]
+    low, high = np.percentile(levels, LOUDNESS_RANGE_PERCENTILES)
+    return float(high - low)
+
+
+class LoudnessMeter:
+    """
+    Acumula blocos (canais, frames) e mede loudness (ponderada em K), pico de
+    amostra e, se pedido, true peak
+    """
+
+    def __init__(self, sample_rate, true_peak=False):
+        self.sample_rate = sample_rate
+        self.step = max(1, int(round(sample_rate * LOUDNESS_STEP_SECONDS)))
+        self.frames = 0
+        self.channels = 0
+        self.energy = 0.0
+        self.peak = 0.0
+        self.weighting = KWeighting(sample_rate)
+        self.true_peak = TruePeakMeter() if true_peak else None
+        self._powers = []
+        self._pending = None
+
+    def add(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if block.ndim == 1:
+            block = block[np.newaxis, :]
+        if not block.shape[1]:
+            return
+        self.frames += block.shape[1]
+        self.channels = block.shape[0]
+        self.peak = max(self.peak, float(np.max(block)), -float(np.min(block)))
+        self.energy += float(np.einsum('ij,ij->', block, block, dtype=np.float64))
+        if self.true_peak is not None:
+            self.true_peak.add(block)
+
+        # Energia ponderada somada entre os canais, por amostra
+        weighted = self.weighting.process(block)
+        power = np.einsum('ij,ij->j', weighted, weighted)
+        if self._pending is not None:
+            power = np.concatenate([self._pending, power])
+        usable = len(power) - len(power) % self.step
+        if usable:
+            self._powers.append(power[:usable].reshape(-1, self.step).mean(axis=1))
+        self._pending = power[usable:] if usable < len(power) else None
+
+    def step_powers(self):
+        return np.concatenate(self._powers) if self._powers else np.zeros(0)
+
+    def rms_db(self):
+        """
+        RMS de amostra (dB) por canal, sem ponderação nem gate
+        """
+        if not self.frames:
+            return _SILENCE_DB
+        return float(_to_db(self.energy / (self.frames * self.channels)))
+
+    def result(self):
+        powers = self.step_powers()
+        return {
+            'loudness_db': round(gated_loudness(powers), 2),
+            'peak_db': round(float(_to_db(self.peak ** 2)) if self.peak > 0 else _SILENCE_DB, 2),
+            'duration': self.frames / self.sample_rate if self.sample_rate else 0.0
+        }
+
+    def report(self, gain=1.0):
+        """
+        Relatório de medição do master (o que vai no JSON e no banco).
+        `gain` é um ganho linear aplicado depois da medição (ex.: normalização do streaming).
+        """
+        shift = 20 * np.log10(gain) if gain > 0 else 0.0
+        powers = self.step_powers()
+
+        def level(value):
+            return round(float(value + shift), 2) if value > _SILENCE_DB else _SILENCE_DB
+
+        def peak(value):
+            return level(float(_to_db(value ** 2)) if value > 0 else _SILENCE_DB)
+
+        return {
+            'integrated_lufs': level(gated_loudness(powers)),
+            'short_term_max_lufs': level(max_loudness(powers, SHORT_TERM_WINDOW_STEPS)),
+            'momentary_max_lufs': level(max_loudness(powers, MOMENTARY_WINDOW_STEPS)),
+            'loudness_range_lu': round(loudness_range(powers), 2),
+            'true_peak_dbtp': peak(max(self.true_peak.peak, self.peak)) if self.true_peak else None,
+            'sample_peak_dbfs': peak(self.peak)
+        }
+
+
+def meter_file(path, block_size=MEASURE_BLOCK_SIZE, process=None, true_peak=False):
+    """
+    Mede o arquivo em blocos e retorna o LoudnessMeter.
+    `process(bloco, sample_rate, block_size)`, se informado, recebe cada bloco
+    (frames, canais) e retorna o bloco processado (canais, frames) a medir.
+    """
+    try:
+        with sf.SoundFile(path) as f:
+            meter = LoudnessMeter(f.samplerate, true_peak)
+            for block in f.blocks(blocksize=block_size, dtype='float32', always_2d=True):
+                meter.add(process(block, f.samplerate, block_size) if process else block.T)
+    except RuntimeError:
+        # Formato que o soundfile não lê
+        from audio_io import read_audio
+        audio_data, sample_rate = read_audio(path)
+        meter = LoudnessMeter(sample_rate, true_peak)
+        meter.add(process(audio_data.T, sample_rate, audio_data.shape[1]) if process else audio_data)
+    return meter
+
+
+def measure_file(path, block_size=MEASURE_BLOCK_SIZE, process=None):
+    """
+    Loudness integrada, pico e duração do arquivo, lendo em blocos (ver meter_file)
+    """
+    return meter_file(path, block_size, process).result()
+
+
+def loudness_path(audio_path):
+    """
+    Caminho do sidecar de medição ao lado do arquivo de áudio
+    """
+    return audio_path + LOUDNESS_SUFFIX
+
+
+def save_loudness(audio_path, report):
+    """
+    Grava o relatório de medição no sidecar (escrita atômica)
+    """
+    path = loudness_path(audio_path)
+    # Nome único: dois workers podem gravar o mesmo sidecar ao mesmo tempo
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(report, version=LOUDNESS_VERSION), f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return report
+
+
+def load_or_measure_loudness(audio_path):
+    """
+    Lê o sidecar de medição se estiver atualizado; senão mede o arquivo e grava
+    """
+    path = loudness_path(audio_path)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(audio_path):
+            with open(path) as f:
+                report = json.load(f)
+            if report.pop('version', None) == LOUDNESS_VERSION:
+                return report
+    except (OSError, ValueError):
+        pass
+    return save_loudness(audio_path, meter_file(audio_path, true_peak=True).report())
+
+
+def album_target_loudness(levels, target_db=None):
+    """
+    Alvo de loudness comum do álbum a partir da loudness prevista de cada faixa (dB).
+    Sem alvo explícito, o alvo é a média das faixas (o álbum mantém o nível médio e
+    as faixas ficam iguais entre si). Faixas sem previsão (None) ou em silêncio ficam
+    fora do alvo. Retorna (alvo, [alvo por faixa ou None]).
+    """
+    audible = [level for level in levels if level is not None and level > _SILENCE_DB]
+    if target_db is None:
+        target_db = float(np.mean(audible)) if audible else None
+    if target_db is None:
+        return None, [None] * len(levels)
+    target_db = round(float(target_db), 2)
+    return target_db, [target_db if level is not None and level > _SILENCE_DB else None for level in levels]
@@ -0,0 +1,270 @@
+"""
+Modo alvo de loudness: leva o master a um LUFS integrado sem passar de um true
+peak máximo, com uma única renderização em resolução completa.
+
+1. Os estágios da cadeia antes do Gain (filtros, EQ, compressor) rodam uma vez.
+2. Esse sinal vira um proxy de análise em taxa reduzida (soxr, ~11kHz).
+3. No proxy, uma busca (regula falsi) no gain_db, que é o drive do limiter,
+   procura o menor drive cuja relação pico/loudness (PLR = true peak - LUFS)
+   cabe em `max_true_peak - target_lufs`. Cada passo roda só Gain, low-pass e
+   limiter sobre o proxy e o mede.
+   O proxy perde os agudos acima da sua Nyquist, o que muda o PLR; os trechos
+   curtos de maior pico, processados em taxa completa no drive encontrado,
+   medem essa diferença e a busca é refeita com o alvo corrigido.
+4. Com o drive escolhido, os estágios do Gain em diante rodam uma vez sobre o
+   sinal completo.
+5. O master é medido e um ajuste linear final (trim) acerta o alvo: ganho
+   linear desloca loudness e true peak igualmente, então o trim é exato e
+   nunca passa do true peak máximo (se o alvo for inalcançável, o master fica
+   no true peak máximo, abaixo do alvo).
+
+A mesma previsão (proxy calibrado, medindo a saída do Gain em diante) escolhe o
+gain_db que leva o master à loudness da referência (`solve_loudness_gain`).
+"""
+
+import numpy as np
+import soxr
+
+# Limites aceitos para o alvo
+TARGET_LUFS_RANGE = (-40.0, -5.0)
+MAX_TRUE_PEAK_RANGE = (-9.0, 0.0)
+DEFAULT_MAX_TRUE_PEAK = -1.0
+
+# Proxy de análise: taxa reduzida e tamanho máximo (faixas longas usam uma taxa menor)
+TARGET_PROXY_RATE = 11025
+TARGET_PROXY_MIN_RATE = 4000
+TARGET_PROXY_MAX_FRAMES = TARGET_PROXY_RATE * 900
+
+# Busca do drive
+TARGET_MAX_DRIVE_DB = 24.0
+TARGET_TOLERANCE_DB = 0.2
+TARGET_MAX_ITERATIONS = 8
+
+# Calibração do proxy: trechos com os maiores picos, em taxa completa
+TARGET_CALIBRATION_SLICES = 6
+TARGET_CALIBRATION_SLICE_SECONDS = 2.0
+TARGET_CALIBRATION_ROUNDS = 2
+
+_SILENCE_DB = -120.0
+
+
+def parse_loudness_target(values):
+    """
+    {'target_lufs', 'max_true_peak'} a partir dos parâmetros (JSON ou formulário);
+    {} se o modo alvo não foi pedido. ValueError se os valores forem inválidos.
+    """
+    target = values.get('target_lufs')
+    if target is None or target == '':
+        return {}
+    max_true_peak = values.get('max_true_peak')
+    try:
+        target = float(target)
+        max_true_peak = DEFAULT_MAX_TRUE_PEAK if max_true_peak in (None, '') else float(max_true_peak)
+    except (TypeError, ValueError):
+        raise ValueError('Alvo de loudness inválido')
+    if not TARGET_LUFS_RANGE[0] <= target <= TARGET_LUFS_RANGE[1]:
+        raise ValueError(f'Alvo de loudness fora da faixa ({TARGET_LUFS_RANGE[0]:g} a {TARGET_LUFS_RANGE[1]:g} LUFS)')
+    if not MAX_TRUE_PEAK_RANGE[0] <= max_true_peak <= MAX_TRUE_PEAK_RANGE[1]:
+        raise ValueError(f'True peak máximo fora da faixa ({MAX_TRUE_PEAK_RANGE[0]:g} a {MAX_TRUE_PEAK_RANGE[1]:g} dBTP)')
+    return {'target_lufs': target, 'max_true_peak': max_true_peak}
+
+
+def has_loudness_target(params):
+    return params.get('target_lufs') is not None
+
+
+def proxy_rate(sample_rate, frames):
+    """
+    Taxa do proxy: TARGET_PROXY_RATE, reduzida para faixas longas caberem em TARGET_PROXY_MAX_FRAMES
+    """
+    duration = frames / sample_rate if sample_rate else 0
+    rate = TARGET_PROXY_RATE
+    if duration and duration * rate > TARGET_PROXY_MAX_FRAMES:
+        rate = max(TARGET_PROXY_MIN_RATE, int(TARGET_PROXY_MAX_FRAMES / duration))
+    return min(rate, sample_rate)
+
+
+class ProxyBuilder:
+    """
+    Reamostra blocos (canais, frames) para o proxy de análise e junta o resultado
+    """
+
+    def __init__(self, sample_rate, rate, channels):
+        self.rate = rate
+        self.channels = channels
+        self._resampler = soxr.ResampleStream(sample_rate, rate, channels, dtype='float32', quality='LQ') \
+            if rate != sample_rate else None
+        self._blocks = []
+
+    def add(self, block):
+        if self._resampler is None:
+            self._blocks.append(np.array(block, dtype=np.float32))
+        else:
+            self._blocks.append(self._resampler.resample_chunk(np.ascontiguousarray(block.T)).T)
+
+    def build(self):
+        if self._resampler is not None:
+            tail = self._resampler.resample_chunk(np.zeros((0, self.channels), dtype=np.float32), last=True)
+            self._blocks.append(tail.T)
+        if not self._blocks:
+            return np.zeros((self.channels, 0), dtype=np.float32)
+        return np.ascontiguousarray(np.concatenate(self._blocks, axis=1))
+
+
+class CalibrationBuilder:
+    """
+    Trechos de calibração montados durante uma passada em blocos (canais, frames), sem
+    reler o arquivo: guarda só as TARGET_CALIBRATION_SLICES janelas completas de maior
+    pico (mesmo critério de `calibration_ranges`) e, em faixas curtas, o sinal inteiro
+    """
+
+    def __init__(self, sample_rate, channels):
+        self.channels = channels
+        self.length = int(TARGET_CALIBRATION_SLICE_SECONDS * sample_rate)
+        self.count = 0
+        self._windows = []
+        self._pending = []
+        self._pending_frames = 0
+
+    def add(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        while block.shape[1]:
+            take = min(self.length - self._pending_frames, block.shape[1])
+            self._pending.append(block[:, :take])
+            self._pending_frames += take
+            block = block[:, take:]
+            if self._pending_frames == self.length:
+                window = np.concatenate(self._pending, axis=1)
+                self._windows.append((float(np.max(np.abs(window))) if window.size else 0.0, self.count, window))
+                self.count += 1
+                self._pending, self._pending_frames = [], 0
+                if len(self._windows) > TARGET_CALIBRATION_SLICES:
+                    self._windows.remove(min(self._windows, key=lambda item: item[0]))
+
+    def build(self):
+        windows = [window for _, _, window in sorted(self._windows, key=lambda item: item[1])]
+        if self.count <= TARGET_CALIBRATION_SLICES:
+            windows += self._pending
+        if not windows:
+            return np.zeros((self.channels, 0), dtype=np.float32)
+        return np.concatenate(windows, axis=1)
+
+
+def calibration_ranges(proxy_signal, rate, sample_rate, frames):
+    """
+    Trechos (início, fim), em frames da taxa completa, usados para calibrar o proxy:
+    as janelas com os maiores picos no proxy, onde o limiter mais trabalha e onde
+    costuma estar o true peak da faixa
+    """
+    length = int(TARGET_CALIBRATION_SLICE_SECONDS * sample_rate)
+    window = int(TARGET_CALIBRATION_SLICE_SECONDS * rate)
+    count = proxy_signal.shape[1] // window if window else 0
+    if frames <= length * TARGET_CALIBRATION_SLICES or count <= TARGET_CALIBRATION_SLICES:
+        return [(0, frames)]
+    peaks = np.abs(proxy_signal[:, :count * window]).reshape(proxy_signal.shape[0], count, window).max(axis=(0, 2))
+    ranges = []
+    for index in np.sort(np.argsort(peaks)[-TARGET_CALIBRATION_SLICES:]):
+        start = min(int(index * window * sample_rate / rate), frames - length)
+        ranges.append((start, start + length))
+    return ranges
+
+
+def solve_drive(plr_at, base_gain_db, goal_plr, known=None, max_drive_db=TARGET_MAX_DRIVE_DB,
+                tolerance=TARGET_TOLERANCE_DB, max_iterations=TARGET_MAX_ITERATIONS):
+    """
+    Menor gain_db (a partir de `base_gain_db`) com PLR <= `goal_plr`, onde
+    `plr_at(gain_db)` mede o proxy. Mais drive = mais limitação = PLR menor.
+    `known` ({gain_db: PLR}) guarda as avaliações e, vindo de uma busca anterior,
+    estreita o intervalo inicial.
+    """
+    known = {} if known is None else known
+
+    def f(gain_db):
+        if gain_db not in known:
+            known[gain_db] = plr_at(gain_db)
+        return known[gain_db] - goal_plr
+
+    lo = base_gain_db
+    f_lo = f(lo)
+    if f_lo <= 0:
+        # Sem limitação extra: o trim final sozinho alcança o alvo
+        return lo
+    above = [gain_db for gain_db in known if f(gain_db) > 0]
+    below = [gain_db for gain_db in known if f(gain_db) <= 0]
+    lo = max(above)
+    f_lo = f(lo)
+    hi = min(below) if below else base_gain_db + max_drive_db
+    f_hi = f(hi)
+    if f_hi > 0:
+        # Alvo inalcançável mesmo com o drive máximo: o trim final respeita o true peak
+        return hi
+
+    # Regula falsi (variante Illinois) no intervalo [lo, hi], com f(lo) > 0 >= f(hi)
+    side = 0
+    for _ in range(max_iterations):
+        if hi - lo <= tolerance or -tolerance <= f_hi:
+            break
+        if f_lo <= tolerance:
+            # Já dentro da tolerância pelo outro lado: a secante voltaria ao mesmo ponto
+            return lo
+        gain = hi - f_hi * (hi - lo) / (f_hi - f_lo)
+        value = f(gain)
+        if value <= 0:
+            hi, f_hi = gain, value
+            if side == -1:
+                f_lo /= 2
+            side = -1
+        else:
+            lo, f_lo = gain, value
+            if side == 1:
+                f_hi /= 2
+            side = 1
+    return hi
+
+
+def solve_target(plr_at, base_gain_db, goal_plr, plr_offset_at=None, max_drive_db=TARGET_MAX_DRIVE_DB):
+    """
+    Drive para o alvo: busca no proxy (`plr_at`) e, com `plr_offset_at(gain_db)`
+    (PLR em taxa completa menos PLR no proxy, medidos nos trechos de calibração),
+    refaz a busca com o alvo corrigido até o drive estabilizar.
+    Retorna (gain_db, correção do PLR em dB, avaliações no proxy).
+    """
+    known = {}
+    gain_db = solve_drive(plr_at, base_gain_db, goal_plr, known, max_drive_db)
+    offset = 0.0
+    if plr_offset_at is not None:
+        for _ in range(TARGET_CALIBRATION_ROUNDS):
+            offset = plr_offset_at(gain_db)
+            corrected = solve_drive(plr_at, base_gain_db, goal_plr - offset, known, max_drive_db)
+            converged = abs(corrected - gain_db) <= TARGET_TOLERANCE_DB
+            gain_db = corrected
+            if converged:
+                break
+    return gain_db, offset, len(known)
+
+
+def solve_loudness_gain(loudness_at, goal_lufs, gain_range, loudness_offset_at=None):
+    """
+    gain_db, dentro de `gain_range`, com o qual a loudness integrada do master medida
+    no proxy por `loudness_at(gain_db)` chega a `goal_lufs`. Mais ganho = master mais
+    alto, então é a busca do drive (solve_target) com os sinais invertidos.
+    `loudness_offset_at(gain_db)`: loudness em taxa completa menos no proxy, medidas
+    nos trechos de calibração.
+    Retorna (gain_db, correção da loudness em dB, avaliações no proxy).
+    """
+    low, high = gain_range
+    offset_at = (lambda gain_db: -loudness_offset_at(gain_db)) if loudness_offset_at else None
+    gain_db, offset, evaluations = solve_target(lambda gain_db: -loudness_at(gain_db), low, -goal_lufs,
+                                                offset_at, max_drive_db=high - low)
+    return gain_db, -offset, evaluations
+
+
+def output_trim(report, target_lufs, max_true_peak):
+    """
+    Ganho linear final: acerta o alvo de loudness sem passar do true peak máximo
+    """
+    if report['true_peak_dbtp'] is None or report['integrated_lufs'] <= _SILENCE_DB:
+        # Silêncio (ou sem true peak): nada a ajustar
+        return 1.0
+    trim_db = min(target_lufs - report['integrated_lufs'], max_true_peak - report['true_peak_dbtp'])
+    return float(10 ** (trim_db / 20))
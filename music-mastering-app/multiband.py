@@ -0,0 +1,189 @@
+"""
+Compressão multibanda (EQ dinâmico) com crossovers Linkwitz-Riley.
+
+O sinal é dividido em três bandas por crossovers Linkwitz-Riley de 4ª ordem
+(duas Butterworth de 2ª ordem em cascata):
+
+    x ── LP(f1) ── AP(f2) ──────── graves
+     └── HP(f1) ─┬─ LP(f2) ─────── médios
+                 └─ HP(f2) ─────── agudos
+
+O all-pass em f2 nos graves alinha a fase deles com a soma médios + agudos:
+sem compressão, a soma das bandas tem resposta de magnitude plana. Cada banda
+passa por um compressor e um ganho próprios (o ganho acerta o balanço tonal,
+o compressor o controla conforme o nível) e as bandas são somadas.
+
+Os filtros rodam com scipy (sosfilt, vetorizado em todos os canais, com estado
+entre blocos); os filtros independentes de cada nível da divisão e os
+compressores das bandas rodam em paralelo em threads (sosfilt e a Pedalboard
+liberam o GIL). O mesmo processamento em blocos atende o áudio inteiro em
+memória e o streaming: com `reset=False` o estado continua entre chamadas,
+como nos plugins da Pedalboard.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.signal import butter, tf2sos, sosfilt
+from pedalboard import Pedalboard, Compressor, Gain
+
+# Blocos internos do processamento em memória (~1,5s a 44.1kHz)
+MULTIBAND_BLOCK_SIZE = 65536
+
+# Threads das bandas (1 = sequencial)
+MULTIBAND_THREADS = int(os.environ.get('MULTIBAND_THREADS', min(3, os.cpu_count() or 1)))
+
+# Crossovers acima desta fração da taxa de amostragem são limitados a ela
+MAX_CROSSOVER_FRACTION = 0.45
+
+BANDS = ('low', 'mid', 'high')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def run_parallel(tasks):
+    """
+    Executa as funções sem argumentos em `tasks` nas threads das bandas; retorna os resultados em ordem
+    """
+    global _executor
+    if MULTIBAND_THREADS <= 1 or len(tasks) == 1:
+        return [task() for task in tasks]
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MULTIBAND_THREADS, thread_name_prefix='multiband')
+    return [future.result() for future in [_executor.submit(task) for task in tasks]]
+
+
+def linkwitz_riley(cutoff_hz, sample_rate, btype):
+    """
+    Seções biquad (sos) de um filtro Linkwitz-Riley de 4ª ordem: Butterworth de 2ª ordem duas vezes
+    """
+    sos = butter(2, cutoff_hz, btype, fs=sample_rate, output='sos')
+    return np.concatenate([sos, sos])
+
+
+def linkwitz_riley_allpass(cutoff_hz, sample_rate):
+    """
+    All-pass com a mesma fase de LP + HP Linkwitz-Riley em `cutoff_hz`
+    """
+    b_low, a = butter(2, cutoff_hz, 'lowpass', fs=sample_rate)
+    b_high, _ = butter(2, cutoff_hz, 'highpass', fs=sample_rate)
+    numerator = np.polyadd(np.polymul(b_low, b_low), np.polymul(b_high, b_high))
+    return tf2sos(numerator, np.polymul(a, a))
+
+
+class StatefulFilter:
+    """
+    Filtro sos aplicado em blocos (canais, frames), com o estado guardado entre eles
+    """
+
+    def __init__(self, sos):
+        self.sos = sos
+        self.zi = None
+
+    def __call__(self, block):
+        if self.zi is None:
+            self.zi = np.zeros((self.sos.shape[0], block.shape[0], 2))
+        output, self.zi = sosfilt(self.sos, block, axis=-1, zi=self.zi)
+        return output
+
+    def reset(self):
+        self.zi = None
+
+
+class MultibandCompressor:
+    """
+    Estágio de compressão em três bandas, usável em presets da cadeia ao lado dos
+    plugins da Pedalboard (mesma chamada `board(audio, sample_rate, reset=True)`)
+    """
+
+    # Atributos aceitos no preset (e atualizados no lugar pelo pool de boards)
+    PARAMETERS = {
+        'low_crossover_hz': 200.0,
+        'high_crossover_hz': 3000.0,
+        'low_threshold_db': -24.0, 'low_ratio': 2.0, 'low_attack_ms': 30.0, 'low_release_ms': 250.0,
+        'low_gain_db': 0.0,
+        'mid_threshold_db': -24.0, 'mid_ratio': 1.8, 'mid_attack_ms': 15.0, 'mid_release_ms': 150.0,
+        'mid_gain_db': 0.0,
+        'high_threshold_db': -26.0, 'high_ratio': 1.6, 'high_attack_ms': 5.0, 'high_release_ms': 80.0,
+        'high_gain_db': 0.0,
+    }
+
+    def __init__(self, **values):
+        unknown = set(values) - set(self.PARAMETERS)
+        if unknown:
+            raise TypeError(f"atributos desconhecidos: {', '.join(sorted(unknown))}")
+        for name, default in self.PARAMETERS.items():
+            setattr(self, name, float(values.get(name, default)))
+        if not 0 < self.low_crossover_hz < self.high_crossover_hz:
+            raise ValueError('os crossovers devem ser positivos e low_crossover_hz < high_crossover_hz')
+
+        self._bands = {band: Pedalboard([Compressor(), Gain()]) for band in BANDS}
+        self._filters = None
+        self._design = None
+
+    def _prepare(self, sample_rate):
+        # Filtros refeitos só quando a taxa ou os crossovers mudam (o estado recomeça)
+        limit = MAX_CROSSOVER_FRACTION * sample_rate
+        low_hz = min(self.low_crossover_hz, limit)
+        high_hz = min(self.high_crossover_hz, limit)
+        design = (sample_rate, low_hz, high_hz)
+        if design != self._design:
+            self._design = design
+            self._filters = {
+                'split_low': StatefulFilter(linkwitz_riley(low_hz, sample_rate, 'lowpass')),
+                'split_high': StatefulFilter(linkwitz_riley(low_hz, sample_rate, 'highpass')),
+                'low': StatefulFilter(linkwitz_riley_allpass(high_hz, sample_rate)),
+                'mid': StatefulFilter(linkwitz_riley(high_hz, sample_rate, 'lowpass')),
+                'high': StatefulFilter(linkwitz_riley(high_hz, sample_rate, 'highpass')),
+            }
+
+        # Parâmetros atuais de cada banda nos seus plugins
+        for band, board in self._bands.items():
+            compressor, gain = board
+            compressor.threshold_db = getattr(self, f'{band}_threshold_db')
+            compressor.ratio = getattr(self, f'{band}_ratio')
+            compressor.attack_ms = getattr(self, f'{band}_attack_ms')
+            compressor.release_ms = getattr(self, f'{band}_release_ms')
+            gain.gain_db = getattr(self, f'{band}_gain_db')
+
+    def reset(self):
+        for board in self._bands.values():
+            board.reset()
+        for stage in (self._filters or {}).values():
+            stage.reset()
+
+    def _process_block(self, block, sample_rate):
+        filters = self._filters
+        block = np.asarray(block, dtype=np.float64)
+        low, rest = run_parallel([lambda: filters['split_low'](block), lambda: filters['split_high'](block)])
+        split = {'low': low, 'mid': rest, 'high': rest}
+
+        def compress(band):
+            signal = filters[band](split[band]).astype(np.float32)
+            return self._bands[band](signal, sample_rate, reset=False)
+
+        low, mid, high = run_parallel([lambda band=band: compress(band) for band in BANDS])
+        low += mid
+        low += high
+        return low
+
+    def __call__(self, audio, sample_rate, reset=True):
+        """
+        Processa `audio` (canais, frames) e retorna float32 no mesmo formato
+        """
+        if reset:
+            self.reset()
+        self._prepare(sample_rate)
+        frames = audio.shape[-1]
+        if frames <= MULTIBAND_BLOCK_SIZE:
+            return self._process_block(audio, sample_rate)
+
+        output = np.empty(audio.shape, dtype=np.float32)
+        for start in range(0, frames, MULTIBAND_BLOCK_SIZE):
+            end = min(start + MULTIBAND_BLOCK_SIZE, frames)
+            output[:, start:end] = self._process_block(audio[:, start:end], sample_rate)
+        return output
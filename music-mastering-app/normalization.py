@@ -0,0 +1,63 @@
+"""
+Normalização de pico em duas passadas, sem criar cópias do sinal.
+
+Primeira passada: `observe` acompanha o pico de cada bloco (ou do sinal
+inteiro). Segunda passada: `apply` aplica o ganho no próprio array, seja o
+áudio completo em memória ou cada bloco no momento da escrita final.
+"""
+
+import numpy as np
+
+# Pico máximo permitido na saída da masterização
+NORMALIZATION_TARGET_PEAK = 0.98
+
+
+def peak_abs(audio_data):
+    """
+    Pico absoluto do sinal sem alocar o array intermediário de np.abs
+    """
+    if audio_data.size == 0:
+        return 0.0
+    return max(float(np.max(audio_data)), -float(np.min(audio_data)))
+
+
+class PeakNormalizer:
+    """
+    Acompanha o pico em execução e aplica o ganho de normalização no lugar
+    """
+
+    def __init__(self, target_peak=NORMALIZATION_TARGET_PEAK):
+        self.target_peak = target_peak
+        self.peak = 0.0
+
+    def observe(self, block):
+        self.peak = max(self.peak, peak_abs(block))
+        return self.peak
+
+    # Mesma interface dos acumuladores por bloco (picos, loudness) do streaming
+    add = observe
+
+    @property
+    def gain(self):
+        # Normalização suave: só reduz quando o pico passa do alvo
+        if self.peak > self.target_peak:
+            return self.target_peak / self.peak
+        return 1.0
+
+    def apply(self, block):
+        """
+        Aplica o ganho no próprio bloco (deve ser um array float gravável)
+        """
+        gain = self.gain
+        if gain != 1.0:
+            np.multiply(block, gain, out=block)
+        return block
+
+
+def normalize_in_place(audio_data, target_peak=NORMALIZATION_TARGET_PEAK):
+    """
+    Normaliza um sinal completo em memória, reutilizando o mesmo buffer
+    """
+    normalizer = PeakNormalizer(target_peak)
+    normalizer.observe(audio_data)
+    return normalizer.apply(audio_data)
@@ -0,0 +1,308 @@
+"""
+Análise de referência: compara a faixa com a referência e deriva os parâmetros
+da masterização.
+
+Uma passada em blocos por arquivo extrai um vetor de features:
+
+- loudness integrada (LUFS) e pico de amostra
+- fator de crista (pico menos RMS)
+- faixa de loudness (janelas de 3s, percentis 10 a 95), a dinâmica macro
+- balanço espectral: energia dos graves e dos agudos relativa aos médios,
+  a partir de uma STFT vetorizada (todos os quadros do bloco em uma rfft)
+
+As features dependem só do conteúdo, então ficam em cache pelo hash do
+arquivo (`uploads/features/<ab>/<hash>.json`, mais um LRU em memória): uma
+referência usada em muitas sessões é analisada uma única vez. Os parâmetros
+resolvidos para um par faixa/referência também ficam em cache
+(`resolved_params_cache`), já que o ganho exige uma passada pela cadeia.
+
+A partir das diferenças entre faixa e referência, `derive_params` escolhe
+os shelves de EQ e o compressor; o ganho é resolvido depois, prevendo a
+loudness do master (estágios do Gain em diante, inclusive o limiter) a
+partir da faixa já equalizada e comprimida (ver `match_gain`).
+"""
+
+import os
+import json
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import soundfile as sf
+
+from content_store import FEATURE_DIR, SHARD_WIDTH, content_hash
+from loudness import LoudnessMeter, loudness_range, MEASURE_BLOCK_SIZE
+from loudness_target import solve_loudness_gain
+
+# Incrementar quando o cálculo das features mudar (features antigas são recalculadas)
+FEATURES_VERSION = 3
+# Incrementar quando a derivação dos parâmetros (derive_params/match_gain) mudar
+RESOLVED_PARAMS_VERSION = 1
+
+STFT_SIZE = 4096
+STFT_HOP = STFT_SIZE // 2
+
+# Limites das bandas do balanço espectral, os mesmos dos shelves da cadeia
+LOW_BAND_HZ = 150.0
+HIGH_BAND_HZ = 6000.0
+# Em taxas baixas o limite dos agudos desce para esta fração de Nyquist (a banda não fica vazia)
+HIGH_BAND_MAX_NYQUIST_FRACTION = 0.75
+
+# Limites dos parâmetros derivados
+SHELF_MAX_DB = 6.0
+MATCH_MAX_GAIN_DB = 12.0
+COMPRESSOR_RATIO_RANGE = (1.2, 4.0)
+COMPRESSOR_THRESHOLD_RANGE = (-40.0, -6.0)
+# Threshold do compressor em relação ao RMS da faixa
+COMPRESSOR_THRESHOLD_OFFSET_DB = 4.0
+# Dinâmica em excesso (dB) que soma 1 ao ratio
+COMPRESSOR_DB_PER_RATIO = 4.0
+
+FEATURE_CACHE_SIZE = 256
+
+_SILENCE_DB = -120.0
+
+
+def _to_db(power):
+    return 10 * np.log10(np.maximum(power, 1e-12))
+
+
+class SpectrumAccumulator:
+    """
+    Espectro de potência médio do sinal (mono), acumulado bloco a bloco.
+    Os quadros de cada bloco saem de uma só vez (sliding_window_view) e passam
+    por uma única rfft; a sobra do bloco continua no próximo.
+    """
+
+    def __init__(self, size=STFT_SIZE, hop=STFT_HOP):
+        self.size = size
+        self.hop = hop
+        self.window = np.hanning(size).astype(np.float32)
+        self.power = np.zeros(size // 2 + 1)
+        self.count = 0
+        self._tail = np.zeros(0, dtype=np.float32)
+
+    def add(self, block):
+        mono = np.concatenate([self._tail, block.mean(axis=0, dtype=np.float32)])
+        if len(mono) < self.size:
+            self._tail = mono
+            return
+        frames = np.lib.stride_tricks.sliding_window_view(mono, self.size)[::self.hop]
+        spectrum = np.fft.rfft(frames * self.window, axis=1)
+        self.power += np.einsum('ij,ij->j', spectrum.real, spectrum.real) + np.einsum('ij,ij->j', spectrum.imag, spectrum.imag)
+        self.count += len(frames)
+        self._tail = mono[len(frames) * self.hop:]
+
+    def band_balance(self, sample_rate):
+        """
+        Energia dos graves (< LOW_BAND_HZ) e dos agudos (> HIGH_BAND_HZ) em dB,
+        relativa à energia por Hz dos médios; 0 dB para uma banda sem nenhum bin
+        """
+        nyquist = sample_rate / 2
+        high_hz = min(HIGH_BAND_HZ, HIGH_BAND_MAX_NYQUIST_FRACTION * nyquist)
+        freqs = np.fft.rfftfreq(self.size, 1.0 / sample_rate)
+        low = self.power[(freqs > 20) & (freqs < LOW_BAND_HZ)]
+        mid = self.power[(freqs >= LOW_BAND_HZ) & (freqs <= high_hz)]
+        high = self.power[(freqs > high_hz) & (freqs < min(16000, nyquist))]
+
+        def relative_db(band):
+            if not len(band) or not len(mid):
+                return 0.0
+            return float(_to_db(band.mean()) - _to_db(mid.mean()))
+
+        return relative_db(low), relative_db(high)
+
+
+def extract_features(path, block_size=MEASURE_BLOCK_SIZE):
+    """
+    Vetor de features do arquivo, lido em blocos
+    """
+    def analyze(blocks, sample_rate):
+        meter = LoudnessMeter(sample_rate)
+        spectrum = SpectrumAccumulator()
+        for block in blocks:
+            meter.add(block)
+            spectrum.add(block)
+        return meter, spectrum
+
+    try:
+        with sf.SoundFile(path) as f:
+            sample_rate = f.samplerate
+            meter, spectrum = analyze(
+                (block.T for block in f.blocks(blocksize=block_size, dtype='float32', always_2d=True)),
+                sample_rate
+            )
+    except RuntimeError:
+        # Formato que o soundfile não lê
+        from audio_io import read_audio
+        audio_data, sample_rate = read_audio(path)
+        meter, spectrum = analyze([audio_data], sample_rate)
+
+    measured = meter.result()
+    rms_db = meter.rms_db()
+    low_db, high_db = spectrum.band_balance(sample_rate) if spectrum.count else (0.0, 0.0)
+    return {
+        'version': FEATURES_VERSION,
+        'sample_rate': sample_rate,
+        'duration': round(measured['duration'], 3),
+        'loudness_db': measured['loudness_db'],
+        'peak_db': measured['peak_db'],
+        'rms_db': round(rms_db, 2),
+        'crest_db': round(measured['peak_db'] - rms_db, 2),
+        'loudness_range_db': round(loudness_range(meter.step_powers()), 2),
+        'low_db': round(low_db, 2),
+        'high_db': round(high_db, 2)
+    }
+
+
+def features_path(digest, suffix='.json'):
+    return os.path.join(FEATURE_DIR, digest[:SHARD_WIDTH], f"{digest}{suffix}")
+
+
+class JsonCache:
+    """
+    Valores JSON por chave: LRU em memória na frente do cache em disco (shards em
+    `uploads/features/`). Valores gravados com outra `version` são ignorados.
+    """
+
+    def __init__(self, version, suffix='.json', max_entries=FEATURE_CACHE_SIZE):
+        self.version = version
+        self.suffix = suffix
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """
+        Valor guardado em `key` (memória ou disco), ou None
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                return value
+        value = self._load(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def store(self, key, value):
+        self._save(key, value)
+        self._remember(key, value)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, key):
+        cached_path = features_path(key, self.suffix)
+        try:
+            with open(cached_path) as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if value.pop('version', None) != self.version:
+            return None
+        # Valor reaproveitado: a retenção usa o mtime como último uso
+        os.utime(cached_path)
+        return value
+
+    def _save(self, key, value):
+        cached_path = features_path(key, self.suffix)
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        tmp_path = f"{cached_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(dict(value, version=self.version), f)
+            os.replace(tmp_path, cached_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class FeatureCache(JsonCache):
+    """
+    Features por hash do conteúdo do arquivo
+    """
+
+    def __init__(self, max_entries=FEATURE_CACHE_SIZE):
+        super().__init__(FEATURES_VERSION, max_entries=max_entries)
+
+    def get(self, path):
+        digest = content_hash(path)
+        features = self.lookup(digest)
+        if features is None:
+            features = extract_features(path)
+            self.store(digest, features)
+        return features
+
+
+feature_cache = FeatureCache()
+
+
+def resolved_params_key(target_hash, reference_hash, chain_version, overrides):
+    """
+    Chave dos parâmetros resolvidos a partir da referência: hash de (faixa, referência,
+    cadeia do preset, valores passados explicitamente)
+    """
+    payload = json.dumps({
+        'target': target_hash,
+        'reference': reference_hash,
+        'chain': chain_version,
+        'overrides': {name: round(float(value), 2) for name, value in overrides.items()}
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+# Parâmetros resolvidos com a referência (EQ, compressor e o ganho que exige uma
+# passada pela cadeia): a mesma faixa com a mesma referência não é analisada de novo
+resolved_params_cache = JsonCache(RESOLVED_PARAMS_VERSION, suffix='.params.json')
+
+
+def is_silent(features):
+    return features['loudness_db'] <= _SILENCE_DB
+
+
+def derive_params(target, reference):
+    """
+    Shelves de EQ e compressor que aproximam a faixa da referência (os demais
+    parâmetros ficam com os valores padrão do preset).
+    - EQ: a diferença de balanço espectral de cada banda vira o ganho do shelf
+    - compressor: a dinâmica em excesso na faixa (crista e faixa de loudness
+      acima das da referência) define o ratio e o quanto o threshold desce
+    """
+    low_shelf = np.clip(reference['low_db'] - target['low_db'], -SHELF_MAX_DB, SHELF_MAX_DB)
+    high_shelf = np.clip(reference['high_db'] - target['high_db'], -SHELF_MAX_DB, SHELF_MAX_DB)
+
+    excess = max(0.0, 0.5 * (target['crest_db'] - reference['crest_db'])
+                 + 0.5 * (target['loudness_range_db'] - reference['loudness_range_db']))
+    ratio = np.clip(1.0 + excess / COMPRESSOR_DB_PER_RATIO, *COMPRESSOR_RATIO_RANGE)
+    threshold = np.clip(target['rms_db'] + COMPRESSOR_THRESHOLD_OFFSET_DB - excess / 2,
+                        *COMPRESSOR_THRESHOLD_RANGE)
+
+    return {
+        'compressor_threshold': round(float(threshold), 1),
+        'compressor_ratio': round(float(ratio), 2),
+        'low_shelf_db': round(float(low_shelf), 1),
+        'high_shelf_db': round(float(high_shelf), 1)
+    }
+
+
+def match_gain(pre_gain_loudness_db, reference, loudness_at, loudness_offset_at=None):
+    """
+    Ganho (dB) que leva a loudness integrada do master à da referência.
+    `loudness_at(gain_db)` mede no proxy da faixa a saída dos estágios do Gain em
+    diante (o limiter muda a loudness além do próprio ganho) e
+    `loudness_offset_at(gain_db)` corrige o proxy para a taxa completa (ver
+    loudness_target). Referências mais altas do que o limiter alcança ficam no
+    ganho máximo (MATCH_MAX_GAIN_DB). Faixa em silêncio: None (fica o ganho do preset).
+    """
+    if pre_gain_loudness_db <= _SILENCE_DB:
+        return None
+    gain, _, _ = solve_loudness_gain(loudness_at, reference['loudness_db'],
+                                     (-MATCH_MAX_GAIN_DB, MATCH_MAX_GAIN_DB), loudness_offset_at)
+    return round(float(gain), 2)
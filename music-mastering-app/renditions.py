@@ -0,0 +1,144 @@
+"""
+Versões comprimidas (Opus/MP3/FLAC) do áudio para tocar no navegador.
+
+Os players da página de masterização tocavam o WAV sem compressão (~10MB por
+minuto por player). A versão comprimida é gerada na primeira vez que é pedida,
+em blocos (sem carregar a faixa inteira), e fica gravada ao lado do áudio com
+a versão do conteúdo no nome: `x.wav.<versão>.opus`. Um master refeito tem
+outra versão, então a versão antiga nunca é servida no lugar da nova.
+
+Os downloads continuam servindo o WAV original, bit a bit.
+"""
+
+import os
+import glob
+import uuid
+import threading
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+# Formato -> (formato e subtipo do soundfile, extensão, mimetype)
+RENDITION_FORMATS = {
+    'opus': ('OGG', 'OPUS', '.opus', 'audio/ogg; codecs=opus'),
+    'mp3': ('MP3', 'MPEG_LAYER_III', '.mp3', 'audio/mpeg'),
+    'flac': ('FLAC', 'PCM_16', '.flac', 'audio/flac'),
+}
+
+# Ordem de preferência na negociação pelo cabeçalho Accept
+RENDITION_MIMETYPES = (
+    ('audio/ogg', 'opus'),
+    ('audio/opus', 'opus'),
+    ('audio/mpeg', 'mp3'),
+    ('audio/mp3', 'mp3'),
+    ('audio/flac', 'flac'),
+    ('audio/x-flac', 'flac'),
+    ('audio/wav', 'wav'),
+    ('audio/x-wav', 'wav'),
+)
+
+# Opus só aceita estas taxas: o resto é reamostrado para 48kHz
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+OPUS_TARGET_RATE = 48000
+
+RENDITION_BLOCK_SIZE = 65536
+
+# Uma conversão por arquivo de cada vez (requisições simultâneas esperam a primeira)
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def negotiate_format(requested=None, accept=None):
+    """
+    Formato da versão servida: parâmetro `format` da URL ou, se o cliente listar tipos de
+    áudio explicitamente, o melhor do Accept. Sem nenhum dos dois, 'wav' (arquivo original).
+    `accept` é o request.accept_mimetypes do Flask.
+    """
+    if requested:
+        requested = requested.lower()
+        return requested if requested in RENDITION_FORMATS or requested == 'wav' else None
+
+    if accept:
+        best = None
+        for mimetype, fmt in RENDITION_MIMETYPES:
+            # Só tipos listados explicitamente (*/* e audio/* não escolhem formato)
+            quality = max((q for value, q in accept if value == mimetype), default=0)
+            if quality > 0 and (best is None or quality > best[0]):
+                best = (quality, fmt)
+        if best:
+            return best[1]
+    return 'wav'
+
+
+def rendition_path(audio_path, version, fmt):
+    return f"{audio_path}.{version}{RENDITION_FORMATS[fmt][2]}"
+
+
+def _lock_for(path):
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def _remove_stale(audio_path, keep, ext):
+    # Versões comprimidas de conteúdos anteriores do mesmo áudio
+    for path in glob.glob(glob.escape(audio_path) + '.*' + ext):
+        if path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def encode_rendition(audio_path, output_path, fmt, block_size=RENDITION_BLOCK_SIZE):
+    """
+    Converte audio_path para o formato comprimido, em blocos, gravando de forma atômica
+    """
+    sf_format, subtype, ext, _ = RENDITION_FORMATS[fmt]
+    tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+
+    try:
+        with sf.SoundFile(audio_path) as infile:
+            sample_rate = infile.samplerate
+            channels = infile.channels
+            resampler = None
+            out_rate = sample_rate
+            if fmt == 'opus' and sample_rate not in OPUS_SAMPLE_RATES:
+                out_rate = OPUS_TARGET_RATE
+                resampler = soxr.ResampleStream(sample_rate, out_rate, channels, dtype='float32')
+
+            with sf.SoundFile(tmp_path, 'w', samplerate=out_rate, channels=channels,
+                              format=sf_format, subtype=subtype) as outfile:
+                blocks = infile.blocks(blocksize=block_size, dtype='float32', always_2d=True)
+                for block in blocks:
+                    if resampler is not None:
+                        block = resampler.resample_chunk(block)
+                    if len(block):
+                        outfile.write(block)
+                if resampler is not None:
+                    tail = resampler.resample_chunk(np.zeros((0, channels), dtype=np.float32), last=True)
+                    if len(tail):
+                        outfile.write(tail)
+
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output_path
+
+
+def get_rendition(audio_path, version, fmt):
+    """
+    Caminho da versão comprimida de `audio_path` na versão `version`, gerando-a se ainda não existir
+    """
+    path = rendition_path(audio_path, version, fmt)
+    if os.path.exists(path):
+        return path
+
+    with _lock_for(path):
+        if not os.path.exists(path):
+            encode_rendition(audio_path, path, fmt)
+            _remove_stale(audio_path, path, RENDITION_FORMATS[fmt][2])
+    with _locks_guard:
+        _locks.pop(path, None)
+    return path
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Retenção e coleta de lixo de uploads/ e static/results/.
+
+Os arquivos de uma sessão (`{session}_target.wav`, `{session}_reference.wav`,
+`mastered_{session}.wav` e seus sidecars) são removidos juntos quando a
+sessão passa da idade máxima, quando o dono passa da sua cota ou quando o
+total passa do limite global (as mais antigas saem primeiro). Blobs e
+resultados sem nenhuma sessão ligada a eles, exportações, features de análise
+e PNGs de waveform antigos também são coletados. Arquivos antigos no nível superior de uploads/ são
+migrados para os subdiretórios por hash.
+
+Roda em segundo plano no app (RetentionSweeper) ou pela linha de comando:
+
+    python retention.py [--dry-run] [--max-age-hours N] [--user-quota-mb N]
+"""
+
+import os
+import re
+import time
+import argparse
+import threading
+
+import db
+from content_store import (UPLOAD_FOLDER, BLOB_DIR, RESULT_DIR, EXPORT_DIR, FEATURE_DIR, is_shard_dir,
+                           primary_name, upload_path)
+
+WAVEFORM_RESULTS_DIR = os.path.join('static', 'results')
+
+# Idade máxima de uma sessão desde o último uso (mtime mais recente dos seus arquivos)
+RETENTION_MAX_AGE_HOURS = float(os.environ.get('RETENTION_MAX_AGE_HOURS', 72))
+# Cota por usuário (0 = sem cota); exceções por usuário no formato "id:mb,id:mb"
+RETENTION_USER_QUOTA_MB = float(os.environ.get('RETENTION_USER_QUOTA_MB', 2048))
+RETENTION_USER_QUOTAS_MB = os.environ.get('RETENTION_USER_QUOTAS_MB', '')
+# Limite global de uploads/ (0 = sem limite)
+RETENTION_MAX_TOTAL_MB = float(os.environ.get('RETENTION_MAX_TOTAL_MB', 0))
+# Intervalo do sweeper em segundo plano (0 = desativado)
+RETENTION_SWEEP_INTERVAL = float(os.environ.get('RETENTION_SWEEP_INTERVAL', 3600))
+
+# Blobs sem sessão ligada só são removidos depois deste tempo (um upload pode
+# estar prestes a criar o link)
+ORPHAN_GRACE_SECONDS = 10 * 60
+
+_MB = 1024 * 1024
+_SESSION_RE = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def parse_user_quotas(value):
+    """
+    "12:4096,15:0" -> {12: 4096.0, 15: 0.0}
+    """
+    quotas = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        user_id, _, megabytes = item.partition(':')
+        try:
+            quotas[int(user_id)] = float(megabytes)
+        except ValueError:
+            print(f"Cota de usuário inválida ignorada: {item}")
+    return quotas
+
+
+class RetentionPolicy:
+    """
+    Políticas de idade, cota por usuário e tamanho total
+    """
+
+    def __init__(self, max_age_hours=RETENTION_MAX_AGE_HOURS, user_quota_mb=RETENTION_USER_QUOTA_MB,
+                 user_quotas_mb=None, max_total_mb=RETENTION_MAX_TOTAL_MB):
+        self.max_age_seconds = max_age_hours * 3600
+        self.user_quota_bytes = int(user_quota_mb * _MB)
+        if user_quotas_mb is None:
+            user_quotas_mb = parse_user_quotas(RETENTION_USER_QUOTAS_MB)
+        self.user_quotas_bytes = {user_id: int(mb * _MB) for user_id, mb in user_quotas_mb.items()}
+        self.max_total_bytes = int(max_total_mb * _MB)
+
+    def quota_for(self, user_id):
+        return self.user_quotas_bytes.get(user_id, self.user_quota_bytes)
+
+
+def _scan_dir(path):
+    try:
+        with os.scandir(path) as entries:
+            return list(entries)
+    except FileNotFoundError:
+        return []
+
+
+def scan_uploads(folder=UPLOAD_FOLDER):
+    """
+    Uma varredura de uploads/ e dos shards: lista de (caminho, nome, tamanho, mtime, legado)
+    """
+    files = []
+    for entry in _scan_dir(folder):
+        if entry.is_file():
+            if not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                files.append((entry.path, entry.name, stat.st_size, stat.st_mtime, True))
+        elif is_shard_dir(entry.name) and entry.is_dir():
+            for shard_entry in _scan_dir(entry.path):
+                if shard_entry.is_file() and not shard_entry.name.endswith('.tmp'):
+                    stat = shard_entry.stat()
+                    files.append((shard_entry.path, shard_entry.name, stat.st_size, stat.st_mtime, False))
+    return files
+
+
+def migrate_legacy_files(files, dry_run=False):
+    """
+    Move arquivos de sessão do nível superior de uploads/ para o seu shard
+    """
+    migrated = []
+    for path, name, size, mtime, legacy in files:
+        if legacy and _SESSION_RE.search(name):
+            new_path = path if dry_run else _move_to_shard(path, name)
+            migrated.append((new_path, name, size, mtime, False))
+        else:
+            migrated.append((path, name, size, mtime, legacy))
+    return migrated
+
+
+def _move_to_shard(path, name):
+    new_path = upload_path(name)
+    try:
+        os.replace(path, new_path)
+        return new_path
+    except OSError as e:
+        print(f"Não foi possível migrar {path}: {str(e)}")
+        return path
+
+
+def group_sessions(files):
+    """
+    {session_id: {'paths': [...], 'names': [...], 'bytes': n, 'last_used': mtime}}
+    """
+    sessions = {}
+    for path, name, size, mtime, _ in files:
+        match = _SESSION_RE.search(primary_name(name))
+        if not match:
+            continue
+        group = sessions.setdefault(match.group(0), {'paths': [], 'names': [], 'bytes': 0, 'last_used': 0.0})
+        group['paths'].append(path)
+        group['names'].append(name)
+        group['bytes'] += size
+        group['last_used'] = max(group['last_used'], mtime)
+    return sessions
+
+
+def session_owners(session_ids):
+    """
+    {session_id: user_id} a partir de mastered_songs, em consultas por lote
+    """
+    owners = {}
+    if not session_ids or not db.has_table('mastered_songs'):
+        return owners
+    session_ids = list(session_ids)
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        for start in range(0, len(session_ids), db.DELETE_BATCH_SIZE):
+            batch = session_ids[start:start + db.DELETE_BATCH_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(f'SELECT session_id, user_id FROM mastered_songs WHERE session_id IN ({placeholders})', batch)
+            owners.update(cursor.fetchall())
+    return owners
+
+
+def select_expired(sessions, owners, policy, now):
+    """
+    Sessões a remover: por idade, depois por cota do dono, depois pelo limite total
+    (sempre as usadas há mais tempo primeiro)
+    """
+    expired = set()
+    if policy.max_age_seconds > 0:
+        limit = now - policy.max_age_seconds
+        expired.update(sid for sid, group in sessions.items() if group['last_used'] < limit)
+
+    by_user = {}
+    for sid, group in sessions.items():
+        if sid not in expired and sid in owners:
+            by_user.setdefault(owners[sid], []).append(sid)
+    for user_id, user_sessions in by_user.items():
+        quota = policy.quota_for(user_id)
+        if quota <= 0:
+            continue
+        # A sessão mais recente nunca sai por cota: o usuário pode estar usando-a agora
+        newest_first = sorted(user_sessions, key=lambda s: sessions[s]['last_used'], reverse=True)
+        used = sessions[newest_first[0]]['bytes']
+        for sid in newest_first[1:]:
+            used += sessions[sid]['bytes']
+            if used > quota:
+                expired.add(sid)
+
+    if policy.max_total_bytes > 0:
+        remaining = sorted((sid for sid in sessions if sid not in expired), key=lambda s: sessions[s]['last_used'])
+        total = sum(sessions[sid]['bytes'] for sid in remaining)
+        for sid in remaining:
+            if total <= policy.max_total_bytes:
+                break
+            expired.add(sid)
+            total -= sessions[sid]['bytes']
+
+    return expired
+
+
+def _remove(path, dry_run):
+    try:
+        size = os.path.getsize(path)
+        if not dry_run:
+            os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+def collect_unlinked(folder, min_age_seconds, now, dry_run=False):
+    """
+    Remove blobs/resultados que nenhuma sessão usa mais (um único link) e que não
+    mudam de contagem de links há pelo menos `min_age_seconds`
+    """
+    removed, freed = 0, 0
+    limit = now - min_age_seconds
+    for entry in _scan_dir(folder):
+        candidates = _scan_dir(entry.path) if entry.is_dir() else [entry]
+        for candidate in candidates:
+            if not candidate.is_file() or candidate.name.endswith('.tmp'):
+                continue
+            stat = candidate.stat()
+            # st_ctime muda quando um hard link é criado ou removido
+            if stat.st_nlink == 1 and stat.st_ctime < limit:
+                freed += _remove(candidate.path, dry_run)
+                removed += 1
+    return removed, freed
+
+
+def collect_waveforms(folder, max_age_seconds, now, dry_run=False):
+    """
+    Remove PNGs de waveform não gerados nem reaproveitados há mais de `max_age_seconds`
+    """
+    removed, freed = 0, 0
+    limit = now - max_age_seconds
+    for entry in _scan_dir(folder):
+        if entry.is_file() and entry.name.endswith('.png') and entry.stat().st_mtime < limit:
+            freed += _remove(entry.path, dry_run)
+            removed += 1
+    return removed, freed
+
+
+def collect_exports(folder, max_age_seconds, now, dry_run=False):
+    """
+    Remove exportações (outros formatos do master) não geradas nem baixadas há mais de `max_age_seconds`.
+    Serve para qualquer cache em shards com o mtime como último uso (ex.: features de análise).
+    """
+    removed, freed = 0, 0
+    limit = now - max_age_seconds
+    for entry in _scan_dir(folder):
+        if not entry.is_dir():
+            continue
+        for export in _scan_dir(entry.path):
+            if export.is_file() and not export.name.endswith('.tmp') and export.stat().st_mtime < limit:
+                freed += _remove(export.path, dry_run)
+                removed += 1
+    return removed, freed
+
+
+def update_records(removed_names, dry_run=False):
+    """
+    Marca como expiradas as masterizações cujos arquivos foram removidos e apaga
+    os downloads correspondentes, em lotes
+    """
+    if not removed_names or dry_run:
+        return 0, 0
+    expired_songs = deleted_downloads = 0
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        if db.has_table('mastered_songs'):
+            expired_songs = db.execute_in_batches(
+                cursor,
+                "UPDATE mastered_songs SET status = 'expired' WHERE mastered_filename IN ({placeholders})",
+                removed_names
+            )
+        if db.has_table('downloads'):
+            deleted_downloads = db.execute_in_batches(
+                cursor, 'DELETE FROM downloads WHERE filename IN ({placeholders})', removed_names
+            )
+    return expired_songs, deleted_downloads
+
+
+def sweep(policy=None, dry_run=False, now=None):
+    """
+    Uma passada completa de retenção. Retorna as estatísticas da passada.
+    """
+    policy = policy or RetentionPolicy()
+    now = time.time() if now is None else now
+
+    files = migrate_legacy_files(scan_uploads(), dry_run)
+    sessions = group_sessions(files)
+    owners = session_owners(sessions.keys())
+    expired = select_expired(sessions, owners, policy, now)
+
+    removed_names = []
+    freed = 0
+    for sid in expired:
+        for path, name in zip(sessions[sid]['paths'], sessions[sid]['names']):
+            freed += _remove(path, dry_run)
+            removed_names.append(name)
+
+    # Com as sessões removidas, blobs e resultados podem ter ficado sem links
+    blobs_removed, blobs_freed = collect_unlinked(BLOB_DIR, ORPHAN_GRACE_SECONDS, now, dry_run)
+    results_removed, results_freed = collect_unlinked(RESULT_DIR, policy.max_age_seconds, now, dry_run)
+    waveforms_removed, waveforms_freed = collect_waveforms(WAVEFORM_RESULTS_DIR, policy.max_age_seconds, now, dry_run)
+    exports_removed, exports_freed = collect_exports(EXPORT_DIR, policy.max_age_seconds, now, dry_run)
+    features_removed, features_freed = collect_exports(FEATURE_DIR, policy.max_age_seconds, now, dry_run)
+
+    expired_songs, deleted_downloads = update_records(
+        [name for name in removed_names if primary_name(name) == name], dry_run
+    )
+
+    stats = {
+        'sessions_removed': len(expired),
+        'files_removed': len(removed_names) + blobs_removed + results_removed + waveforms_removed + exports_removed
+                         + features_removed,
+        'bytes_freed': freed + blobs_freed + results_freed + waveforms_freed + exports_freed + features_freed,
+        'songs_expired': expired_songs,
+        'downloads_removed': deleted_downloads,
+        'dry_run': dry_run
+    }
+    print(f"Retenção: {stats['sessions_removed']} sessão(ões), {stats['files_removed']} arquivo(s), "
+          f"{stats['bytes_freed'] / _MB:.1f}MB liberados{' (simulação)' if dry_run else ''}")
+    return stats
+
+
+class RetentionSweeper:
+    """
+    Executa `sweep` periodicamente em uma thread daemon
+    """
+
+    def __init__(self, interval=RETENTION_SWEEP_INTERVAL, policy=None, on_sweep=None):
+        self.interval = interval
+        self.policy = policy or RetentionPolicy()
+        self.on_sweep = on_sweep
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        print(f"Sweeper de retenção iniciado (a cada {self.interval:.0f}s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                stats = sweep(self.policy)
+                if self.on_sweep:
+                    self.on_sweep(stats)
+            except Exception as e:
+                print(f"Erro no sweeper de retenção: {str(e)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Retenção e limpeza de uploads/ e static/results/')
+    parser.add_argument('--dry-run', action='store_true', help='só mostra o que seria removido')
+    parser.add_argument('--max-age-hours', type=float, default=RETENTION_MAX_AGE_HOURS)
+    parser.add_argument('--user-quota-mb', type=float, default=RETENTION_USER_QUOTA_MB)
+    parser.add_argument('--max-total-mb', type=float, default=RETENTION_MAX_TOTAL_MB)
+    args = parser.parse_args(argv)
+
+    print("=== Retenção de arquivos ===")
+    policy = RetentionPolicy(max_age_hours=args.max_age_hours, user_quota_mb=args.user_quota_mb,
+                             max_total_mb=args.max_total_mb)
+    return sweep(policy, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Cache de estágios intermediários da cadeia de masterização.
+
+Ajustes de gain e limiter em /masterize não mudam a saída dos estágios
+anteriores (high-pass, EQ e compressor). O sinal que chega ao Gain fica em
+memória, com política LRU e limite total de bytes, indexado pelo hash do
+áudio e pelos parâmetros dos estágios que o produziram; um novo render com
+os mesmos estágios anteriores roda só do Gain em diante.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from content_store import MASTERING_PARAM_DEFAULTS
+
+# Limites padrão do cache em memória
+STAGE_CACHE_MAX_BYTES = int(os.environ.get('STAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+STAGE_CACHE_MAX_ENTRIES = int(os.environ.get('STAGE_CACHE_MAX_ENTRIES', 8))
+
+
+def stage_key(audio_hash, stage, params, chain_version, names):
+    """
+    Chave de um estágio: hash de (áudio, estágio, parâmetros `names` dos estágios até
+    ele, versão da cadeia)
+    """
+    payload = json.dumps({
+        'audio': audio_hash,
+        'stage': stage,
+        'params': {name: round(float(params.get(name, MASTERING_PARAM_DEFAULTS[name])), 2) for name in names},
+        'chain': chain_version
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class StageCache:
+    """
+    Cache LRU de saídas de estágios (float32, canais x frames) com orçamento total de bytes
+    """
+
+    def __init__(self, max_bytes=STAGE_CACHE_MAX_BYTES, max_entries=STAGE_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, key):
+        """
+        Saída em cache do estágio, ou None (sem calcular)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry['audio']
+
+    def get(self, key, compute, session_id=None):
+        """
+        Saída do estágio: do cache ou de `compute()`, guardada em seguida.
+        O array retornado é somente leitura e não deve ser modificado.
+        """
+        audio_data = self.peek(key)
+        if audio_data is not None:
+            return audio_data
+
+        audio_data = compute()
+        audio_data.setflags(write=False)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self.total_bytes -= old['nbytes']
+            if audio_data.nbytes <= self.max_bytes:
+                self._entries[key] = {
+                    'audio': audio_data,
+                    'nbytes': audio_data.nbytes,
+                    'session_id': session_id
+                }
+                self.total_bytes += audio_data.nbytes
+                self._evict_over_budget()
+
+        return audio_data
+
+    def _evict_over_budget(self):
+        # Chamado com o lock adquirido
+        while self._entries and (self.total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            _, entry = self._entries.popitem(last=False)
+            self.total_bytes -= entry['nbytes']
+
+    def evict_session(self, session_id):
+        """
+        Remove da memória os estágios calculados para uma sessão de masterização
+        """
+        if not session_id:
+            return 0
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry['session_id'] == session_id]
+            for key in keys:
+                self.total_bytes -= self._entries.pop(key)['nbytes']
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
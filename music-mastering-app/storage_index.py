@@ -0,0 +1,80 @@
+"""
+Índice em memória dos arquivos presentes em uploads/.
+
+Substitui as chamadas a os.path.exists feitas uma vez por linha do banco
+(lentas quando uploads/ é um volume de rede) por consultas a um conjunto.
+O índice é reconciliado com uma única varredura do diretório e mantido
+atualizado pelos caminhos que gravam arquivos; a varredura é refeita quando
+o índice fica mais velho que STORAGE_INDEX_MAX_AGE, para cobrir arquivos
+gravados ou removidos fora desses caminhos.
+"""
+
+import os
+import time
+import threading
+
+from content_store import UPLOAD_FOLDER, is_shard_dir
+
+STORAGE_INDEX_MAX_AGE = float(os.environ.get('STORAGE_INDEX_MAX_AGE', 300))
+
+
+class StorageIndex:
+    """
+    Conjunto de nomes de arquivos de `folder` e dos seus shards (uploads/<ab>/)
+    """
+
+    def __init__(self, folder=UPLOAD_FOLDER, max_age=STORAGE_INDEX_MAX_AGE):
+        self.folder = folder
+        self.max_age = max_age
+        self._files = None
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+
+    def reconcile(self):
+        """
+        Refaz o índice com uma única varredura do diretório e retorna uma cópia dele
+        """
+        files = set()
+        try:
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        files.add(entry.name)
+                    elif is_shard_dir(entry.name) and entry.is_dir():
+                        with os.scandir(entry.path) as shard_entries:
+                            files.update(shard.name for shard in shard_entries if shard.is_file())
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._files = files
+            self._scanned_at = time.monotonic()
+            return set(files)
+
+    def _ensure_fresh(self):
+        if self._files is None or time.monotonic() - self._scanned_at > self.max_age:
+            self.reconcile()
+
+    def add(self, path):
+        """
+        Registra um arquivo recém-gravado (nome ou caminho dentro de uploads/)
+        """
+        with self._lock:
+            if self._files is not None:
+                self._files.add(os.path.basename(path))
+
+    def discard(self, path):
+        with self._lock:
+            if self._files is not None:
+                self._files.discard(os.path.basename(path))
+
+    def exists(self, filename):
+        if not filename:
+            return False
+        self._ensure_fresh()
+        with self._lock:
+            return filename in self._files
+
+    def snapshot(self):
+        self._ensure_fresh()
+        with self._lock:
+            return set(self._files)
@@ -0,0 +1,122 @@
+"""
+Motor de masterização em blocos para arquivos muito longos.
+
+O arquivo é lido em blocos de tamanho fixo com soundfile, passa por uma
+Pedalboard com estado (reset=False, para o compressor/limiter continuarem
+entre blocos) e é escrito direto em disco. O pico de memória depende só do
+tamanho do bloco, não da duração da faixa.
+"""
+
+import os
+
+import numpy as np
+import soundfile as sf
+
+from normalization import PeakNormalizer
+
+# Tamanho do bloco em frames (~1,5s a 44.1kHz)
+STREAM_BLOCK_SIZE = 65536
+
+
+def process_block(board, block, sample_rate, block_size):
+    # Completar o último bloco com silêncio: blocos muito curtos (ex.: 2 frames)
+    # deixam ambíguo para a Pedalboard qual eixo é o de canais
+    frames = block.shape[0]
+    if frames < block_size:
+        block = np.concatenate([block, np.zeros((block_size - frames, block.shape[1]), dtype=block.dtype)])
+
+    processed = board(np.ascontiguousarray(block.T), sample_rate, reset=False)
+    return processed[:, :frames]
+
+
+def stream_process_file(input_path, output_path, board, block_size=STREAM_BLOCK_SIZE,
+                        progress=None, inputs=(), outputs=()):
+    """
+    Processa input_path em blocos pela board e grava a saída em float, sem normalizar
+    (ex.: a primeira passada da masterização ou o sinal intermediário de um estágio).
+    Cada acumulador em `inputs` recebe o bloco lido e cada um em `outputs` o bloco
+    processado, ambos (canais, frames). Retorna (sample_rate, canais, frames).
+    """
+    with sf.SoundFile(input_path) as infile:
+        sample_rate = infile.samplerate
+        channels = infile.channels
+        total_frames = infile.frames
+
+        board.reset()
+        done = 0
+        with sf.SoundFile(output_path, 'w', samplerate=sample_rate, channels=channels,
+                          format='WAV', subtype='FLOAT') as out:
+            for block in infile.blocks(blocksize=block_size, dtype='float32', always_2d=True):
+                processed = process_block(board, block, sample_rate, block_size)
+                out.write(processed.T)
+
+                for accumulator in inputs:
+                    accumulator.add(block.T)
+                for accumulator in outputs:
+                    accumulator.add(processed)
+
+                done += block.shape[0]
+                if progress and total_frames:
+                    progress(done / total_frames)
+
+    return sample_rate, channels, done
+
+
+def stream_master_file(input_path, output_path, board, block_size=STREAM_BLOCK_SIZE,
+                       subtype='PCM_16', progress=None, input_peaks=None, output_peaks=None,
+                       output_meter=None, final_gain=None):
+    """
+    Masteriza input_path em blocos e grava o resultado em output_path.
+
+    Primeira passada: processa cada bloco e grava em um arquivo float temporário,
+    medindo o pico. Segunda passada: aplica a normalização e grava o arquivo final.
+    `progress(fração)` é chamado ao longo do processamento, se fornecido, e
+    `input_peaks`/`output_peaks` (PeakPyramidBuilder) e `output_meter`
+    (LoudnessMeter) recebem cada bloco.
+    `final_gain(ganho)`, se fornecido, recebe o ganho da normalização ao fim da
+    primeira passada e devolve o ganho aplicado na segunda (ex.: o trim do modo
+    alvo de loudness, calculado a partir de `output_meter`).
+    Picos e medição de saída são anteriores à normalização: aplicar `info['gain']`.
+    """
+    temp_path = output_path + '.part.wav'
+    final_tmp_path = output_path + '.tmp.wav'
+    normalizer = PeakNormalizer()
+
+    try:
+        sample_rate, channels, done = stream_process_file(
+            input_path, temp_path, board, block_size,
+            progress=(lambda fraction: progress(0.9 * fraction)) if progress else None,
+            inputs=[input_peaks] if input_peaks is not None else [],
+            outputs=[acc for acc in (normalizer, output_peaks, output_meter) if acc is not None]
+        )
+
+        # Segunda passada: normalização suave aplicada na escrita final
+        gain = normalizer.gain
+        if final_gain is not None:
+            gain = final_gain(gain)
+        if gain == 1.0 and subtype == 'FLOAT':
+            # Nada a normalizar nem converter: o temporário já é o arquivo final
+            os.replace(temp_path, output_path)
+        else:
+            with sf.SoundFile(temp_path) as tmp, \
+                    sf.SoundFile(final_tmp_path, 'w', samplerate=sample_rate, channels=channels,
+                                 format='WAV', subtype=subtype) as out:
+                for block in tmp.blocks(blocksize=block_size, dtype='float32', always_2d=True):
+                    if gain != 1.0:
+                        np.multiply(block, gain, out=block)
+                    out.write(block)
+            os.replace(final_tmp_path, output_path)
+        if progress:
+            progress(1.0)
+
+        return {
+            'sample_rate': sample_rate,
+            'channels': channels,
+            'frames': done,
+            'peak': normalizer.peak * gain,
+            'gain': gain
+        }
+    finally:
+        for path in (temp_path, final_tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
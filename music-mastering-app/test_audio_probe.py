@@ -0,0 +1,59 @@
+"""
+Testes do probe de formato dos uploads
+"""
+
+import io
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from audio_probe import AudioProbe, UploadError, detect_format
+
+
+def encoded(format, sample_rate=44100, channels=2, seconds=1.5, subtype=None):
+    buffer = io.BytesIO()
+    sf.write(buffer, np.zeros((int(sample_rate * seconds), channels), dtype=np.float32), sample_rate,
+             format=format, subtype=subtype)
+    return buffer.getvalue()
+
+
+def probe_chunks(data, chunk_size):
+    probe = AudioProbe(total_size=len(data))
+    for start in range(0, len(data), chunk_size):
+        probe.feed(data[start:start + chunk_size])
+    return probe.finish()
+
+
+@pytest.mark.parametrize('chunk_size', [7, 4096, 1 << 20])
+def test_wav_header(chunk_size):
+    result = probe_chunks(encoded('WAV', 48000, 2, subtype='PCM_16'), chunk_size)
+    assert result['format'] == 'wav'
+    assert (result['sample_rate'], result['channels']) == (48000, 2)
+    assert result['duration'] == pytest.approx(1.5)
+
+
+def test_flac_header():
+    result = probe_chunks(encoded('FLAC', 44100, 1), 4096)
+    assert result == {'format': 'flac', 'sample_rate': 44100, 'channels': 1, 'duration': pytest.approx(1.5)}
+
+
+def test_other_formats_are_detected_without_details():
+    assert detect_format(b'OggS' + bytes(8)) == 'ogg'
+    assert detect_format(b'ID3\x04' + bytes(8)) == 'mp3'
+    assert detect_format(b'FORM\x00\x00\x00\x00AIFF') == 'aiff'
+    assert detect_format(b'%PDF-1.7\n' + bytes(8)) is None
+
+
+def test_non_audio_is_rejected_on_the_first_chunk():
+    probe = AudioProbe()
+    with pytest.raises(UploadError) as error:
+        probe.feed(b'<html><body>not audio</body></html>')
+    assert error.value.status == 415
+
+
+def test_upload_too_short_to_identify_is_rejected():
+    probe = AudioProbe()
+    probe.feed(b'RIFF')
+    with pytest.raises(UploadError):
+        probe.finish()
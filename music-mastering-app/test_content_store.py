@@ -0,0 +1,102 @@
+"""
+Testes do armazenamento por conteúdo: hash, deduplicação, layout em shards e cache de resultados
+"""
+
+import hashlib
+import io
+import os
+
+import pytest
+
+import content_store
+from audio_probe import UploadError
+from content_store import (store_stream, content_hash, upload_path, find_upload, shard_name, primary_name,
+                           is_shard_dir, result_key, store_result, restore_result, HASH_SUFFIX, SHARD_WIDTH)
+
+
+@pytest.fixture(autouse=True)
+def uploads_dir(tmp_path, monkeypatch):
+    # Os diretórios do armazenamento são relativos ao diretório atual
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / content_store.UPLOAD_FOLDER
+
+
+def test_content_hash_is_sha256_and_follows_changes():
+    path = upload_path('s1_target.wav')
+    with open(path, 'wb') as f:
+        f.write(b'audio' * 1000)
+    assert content_hash(path) == hashlib.sha256(b'audio' * 1000).hexdigest()
+    assert os.path.exists(path + HASH_SUFFIX)
+
+    with open(path, 'wb') as f:
+        f.write(b'other')
+    os.utime(path, (os.path.getmtime(path) + 10,) * 2)
+    assert content_hash(path) == hashlib.sha256(b'other').hexdigest()
+
+
+def test_identical_uploads_share_one_blob():
+    data = os.urandom(300000)
+    first = upload_path('s1_target.wav')
+    second = upload_path('s2_target.wav')
+    digest = store_stream(io.BytesIO(data), first, chunk_size=65536)
+    assert store_stream(io.BytesIO(data), second) == digest == hashlib.sha256(data).hexdigest()
+
+    blob = os.path.join(content_store.BLOB_DIR, digest[:SHARD_WIDTH], digest + '.wav')
+    assert os.path.samefile(first, blob) and os.path.samefile(second, blob)
+    assert content_hash(second) == digest
+    assert not [name for name in os.listdir(content_store.BLOB_DIR) if name.endswith('.tmp')]
+
+
+def test_upload_over_the_limit_leaves_nothing_behind():
+    with pytest.raises(UploadError) as error:
+        store_stream(io.BytesIO(bytes(5000)), upload_path('s1_target.wav'), chunk_size=1000, max_bytes=3000)
+    assert error.value.status == 413
+    assert not os.path.exists(find_upload('s1_target.wav'))
+    assert os.listdir(content_store.BLOB_DIR) == []
+
+
+def test_session_files_and_sidecars_share_a_shard(uploads_dir):
+    assert primary_name('s1_target.wav.npy') == 's1_target.wav'
+    assert primary_name('mastered_s1.wav.peaks') == 'mastered_s1.wav'
+    shard = shard_name('s1_target.wav')
+    assert is_shard_dir(shard)
+    assert shard_name('s1_target.wav.npy') == shard_name('s1_target.wav.sha256') == shard
+
+    path = upload_path('s1_target.wav')
+    assert path == os.path.join(content_store.UPLOAD_FOLDER, shard, 's1_target.wav')
+    assert os.path.isdir(uploads_dir / shard)
+
+
+def test_find_upload_falls_back_to_the_legacy_location(uploads_dir):
+    uploads_dir.mkdir(exist_ok=True)
+    (uploads_dir / 'old_target.wav').write_bytes(b'x')
+    assert find_upload('old_target.wav') == os.path.join(content_store.UPLOAD_FOLDER, 'old_target.wav')
+    assert find_upload('new_target.wav') == os.path.join(content_store.UPLOAD_FOLDER, shard_name('new_target.wav'),
+                                                         'new_target.wav')
+
+
+def test_result_key_normalizes_params():
+    key = result_key('a' * 64, {'gain_db': 1.2}, 'v1')
+    assert result_key('a' * 64, {'gain_db': '1.2000001', 'compressor_ratio': 1.8}, 'v1') == key
+    assert result_key('a' * 64, {'gain_db': 1.3}, 'v1') != key
+    assert result_key('a' * 64, {'gain_db': 1.2}, 'v2') != key
+    assert result_key('a' * 64, {'gain_db': 1.2}, 'v1', mode='streaming') != key
+    assert result_key('a' * 64, {'gain_db': 1.2, 'target_lufs': -14}, 'v1') != key
+
+
+def test_result_round_trip_with_sidecars():
+    mastered = upload_path('mastered_s1.wav')
+    with open(mastered, 'wb') as f:
+        f.write(b'master')
+    for suffix in ('.peaks', '.loudness'):
+        with open(mastered + suffix, 'wb') as f:
+            f.write(suffix.encode())
+
+    key = result_key(content_hash(mastered), {}, 'v1')
+    restored = upload_path('mastered_s2.wav')
+    assert not restore_result(key, restored)
+    store_result(key, mastered)
+    assert restore_result(key, restored)
+    assert os.path.samefile(restored, mastered)
+    with open(restored + '.loudness', 'rb') as f:
+        assert f.read() == b'.loudness'
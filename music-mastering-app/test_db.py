@@ -75,5 +75,83 @@ def test_database():
         print(f"Traceback: {traceback.format_exc()}")
         return False
 
+# Esquema de mastered_songs antes da medição de loudness (users.db da versão original)
+BASELINE_MASTERED_SONGS = '''
+    CREATE TABLE mastered_songs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        session_id TEXT NOT NULL,
+        original_filename TEXT NOT NULL,
+        mastered_filename TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        status TEXT DEFAULT 'completed'
+    )
+'''
+
+def insert_song(conn, loudness_db=-14.0):
+    import db
+    columns = ', '.join(db.LOUDNESS_COLUMNS)
+    conn.execute(f'''
+        INSERT INTO mastered_songs (user_id, session_id, original_filename, mastered_filename, {columns})
+        VALUES (?, ?, ?, ?{', ?' * len(db.LOUDNESS_COLUMNS)})
+    ''', (1, 's1', 's1_target.wav', 'mastered_s1.wav') + (loudness_db,) * len(db.LOUDNESS_COLUMNS))
+
+def test_pool_migrates_baseline_schema(tmp_path):
+    import db
+    path = str(tmp_path / 'users.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute(BASELINE_MASTERED_SONGS)
+
+    pool = db.ConnectionPool(path, size=2)
+    conn = pool.acquire()
+    insert_song(conn)
+    conn.commit()
+    assert conn.execute('SELECT integrated_lufs FROM mastered_songs').fetchone() == (-14.0,)
+    pool.release(conn)
+
+def test_init_database_migrates_baseline_schema(tmp_path, monkeypatch):
+    import db
+    from init_db import init_database
+    monkeypatch.chdir(tmp_path)
+    with sqlite3.connect('users.db') as conn:
+        conn.execute(BASELINE_MASTERED_SONGS)
+
+    assert init_database()
+    with sqlite3.connect('users.db') as conn:
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(mastered_songs)')]
+        assert set(db.LOUDNESS_COLUMNS) <= set(columns)
+        insert_song(conn)
+        # Idempotente: rodar de novo não tenta recriar as colunas
+        db.add_missing_columns(conn.cursor())
+
+def test_pool_reuses_connections_and_resets_after_fork(tmp_path, monkeypatch):
+    import db
+    pool = db.ConnectionPool(str(tmp_path / 'users.db'), size=1)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+
+    # Processo filho: as conexões do pai não voltam para o pool nem são reaproveitadas
+    pool.release(conn)
+    monkeypatch.setattr(db.os, 'getpid', lambda: -1)
+    child_conn = pool.acquire()
+    assert child_conn is not conn
+    pool.release(child_conn)
+    assert pool.acquire() is child_conn
+
+def test_execute_in_batches(tmp_path):
+    import db
+    conn = sqlite3.connect(str(tmp_path / 'users.db'))
+    conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY)')
+    conn.executemany('INSERT INTO items (id) VALUES (?)', [(i,) for i in range(1, 1201)])
+    statements = []
+    conn.set_trace_callback(statements.append)
+    cursor = conn.cursor()
+
+    assert db.delete_by_ids(cursor, 'items', range(1, 1101), batch_size=500) == 1100
+    assert len([sql for sql in statements if sql.startswith('DELETE')]) == 3
+    assert conn.execute('SELECT COUNT(*) FROM items').fetchone() == (100,)
+    assert db.execute_in_batches(cursor, 'DELETE FROM items WHERE id IN ({placeholders})', []) == 0
+
 if __name__ == "__main__":
     test_database()
@@ -0,0 +1,88 @@
+"""
+Testes da medição de loudness (BS.1770 / EBU R128) com sinais de valor conhecido
+"""
+
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from loudness import LoudnessMeter, load_or_measure_loudness, loudness_path, album_target_loudness
+
+
+def sine(sample_rate, freq, amplitude_db, seconds=10.0, phase=0.0):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    return (10 ** (amplitude_db / 20) * np.sin(2 * np.pi * freq * t + phase)).astype(np.float32)
+
+
+@pytest.mark.parametrize('sample_rate', [44100, 48000])
+def test_stereo_1khz_sine_reads_its_level_in_lufs(sample_rate):
+    # EBU Tech 3341: seno de 1 kHz a -23 dBFS nos dois canais = -23 LUFS
+    tone = sine(sample_rate, 1000, -23.0)
+    meter = LoudnessMeter(sample_rate, true_peak=True)
+    meter.add(np.stack([tone, tone]))
+    report = meter.report()
+    assert report['integrated_lufs'] == pytest.approx(-23.0, abs=0.1)
+    assert report['short_term_max_lufs'] == pytest.approx(-23.0, abs=0.1)
+    assert report['momentary_max_lufs'] == pytest.approx(-23.0, abs=0.1)
+    assert report['loudness_range_lu'] == pytest.approx(0.0, abs=0.1)
+    assert report['sample_peak_dbfs'] == pytest.approx(-23.0, abs=0.05)
+    assert report['true_peak_dbtp'] == pytest.approx(-23.0, abs=0.1)
+
+
+def test_single_channel_is_3db_below_stereo():
+    tone = sine(48000, 1000, -23.0)
+    meter = LoudnessMeter(48000)
+    meter.add(tone[np.newaxis, :])
+    assert meter.result()['loudness_db'] == pytest.approx(-26.01, abs=0.1)
+
+
+def test_true_peak_finds_the_inter_sample_peak():
+    # fs/4 com fase de 45°: as amostras ficam em ±0.707 (-3.01 dBFS), o pico real em 0 dBTP
+    tone = sine(48000, 12000, 0.0, seconds=2.0, phase=np.pi / 4)
+    meter = LoudnessMeter(48000, true_peak=True)
+    meter.add(np.stack([tone, tone]))
+    report = meter.report()
+    assert report['sample_peak_dbfs'] == pytest.approx(-3.01, abs=0.05)
+    assert report['true_peak_dbtp'] == pytest.approx(0.0, abs=0.2)
+
+
+def test_block_wise_measurement_matches_whole_signal():
+    tone = np.stack([sine(44100, 1000, -18.0), sine(44100, 440, -24.0)])
+    whole = LoudnessMeter(44100, true_peak=True)
+    whole.add(tone)
+    blocks = LoudnessMeter(44100, true_peak=True)
+    for start in range(0, tone.shape[1], 7777):
+        blocks.add(tone[:, start:start + 7777])
+    assert blocks.report() == whole.report()
+
+
+def test_absolute_gate_ignores_silence_and_gain_shifts_report():
+    tone = sine(48000, 1000, -23.0)
+    signal = np.concatenate([tone, np.zeros_like(tone)])
+    meter = LoudnessMeter(48000)
+    meter.add(np.stack([signal, signal]))
+    assert meter.report()['integrated_lufs'] == pytest.approx(-23.0, abs=0.1)
+    # Ganho aplicado depois da medição: +6 dB em todos os níveis
+    assert meter.report(gain=10 ** (6 / 20))['integrated_lufs'] == pytest.approx(-17.0, abs=0.1)
+
+
+def test_loudness_sidecar_round_trip(tmp_path):
+    path = str(tmp_path / 'master.wav')
+    tone = sine(44100, 1000, -23.0, seconds=5.0)
+    sf.write(path, np.stack([tone, tone], axis=1), 44100, subtype='FLOAT')
+
+    measured = load_or_measure_loudness(path)
+    assert measured['integrated_lufs'] == pytest.approx(-23.0, abs=0.1)
+    assert load_or_measure_loudness(path) == measured
+    assert os.path.exists(loudness_path(path))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_album_target_is_the_mean_of_audible_tracks():
+    target, targets = album_target_loudness([-20.0, -10.0, None, -150.0])
+    assert target == -15.0
+    assert targets == [-15.0, -15.0, None, None]
+    assert album_target_loudness([-20.0, -10.0], target_db=-14)[1] == [-14.0, -14.0]
+    assert album_target_loudness([None]) == (None, [None])
@@ -0,0 +1,98 @@
+"""
+Testes do modo alvo de loudness: busca do drive, calibração do proxy e validação
+"""
+
+import numpy as np
+import pytest
+
+from loudness_target import (solve_drive, solve_target, solve_loudness_gain, parse_loudness_target,
+                             calibration_ranges, CalibrationBuilder, TARGET_TOLERANCE_DB, TARGET_MAX_ITERATIONS,
+                             TARGET_CALIBRATION_SLICES, TARGET_CALIBRATION_SLICE_SECONDS)
+
+
+def limiter_plr(gain_db):
+    # PLR de um limiter: cai rápido com o drive e satura em 6 dB
+    return 6.0 + 10.0 * np.exp(-gain_db / 4.0)
+
+
+def test_solve_drive_converges_to_the_smallest_gain_within_goal():
+    evaluations = []
+
+    def plr_at(gain_db):
+        evaluations.append(gain_db)
+        return limiter_plr(gain_db)
+
+    gain_db = solve_drive(plr_at, 0.0, 9.0)
+    # A tolerância é no PLR: o alvo é alcançado sem limitar mais do que o necessário
+    assert 9.0 - TARGET_TOLERANCE_DB <= limiter_plr(gain_db) <= 9.0
+    assert len(evaluations) <= TARGET_MAX_ITERATIONS + 2
+
+
+def test_solve_drive_returns_base_when_goal_already_met():
+    assert solve_drive(limiter_plr, 2.0, 20.0) == 2.0
+
+
+def test_solve_drive_does_not_stall_at_the_lower_bracket():
+    # PLR logo acima do alvo até 10 dB de drive e bem abaixo depois: a secante volta
+    # sempre ao limite inferior, que já está dentro da tolerância
+    def plr_at(gain_db):
+        return 8.05 if gain_db < 10.0 else -2.0
+
+    gain_db = solve_drive(plr_at, 0.0, 8.0)
+    assert gain_db < TARGET_TOLERANCE_DB
+
+
+def test_solve_drive_reuses_known_evaluations():
+    known = {}
+    first = solve_drive(limiter_plr, 0.0, 9.0, known)
+    evaluations = len(known)
+    assert solve_drive(limiter_plr, 0.0, 9.0, known) == first
+    assert len(known) == evaluations
+
+
+def test_solve_target_applies_the_calibration_offset():
+    # O proxy mede 0.5 dB a menos de PLR do que a taxa completa
+    gain_db, offset, _ = solve_target(limiter_plr, 0.0, 9.0, lambda gain_db: 0.5)
+    assert offset == 0.5
+    assert limiter_plr(gain_db) + offset == pytest.approx(9.0, abs=TARGET_TOLERANCE_DB)
+
+
+def test_solve_loudness_gain_reaches_the_goal():
+    # Loudness do master: sobe 1 dB por dB de ganho até o limiter, depois 0.2 dB
+    def loudness_at(gain_db):
+        return -20.0 + min(gain_db, 6.0) + 0.2 * max(gain_db - 6.0, 0.0)
+
+    gain_db, offset, _ = solve_loudness_gain(loudness_at, -13.0, (-12.0, 12.0))
+    assert offset == 0.0
+    assert loudness_at(gain_db) == pytest.approx(-13.0, abs=TARGET_TOLERANCE_DB)
+
+    gain_db, offset, _ = solve_loudness_gain(loudness_at, -13.0, (-12.0, 12.0), lambda gain_db: 1.0)
+    assert offset == 1.0
+    assert loudness_at(gain_db) + offset == pytest.approx(-13.0, abs=TARGET_TOLERANCE_DB)
+
+
+def test_parse_loudness_target():
+    assert parse_loudness_target({}) == {}
+    assert parse_loudness_target({'target_lufs': '-14'}) == {'target_lufs': -14.0, 'max_true_peak': -1.0}
+    with pytest.raises(ValueError):
+        parse_loudness_target({'target_lufs': '-60'})
+    with pytest.raises(ValueError):
+        parse_loudness_target({'target_lufs': 'alto'})
+
+
+@pytest.mark.parametrize('seconds', [5, 60])
+def test_calibration_builder_matches_calibration_ranges(seconds):
+    sample_rate = 8000
+    rng = np.random.default_rng(1)
+    signal = (rng.standard_normal((2, sample_rate * seconds)) * rng.uniform(0.1, 1.0, seconds).repeat(sample_rate)
+              ).astype(np.float32)
+    expected = np.concatenate([signal[:, start:end] for start, end
+                               in calibration_ranges(signal, sample_rate, sample_rate, signal.shape[1])], axis=1)
+
+    builder = CalibrationBuilder(sample_rate, 2)
+    for start in range(0, signal.shape[1], 3000):
+        builder.add(signal[:, start:start + 3000])
+    excerpt = builder.build()
+    np.testing.assert_array_equal(excerpt, expected)
+    if seconds > TARGET_CALIBRATION_SLICES * TARGET_CALIBRATION_SLICE_SECONDS:
+        assert excerpt.shape[1] == TARGET_CALIBRATION_SLICES * TARGET_CALIBRATION_SLICE_SECONDS * sample_rate
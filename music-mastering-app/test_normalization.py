@@ -0,0 +1,40 @@
+"""
+Testes da normalização de pico em duas passadas
+"""
+
+import numpy as np
+import pytest
+
+from normalization import PeakNormalizer, normalize_in_place, peak_abs, NORMALIZATION_TARGET_PEAK
+
+
+def test_peak_abs():
+    assert peak_abs(np.array([[0.2, -0.7], [0.5, 0.1]], dtype=np.float32)) == pytest.approx(0.7)
+    assert peak_abs(np.zeros((2, 0), dtype=np.float32)) == 0.0
+
+
+def test_normalize_in_place_reuses_the_buffer():
+    audio = np.array([[0.5, -2.0, 1.0]], dtype=np.float32)
+    result = normalize_in_place(audio)
+    assert result is audio
+    assert peak_abs(audio) == pytest.approx(NORMALIZATION_TARGET_PEAK)
+
+
+def test_quiet_signal_is_left_untouched():
+    audio = np.array([[0.1, -0.5]], dtype=np.float32)
+    original = audio.copy()
+    normalize_in_place(audio)
+    np.testing.assert_array_equal(audio, original)
+
+
+def test_block_wise_passes_match_the_whole_signal():
+    rng = np.random.default_rng(0)
+    audio = (rng.standard_normal((2, 10000)) * 0.8).astype(np.float32)
+    expected = normalize_in_place(audio.copy())
+
+    normalizer = PeakNormalizer()
+    blocks = [audio[:, start:start + 1024].copy() for start in range(0, audio.shape[1], 1024)]
+    for block in blocks:
+        normalizer.observe(block)
+    output = np.concatenate([normalizer.apply(block) for block in blocks], axis=1)
+    np.testing.assert_array_equal(output, expected)
@@ -0,0 +1,34 @@
+"""
+Testes do balanço espectral usado na análise da referência
+"""
+
+import warnings
+
+import numpy as np
+import pytest
+
+from reference_analysis import SpectrumAccumulator
+
+
+def noise(sample_rate, seconds=2.0, seed=0):
+    mono = np.random.default_rng(seed).standard_normal(int(sample_rate * seconds)).astype(np.float32)
+    return np.stack([mono, mono])
+
+
+@pytest.mark.parametrize('sample_rate', [8000, 11025, 22050, 44100])
+def test_band_balance_is_finite_at_any_sample_rate(sample_rate):
+    spectrum = SpectrumAccumulator()
+    spectrum.add(noise(sample_rate))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        low_db, high_db = spectrum.band_balance(sample_rate)
+    assert np.isfinite(low_db) and np.isfinite(high_db)
+    # Ruído branco: energia por bin parecida em todas as bandas
+    assert abs(low_db) < 3 and abs(high_db) < 3
+
+
+def test_band_balance_empty_band_is_zero():
+    # Espectro tão curto que nenhuma banda tem bins
+    spectrum = SpectrumAccumulator(size=8, hop=4)
+    spectrum.add(noise(8000, seconds=0.01))
+    assert spectrum.band_balance(8000) == (0.0, 0.0)
@@ -0,0 +1,88 @@
+"""
+Testes da pirâmide de picos do waveform (cálculo em blocos e sidecar binário)
+"""
+
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from waveform_peaks import (PeakPyramid, PeakPyramidBuilder, build_peaks, load_or_build_peaks, peaks_path,
+                            PEAKS_BASE_BIN, PEAKS_LEVEL_FACTOR, PEAKS_MIN_POINTS)
+
+
+def signal(frames=200000, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.uniform(-1, 1, (2, frames)) * np.linspace(0.1, 0.9, frames)).astype(np.float32)
+
+
+def assert_same_levels(pyramid, other, atol=0.0):
+    assert len(pyramid.levels) == len(other.levels)
+    for (mins, maxs), (other_mins, other_maxs) in zip(pyramid.levels, other.levels):
+        np.testing.assert_allclose(mins, other_mins, atol=atol)
+        np.testing.assert_allclose(maxs, other_maxs, atol=atol)
+
+
+def test_levels_reduce_by_factor_down_to_min_points():
+    audio = signal()
+    pyramid = build_peaks(audio, 44100)
+    assert pyramid.total_frames == audio.shape[1]
+    assert len(pyramid.levels[0][0]) == -(-audio.shape[1] // PEAKS_BASE_BIN)
+    assert len(pyramid.levels[-1][0]) <= PEAKS_MIN_POINTS
+    for level in range(1, len(pyramid.levels)):
+        assert len(pyramid.levels[level][0]) == -(-len(pyramid.levels[level - 1][0]) // PEAKS_LEVEL_FACTOR)
+    # O nível mais grosseiro ainda contém o pico do sinal inteiro
+    assert pyramid.levels[-1][1].max() == audio.max()
+    assert pyramid.levels[-1][0].min() == audio.min()
+
+
+def test_block_wise_builder_matches_whole_signal():
+    audio = signal()
+    builder = PeakPyramidBuilder(44100)
+    for start in range(0, audio.shape[1], 3001):
+        builder.add(audio[:, start:start + 3001])
+    assert_same_levels(builder.build(), build_peaks(audio, 44100))
+
+
+def test_sidecar_round_trip(tmp_path):
+    pyramid = build_peaks(signal(), 48000)
+    path = str(tmp_path / 'track.wav.peaks')
+    pyramid.save(path)
+    loaded = PeakPyramid.load(path)
+
+    assert (loaded.sample_rate, loaded.total_frames, loaded.base_bin, loaded.factor) == \
+        (48000, pyramid.total_frames, pyramid.base_bin, pyramid.factor)
+    # Picos gravados em 16 bits
+    assert_same_levels(loaded, pyramid, atol=1.0 / 32767)
+    assert os.listdir(tmp_path) == ['track.wav.peaks']
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'bad.peaks'
+    path.write_bytes(b'RIFF' + bytes(64))
+    with pytest.raises(ValueError):
+        PeakPyramid.load(str(path))
+
+
+def test_load_or_build_peaks_writes_and_reuses_sidecar(tmp_path):
+    audio = signal(50000)
+    audio_path = str(tmp_path / 'track.wav')
+    sf.write(audio_path, audio.T, 44100, subtype='FLOAT')
+
+    built = load_or_build_peaks(audio_path)
+    assert os.path.exists(peaks_path(audio_path))
+    assert_same_levels(built, build_peaks(audio, 44100))
+    assert_same_levels(load_or_build_peaks(audio_path), built, atol=1.0 / 32767)
+
+
+def test_scale_and_json_payload():
+    pyramid = build_peaks(signal(20000), 44100)
+    peak = pyramid.levels[0][1].max()
+    pyramid.scale(0.5)
+    assert pyramid.levels[0][1].max() == pytest.approx(peak * 0.5)
+
+    payload = pyramid.to_json(0)
+    assert payload['samples_per_pixel'] == PEAKS_BASE_BIN
+    assert payload['length'] * 2 == len(payload['data'])
+    assert max(payload['data']) <= 32767 and min(payload['data']) >= -32767
@@ -0,0 +1,251 @@
+"""
+Pirâmide de picos min/max em várias resoluções para desenhar waveforms.
+
+A pirâmide é calculada uma vez por arquivo de áudio, com reduções vetorizadas
+do NumPy, e gravada em um sidecar binário compacto (`.peaks`) ao lado do
+áudio. O front-end desenha o waveform em um <canvas> a partir desses picos.
+"""
+
+import os
+import struct
+import uuid
+
+import numpy as np
+import soundfile as sf
+
+PEAKS_SUFFIX = '.peaks'
+PEAKS_MAGIC = b'PEAK'
+PEAKS_VERSION = 1
+
+# Cabeçalho: magic, versão, sample rate, frames, amostras por pico (nível 0), fator, nº de níveis
+_HEADER = struct.Struct('<4sHIQIHH')
+_LEVEL_HEADER = struct.Struct('<I')
+
+# Nível 0: um par min/max a cada 512 amostras; cada nível acima reduz 4x
+PEAKS_BASE_BIN = 512
+PEAKS_LEVEL_FACTOR = 4
+PEAKS_MIN_POINTS = 256
+
+# Picos guardados como int16 (escala de 16 bits, igual ao formato do audiowaveform)
+_SCALE = 32767
+
+
+def peaks_path(audio_path):
+    """
+    Caminho do sidecar de picos ao lado do arquivo de áudio
+    """
+    return audio_path + PEAKS_SUFFIX
+
+
+class PeakPyramid:
+    """
+    Níveis de picos (mins, maxs) do mais detalhado (nível 0) para o mais grosseiro
+    """
+
+    def __init__(self, sample_rate, total_frames, base_bin, factor, levels):
+        self.sample_rate = sample_rate
+        self.total_frames = total_frames
+        self.base_bin = base_bin
+        self.factor = factor
+        self.levels = levels
+
+    def samples_per_peak(self, level):
+        return self.base_bin * (self.factor ** level)
+
+    def level_for_points(self, points):
+        """
+        Nível mais grosseiro que ainda tem pelo menos `points` picos
+        """
+        for level in range(len(self.levels) - 1, -1, -1):
+            if len(self.levels[level][0]) >= points:
+                return level
+        return 0
+
+    def scale(self, gain):
+        """
+        Aplica um ganho a todos os níveis (ex.: normalização feita depois do streaming)
+        """
+        if gain != 1.0:
+            for mins, maxs in self.levels:
+                mins *= gain
+                maxs *= gain
+        return self
+
+    def interleaved(self, level):
+        """
+        Picos do nível intercalados [min0, max0, min1, max1, ...]
+        """
+        mins, maxs = self.levels[level]
+        data = np.empty(len(mins) * 2, dtype=np.float32)
+        data[0::2] = mins
+        data[1::2] = maxs
+        return data
+
+    def to_signal(self, max_points=25000):
+        """
+        Retorna (sinal, taxa) para o fallback em PNG (generate_*_waveform)
+        """
+        level = self.level_for_points(max_points // 2)
+        return self.interleaved(level), 2.0 * self.sample_rate / self.samples_per_peak(level)
+
+    def to_json(self, level):
+        """
+        Payload no estilo do formato JSON do audiowaveform (picos inteiros de 16 bits)
+        """
+        data = np.clip(np.round(self.interleaved(level) * _SCALE), -_SCALE, _SCALE).astype(np.int16)
+        return {
+            'version': PEAKS_VERSION,
+            'channels': 1,
+            'sample_rate': self.sample_rate,
+            'samples_per_pixel': self.samples_per_peak(level),
+            'bits': 16,
+            'length': len(data) // 2,
+            'duration': self.total_frames / self.sample_rate if self.sample_rate else 0,
+            'data': data.tolist()
+        }
+
+    def save(self, path):
+        """
+        Grava o sidecar binário (escrita atômica)
+        """
+        # Nome único: dois workers podem gravar o mesmo sidecar ao mesmo tempo
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(_HEADER.pack(PEAKS_MAGIC, PEAKS_VERSION, int(self.sample_rate), int(self.total_frames),
+                                     self.base_bin, self.factor, len(self.levels)))
+                for level in range(len(self.levels)):
+                    data = np.clip(np.round(self.interleaved(level) * _SCALE), -_SCALE, _SCALE).astype('<i2')
+                    f.write(_LEVEL_HEADER.pack(len(data) // 2))
+                    f.write(data.tobytes())
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            raw = f.read()
+        magic, version, sample_rate, total_frames, base_bin, factor, num_levels = _HEADER.unpack_from(raw, 0)
+        if magic != PEAKS_MAGIC or version != PEAKS_VERSION:
+            raise ValueError(f'Sidecar de picos inválido: {path}')
+
+        offset = _HEADER.size
+        levels = []
+        for _ in range(num_levels):
+            (count,) = _LEVEL_HEADER.unpack_from(raw, offset)
+            offset += _LEVEL_HEADER.size
+            data = np.frombuffer(raw, dtype='<i2', count=count * 2, offset=offset).astype(np.float32) / _SCALE
+            offset += count * 4
+            levels.append((data[0::2].copy(), data[1::2].copy()))
+        return cls(sample_rate, total_frames, base_bin, factor, levels)
+
+
+class PeakPyramidBuilder:
+    """
+    Calcula o nível 0 bloco a bloco (serve para o motor de streaming) e monta os
+    níveis superiores no final
+    """
+
+    def __init__(self, sample_rate, base_bin=PEAKS_BASE_BIN, factor=PEAKS_LEVEL_FACTOR):
+        self.sample_rate = sample_rate
+        self.base_bin = base_bin
+        self.factor = factor
+        self.total_frames = 0
+        self._mins = []
+        self._maxs = []
+        self._carry_min = np.zeros(0, dtype=np.float32)
+        self._carry_max = np.zeros(0, dtype=np.float32)
+
+    def add(self, block):
+        """
+        Adiciona um bloco mono (frames,) ou multicanal (canais, frames)
+        """
+        block = np.asarray(block, dtype=np.float32)
+        if block.ndim == 2:
+            lower = block.min(axis=0)
+            upper = block.max(axis=0)
+        else:
+            lower = upper = block
+        self.total_frames += len(lower)
+
+        if len(self._carry_min):
+            lower = np.concatenate([self._carry_min, lower])
+            upper = np.concatenate([self._carry_max, upper])
+
+        usable = (len(lower) // self.base_bin) * self.base_bin
+        if usable:
+            self._mins.append(lower[:usable].reshape(-1, self.base_bin).min(axis=1))
+            self._maxs.append(upper[:usable].reshape(-1, self.base_bin).max(axis=1))
+        self._carry_min = lower[usable:]
+        self._carry_max = upper[usable:]
+
+    def build(self):
+        mins = list(self._mins)
+        maxs = list(self._maxs)
+        if len(self._carry_min):
+            mins.append(np.array([self._carry_min.min()], dtype=np.float32))
+            maxs.append(np.array([self._carry_max.max()], dtype=np.float32))
+        if not mins:
+            mins = maxs = [np.zeros(1, dtype=np.float32)]
+
+        level_min = np.concatenate(mins)
+        level_max = np.concatenate(maxs)
+        levels = [(level_min, level_max)]
+
+        # Cada nível reduz o anterior por `factor`, com min de mins e max de maxs
+        while len(level_min) > PEAKS_MIN_POINTS:
+            pad = (-len(level_min)) % self.factor
+            if pad:
+                level_min = np.concatenate([level_min, np.repeat(level_min[-1:], pad)])
+                level_max = np.concatenate([level_max, np.repeat(level_max[-1:], pad)])
+            level_min = level_min.reshape(-1, self.factor).min(axis=1)
+            level_max = level_max.reshape(-1, self.factor).max(axis=1)
+            levels.append((level_min, level_max))
+
+        return PeakPyramid(self.sample_rate, self.total_frames, self.base_bin, self.factor, levels)
+
+
+def build_peaks(audio_data, sample_rate):
+    """
+    Pirâmide de picos de um sinal completo em memória
+    """
+    builder = PeakPyramidBuilder(sample_rate)
+    builder.add(audio_data)
+    return builder.build()
+
+
+def build_peaks_from_file(audio_path, block_size=65536):
+    """
+    Pirâmide de picos lendo o arquivo em blocos (memória limitada)
+    """
+    try:
+        with sf.SoundFile(audio_path) as f:
+            builder = PeakPyramidBuilder(f.samplerate)
+            for block in f.blocks(blocksize=block_size, dtype='float32', always_2d=True):
+                builder.add(block.T)
+        return builder.build()
+    except RuntimeError:
+        # Formato que o soundfile não lê
+        from audio_io import read_audio
+        audio_data, sample_rate = read_audio(audio_path)
+        return build_peaks(audio_data, sample_rate)
+
+
+def save_peaks(audio_path, pyramid):
+    pyramid.save(peaks_path(audio_path))
+    return pyramid
+
+
+def load_or_build_peaks(audio_path):
+    """
+    Lê o sidecar de picos se estiver atualizado; senão calcula a partir do arquivo e grava
+    """
+    path = peaks_path(audio_path)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(audio_path):
+            return PeakPyramid.load(path)
+    except (OSError, ValueError, struct.error):
+        pass
+    return save_peaks(audio_path, build_peaks_from_file(audio_path))